@@ -0,0 +1,171 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from db import connection, transaction
+from query_cache import bump
+
+# Stored as 'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>', so the work factor can be
+# raised later and older hashes are upgraded at their next login
+SCHEME = 'pbkdf2_sha256'
+ITERATIONS = int(os.environ.get('BOOKHIVE_PBKDF2_ITERATIONS', 260000))
+SALT_BYTES = 16
+# Key derivation runs on these threads; hashlib releases the GIL while it works
+AUTH_WORKERS = int(os.environ.get('BOOKHIVE_AUTH_WORKERS', os.cpu_count() or 2))
+# Recent successful logins are checked again without a database round trip or key derivation
+SESSION_TTL = float(os.environ.get('BOOKHIVE_AUTH_CACHE_TTL', 300))
+SESSION_CACHE_SIZE = int(os.environ.get('BOOKHIVE_AUTH_CACHE_SIZE', 1024))
+
+# role -> (table, ID column); both ID columns are UNIQUE, so lookups are a single index probe
+ROLES = {'student': ('students', 'student_id'), 'admin': ('librarystaff', 'employee_id')}
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='bookhive-auth')
+# Cached sessions hold a digest keyed by this per-process secret, never the password itself
+_session_key = secrets.token_bytes(32)
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_dummy_hash = None
+
+
+def hash_password(password, iterations=None, salt=None):
+    iterations = iterations or ITERATIONS
+    salt = salt or secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{SCHEME}${iterations}${salt.hex()}${digest.hex()}'
+
+
+def hash_many(passwords):
+    return list(_executor.map(hash_password, passwords))
+
+
+def is_hashed(stored):
+    return str(stored).startswith(SCHEME + '$')
+
+
+def verify_password(password, stored):
+    # Returns (matches, needs_rehash). A plaintext value written before the migration still
+    # verifies, and is replaced by a hash on that login.
+    if stored is None:
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(str(stored).encode(), password.encode()), True
+    _, iterations, salt, digest = stored.split('$')
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest), int(iterations) != ITERATIONS
+
+
+def _session_digest(password):
+    return hmac.new(_session_key, password.encode(), 'sha256').digest()
+
+
+def _cached_session(role, user_id, name, password):
+    key = (role, user_id)
+    with _sessions_lock:
+        entry = _sessions.get(key)
+        if entry is None:
+            return None
+        expires, cached_name, digest = entry
+        if expires < time.monotonic():
+            del _sessions[key]
+            return None
+        _sessions.move_to_end(key)
+    if cached_name == name and hmac.compare_digest(digest, _session_digest(password)):
+        return user_id, name
+    return None
+
+
+def _remember(role, user_id, name, password):
+    with _sessions_lock:
+        _sessions[(role, user_id)] = (time.monotonic() + SESSION_TTL, name, _session_digest(password))
+        _sessions.move_to_end((role, user_id))
+        while len(_sessions) > SESSION_CACHE_SIZE:
+            _sessions.popitem(last=False)
+
+
+def forget(role, user_id):
+    with _sessions_lock:
+        _sessions.pop((role, user_id), None)
+
+
+def clear_sessions():
+    with _sessions_lock:
+        _sessions.clear()
+
+
+def session_stats():
+    with _sessions_lock:
+        return {'sessions': len(_sessions), 'capacity': SESSION_CACHE_SIZE, 'ttl': SESSION_TTL}
+
+
+def _lookup(role, user_id):
+    table, id_column = ROLES[role]
+    with connection() as conn:
+        return conn.execute(f'SELECT name, password FROM {table} WHERE {id_column} = ?', (user_id,)).fetchone()
+
+
+def _verify(role, user_id, name, password):
+    global _dummy_hash
+    row = _lookup(role, user_id)
+    if row is None:
+        # Spend the same work as a real check, so an unknown ID answers no faster than a wrong password
+        _dummy_hash = _dummy_hash or hash_password(secrets.token_hex(8))
+        verify_password(password, _dummy_hash)
+        return None
+    stored_name, stored = row
+    matches, needs_rehash = verify_password(password, stored)
+    if not matches or stored_name != name:
+        return None
+    if needs_rehash:
+        _store(role, user_id, hash_password(password), stored)
+    _remember(role, user_id, name, password)
+    return user_id, stored_name
+
+
+def authenticate_async(role, user_id, name, password):
+    # Resolves to (user_id, name) or None; only a cache miss reaches the database and worker pool
+    session = _cached_session(role, user_id, name, password)
+    if session is not None:
+        future = Future()
+        future.set_result(session)
+        return future
+    return _executor.submit(_verify, role, user_id, name, password)
+
+
+def authenticate(role, user_id, name, password, timeout=None):
+    return authenticate_async(role, user_id, name, password).result(timeout)
+
+
+def _store(role, user_id, stored, previous=None):
+    table, id_column = ROLES[role]
+    query = f'UPDATE {table} SET password = ? WHERE {id_column} = ?'
+    params = [stored, user_id]
+    if previous is not None:
+        # Upgrading on login: leave the row alone if the password changed meanwhile
+        query += ' AND password = ?'
+        params.append(previous)
+    with transaction() as conn:
+        updated = conn.execute(query, params).rowcount
+        bump(table)
+    return updated == 1
+
+
+def register(role, user_id, name, password):
+    # Raises sqlite3.IntegrityError if the ID is taken
+    table, id_column = ROLES[role]
+    stored = _executor.submit(hash_password, password).result()
+    with transaction() as conn:
+        conn.execute(f'INSERT INTO {table} ({id_column}, name, password) VALUES (?, ?, ?)', (user_id, name, stored))
+        bump(table)
+    forget(role, user_id)
+
+
+def set_password(role, user_id, password):
+    stored = _executor.submit(hash_password, password).result()
+    updated = _store(role, user_id, stored)
+    forget(role, user_id)
+    return updated
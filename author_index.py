@@ -0,0 +1,183 @@
+import argparse
+import json
+
+import pandas as pd
+
+import db
+from db import connection
+
+BATCH_SIZE = 5000
+BOOK_COLUMNS = 'b.bookID, b.title, b.authors, b.average_rating, b.language_code, b.ratings_count, b.publisher'
+# Appended to a name key to make the exclusive upper bound of a prefix range
+KEY_MAX = '\U0010ffff'
+
+
+def normalize_name(name):
+    # Display form with whitespace folded, and the case-insensitive key the indexes use
+    display = ' '.join(str(name).split())
+    return display, display.casefold()
+
+
+def split_authors(authors):
+    # books.csv joins co-authors with '/'; the same name twice on one book counts once
+    names = {}
+    for part in str(authors or '').split('/'):
+        display, key = normalize_name(part)
+        if key and key not in names:
+            names[key] = display
+    return names
+
+
+def create_triggers(cursor):
+    # Any write that adds, removes or re-attributes a book queues it for sync_author_index
+    events = {
+        'author_index_ai': ('AFTER INSERT ON books', 'new'),
+        'author_index_ad': ('AFTER DELETE ON books', 'old'),
+        'author_index_au': ('AFTER UPDATE OF authors, publisher ON books', 'new'),
+    }
+    for name, (event, row) in events.items():
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+            INSERT OR IGNORE INTO author_index_queue(book_id) VALUES ({row}.bookID);
+        END''')
+
+
+def _ids(cursor, table, id_column, names):
+    # Upserts display names by key and returns key -> id
+    cursor.executemany(f'''
+    INSERT INTO {table} (name, name_key) VALUES (?, ?) ON CONFLICT(name_key) DO NOTHING
+    ''', [(display, key) for key, display in names.items()])
+    rows = cursor.execute(f'''
+    SELECT name_key, {id_column} FROM {table} WHERE name_key IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(names)),))
+    return dict(rows.fetchall())
+
+
+def sync_author_index(conn):
+    # Reindexes the queued books. Runs in the caller's transaction; the caller commits.
+    cursor = conn.cursor()
+    synced = 0
+    while True:
+        queued = [row[0] for row in cursor.execute(
+            'SELECT book_id FROM author_index_queue ORDER BY book_id LIMIT ?', (BATCH_SIZE,))]
+        if not queued:
+            break
+        batch = json.dumps(queued)
+        books = cursor.execute('''
+        SELECT bookID, authors, publisher FROM books WHERE bookID IN (SELECT value FROM json_each(?))
+        ''', (batch,)).fetchall()
+        previous = [row[0] for row in cursor.execute('''
+        SELECT DISTINCT author_id FROM book_authors WHERE book_id IN (SELECT value FROM json_each(?))
+        ''', (batch,))]
+        cursor.execute('DELETE FROM book_authors WHERE book_id IN (SELECT value FROM json_each(?))', (batch,))
+
+        book_names = [(book_id, split_authors(authors)) for book_id, authors, _ in books]
+        author_names = {key: display for _, names in book_names for key, display in names.items()}
+        author_ids = _ids(cursor, 'authors', 'author_id', author_names)
+        cursor.executemany('INSERT INTO book_authors (author_id, book_id, position) VALUES (?, ?, ?)', [
+            (author_ids[key], book_id, position)
+            for book_id, names in book_names for position, key in enumerate(names)])
+
+        publishers = {book_id: normalize_name(publisher) for book_id, _, publisher in books if publisher is not None}
+        publisher_ids = _ids(cursor, 'publishers', 'publisher_id',
+                             {key: display for display, key in publishers.values() if key})
+        cursor.executemany('UPDATE books SET publisher_id = ? WHERE bookID = ?', [
+            (publisher_ids.get(publishers[book_id][1]) if book_id in publishers else None, book_id)
+            for book_id, _, _ in books])
+
+        # Names left without a book (renamed, deleted) drop out of lookups
+        cursor.execute('''
+        DELETE FROM authors WHERE author_id IN (SELECT value FROM json_each(?))
+          AND NOT EXISTS (SELECT 1 FROM book_authors ba WHERE ba.author_id = authors.author_id)
+        ''', (json.dumps(previous),))
+        cursor.execute('DELETE FROM author_index_queue WHERE book_id IN (SELECT value FROM json_each(?))', (batch,))
+        synced += len(queued)
+    if synced:
+        cursor.execute('''
+        DELETE FROM publishers
+        WHERE NOT EXISTS (SELECT 1 FROM books b WHERE b.publisher_id = publishers.publisher_id)
+        ''')
+    return synced
+
+
+def _name_lookup(table, id_column, count_sql, name, prefix, limit):
+    _, key = normalize_name(name)
+    if not key:
+        return pd.DataFrame(columns=[id_column, 'name', 'books'])
+    # Exact and prefix lookups are both ranges on the unique name_key index
+    where = 'name_key >= ? AND name_key < ?' if prefix else 'name_key = ?'
+    params = [key, key + KEY_MAX] if prefix else [key]
+    with connection() as conn:
+        return pd.read_sql_query(f'''
+        SELECT {id_column}, name, ({count_sql}) AS books
+        FROM {table} WHERE {where}
+        ORDER BY name_key
+        LIMIT ?
+        ''', conn, params=[*params, limit])
+
+
+def find_authors(name, prefix=False, limit=20):
+    return _name_lookup('authors', 'author_id', '''
+    SELECT COUNT(*) FROM book_authors ba WHERE ba.author_id = authors.author_id
+    ''', name, prefix, limit)
+
+
+def find_publishers(name, prefix=False, limit=20):
+    return _name_lookup('publishers', 'publisher_id', '''
+    SELECT COUNT(*) FROM books b WHERE b.publisher_id = publishers.publisher_id
+    ''', name, prefix, limit)
+
+
+def books_by_author(author_id, limit=None, offset=0):
+    with connection() as conn:
+        return pd.read_sql_query(f'''
+        SELECT {BOOK_COLUMNS}
+        FROM book_authors ba
+        JOIN books b ON b.bookID = ba.book_id
+        WHERE ba.author_id = ?
+        ORDER BY b.average_rating DESC, b.bookID
+        LIMIT ? OFFSET ?
+        ''', conn, params=[int(author_id), -1 if limit is None else limit, offset])
+
+
+def books_by_publisher(publisher_id, limit=None, offset=0):
+    with connection() as conn:
+        return pd.read_sql_query(f'''
+        SELECT {BOOK_COLUMNS}
+        FROM books b
+        WHERE b.publisher_id = ?
+        ORDER BY b.average_rating DESC, b.bookID
+        LIMIT ? OFFSET ?
+        ''', conn, params=[int(publisher_id), -1 if limit is None else limit, offset])
+
+
+def author_stats(author_ids):
+    # One row per author: catalog size, mean rating, Goodreads ratings and lifetime loans.
+    # Each author's books come from book_authors and their loans from idx_loans_book.
+    with connection() as conn:
+        return pd.read_sql_query('''
+        SELECT a.author_id, a.name, COUNT(*) AS books, AVG(b.average_rating) AS mean_rating,
+               SUM(b.ratings_count) AS ratings_count,
+               SUM((SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = b.bookID)) AS loans,
+               SUM(b.copies - b.available_copies) AS on_loan
+        FROM authors a
+        JOIN book_authors ba ON ba.author_id = a.author_id
+        JOIN books b ON b.bookID = ba.book_id
+        WHERE a.author_id IN (SELECT value FROM json_each(?))
+        GROUP BY a.author_id
+        ORDER BY a.name_key
+        ''', conn, params=[json.dumps([int(author_id) for author_id in author_ids])])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up authors in the normalized author index.')
+    parser.add_argument('name')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--prefix', action='store_true', help='match names starting with NAME')
+    args = parser.parse_args()
+    db.configure(args.db)
+    found = find_authors(args.name, prefix=args.prefix)
+    if found.empty:
+        print('No matching authors')
+    else:
+        print(author_stats(found['author_id'].tolist()).to_string(index=False))
@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog
+import db
+from query_cache import bump, estimate_size
+from synthetic import SIZES, dataset
+
+# What a session keeps after paging through a few screens of search results
+RESULT_PAGES = 3
+
+
+def legacy_frame():
+    # What every session used to build: the fetch_books() tuples as a plain DataFrame
+    with db.connection() as conn:
+        rows = conn.execute(f"SELECT {', '.join(catalog.CATALOG_COLUMNS)} FROM books").fetchall()
+    return rows, pd.DataFrame(rows, columns=catalog.CATALOG_COLUMNS)
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def mb(size):
+    return f'{size / 1024 / 1024:9.2f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-session memory of the catalog: per-session frames vs the shared compact frame.')
+    parser.add_argument('size', nargs='?', choices=SIZES, default='small')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='measure this database instead of a synthetic one')
+    parser.add_argument('--sessions', type=int, default=50)
+    args = parser.parse_args()
+
+    db.configure(args.db or dataset(args.data_dir, args.size, args.seed)[0])
+    rows, legacy = legacy_frame()
+    per_session_before = frame_bytes(legacy)
+    object_dtype = frame_bytes(legacy.astype(object))
+
+    started = time.perf_counter()
+    shared = catalog.shared_frame()
+    build = time.perf_counter() - started
+    shared_size = frame_bytes(shared)
+    page_ids = shared['bookID'].head(RESULT_PAGES * 12).tolist()
+    per_session_after = estimate_size([page_ids[i:i + 12] for i in range(0, len(page_ids), 12)])
+
+    # Concurrent sessions all get the same object
+    seen, lock = [], threading.Lock()
+
+    def session():
+        frame = catalog.shared_frame()
+        with lock:
+            seen.append(id(frame))
+
+    threads = [threading.Thread(target=session) for _ in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{len(shared)} books, {args.sessions} sessions")
+    print(f"  fetch_books() tuples (shared through the query cache): {mb(estimate_size(rows))}")
+    print(f"  per-session DataFrame, default dtypes:                {mb(per_session_before)}")
+    print(f"  per-session DataFrame, object dtypes (pandas < 3):    {mb(object_dtype)}")
+    print(f"  shared compact frame, once per process:               {mb(shared_size)}  (built in {build:.2f}s)")
+    print(f"  per-session result IDs ({RESULT_PAGES} pages):                   {per_session_after / 1024:9.2f} KB")
+    before = per_session_before * args.sessions
+    after = shared_size + per_session_after * args.sessions
+    print(f"  {args.sessions} sessions: {mb(before).strip()} before, {mb(after).strip()} after ({before / after:.1f}x smaller)")
+    print(f"  distinct frames handed to {args.sessions} concurrent sessions: {len(set(seen))}")
+
+    print("\n  column                 before       after  dtype")
+    before_columns = legacy.memory_usage(index=False, deep=True)
+    after_columns = shared.memory_usage(index=False, deep=True)
+    for column in catalog.CATALOG_COLUMNS:
+        print(f"  {column:<16} {mb(before_columns[column])} {mb(after_columns[column])}  {shared[column].dtype}")
+
+    # An import bumps the catalog version; the next reader swaps in a fresh frame
+    bump(catalog.CATALOG_TABLE)
+    started = time.perf_counter()
+    refreshed = catalog.shared_frame()
+    print(f"\n  after a catalog bump: rebuilt={refreshed is not shared} in {time.perf_counter() - started:.2f}s")
+    db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circulation
+import db
+from migrations import migrate
+
+
+def setup(path, books, copies):
+    db.configure(path)
+    migrate()
+    with db.transaction() as conn:
+        conn.executemany('''
+        INSERT INTO books (title, authors, average_rating, language_code, ratings_count, publisher, source_key, copies, available_copies)
+        VALUES (?, 'Stress Author', 4.0, 'eng', 10, 'Stress Press', ?, ?, ?)
+        ''', [(f'Stress Book {i}', f'stress-{i}', copies, copies) for i in range(books)])
+        return [row[0] for row in conn.execute('SELECT bookID FROM books')]
+
+
+def setup_legacy(path, books, open_loans):
+    # A database from before copy counts (migration 8), with several open loans per title;
+    # migrating it must leave each title at least as many copies as it has out
+    db.configure(path)
+    migrate(target=7)
+    with db.transaction() as conn:
+        conn.executemany('''
+        INSERT INTO books (title, authors, average_rating, language_code, ratings_count, publisher, source_key)
+        VALUES (?, 'Stress Author', 4.0, 'eng', 10, 'Stress Press', ?)
+        ''', [(f'Stress Book {i}', f'stress-{i}') for i in range(books)])
+        book_ids = [row[0] for row in conn.execute('SELECT bookID FROM books')]
+        conn.executemany('''
+        INSERT INTO book_loans (student_id, book_id, loan_date) VALUES (?, ?, '2023-12-01')
+        ''', [(f'L{n:03d}', book_id) for book_id in book_ids for n in range(open_loans)])
+        loan_ids = [row[0] for row in conn.execute('SELECT loan_id FROM book_loans')]
+    migrate()
+    return book_ids, loan_ids
+
+
+def worker(number, book_ids, deadline, return_ratio, seed, totals, lock, held=()):
+    rng = random.Random(seed)
+    student = f'T{number:03d}'
+    held = list(held)
+    issued = rejected = returned = 0
+    while time.perf_counter() < deadline:
+        if held and rng.random() < return_ratio:
+            error = circulation.return_book(held.pop(rng.randrange(len(held))))
+            if error:
+                raise AssertionError(error)
+            returned += 1
+            continue
+        # Skew towards a handful of titles so threads fight over the last copies
+        book_id = book_ids[min(int(rng.paretovariate(1.0)) - 1, len(book_ids) - 1)]
+        with db.transaction() as conn:
+            loan_id, _, error = circulation.issue(conn, student, book_id, '2024-01-01')
+        if error:
+            rejected += 1
+        else:
+            issued += 1
+            held.append(loan_id)
+    with lock:
+        totals['issued'] += issued
+        totals['rejected'] += rejected
+        totals['returned'] += returned
+
+
+def check_invariants():
+    with db.connection() as conn:
+        return conn.execute('''
+        SELECT b.bookID, b.copies, b.available_copies, COUNT(bl.loan_id) AS open_loans
+        FROM books b
+        LEFT JOIN book_loans bl ON bl.book_id = b.bookID AND bl.return_date IS NULL
+        GROUP BY b.bookID
+        HAVING open_loans > b.copies OR b.available_copies != b.copies - open_loans
+        ''').fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hammer issue/return from many threads and check copy counts.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--books', type=int, default=50)
+    parser.add_argument('--copies', type=int, default=2)
+    parser.add_argument('--return-ratio', type=float, default=0.4)
+    parser.add_argument('--legacy-open-loans', type=int, default=0,
+                        help='start from a database migrated from before copy counts, with this many '
+                             'open loans per title; the threads return them as they go (--copies is ignored)')
+    parser.add_argument('--db', help='database file (default: a temporary file)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'stress.db')
+        legacy_loans, migrated = [], []
+        if args.legacy_open_loans:
+            book_ids, legacy_loans = setup_legacy(path, args.books, args.legacy_open_loans)
+            migrated = check_invariants()
+        else:
+            book_ids = setup(path, args.books, args.copies)
+        totals = {'issued': 0, 'rejected': 0, 'returned': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=worker, args=(i, book_ids, deadline, args.return_ratio, i, totals, lock,
+                                                         legacy_loans[i::args.threads]))
+                   for i in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        violations = check_invariants()
+        db.close_all()
+
+    operations = totals['issued'] + totals['rejected'] + totals['returned']
+    print(f"{args.threads} threads, {elapsed:.1f}s: {operations} operations ({operations / elapsed:.0f} ops/s)")
+    print(f"  issued {totals['issued']}, rejected (no copy left) {totals['rejected']}, returned {totals['returned']}")
+    if migrated:
+        print(f"  {len(migrated)} books have wrong copy counts right after migrating, e.g. {migrated[:5]}")
+    if violations:
+        print(f"  {len(violations)} books violate copy counts, e.g. {violations[:5]}")
+    if migrated or violations:
+        sys.exit(1)
+    print("  no double loans: every book has open loans <= copies and a matching available_copies")
+
+
+if __name__ == '__main__':
+    main()
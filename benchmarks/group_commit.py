@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circulation
+import db
+import write_queue
+from checkout_stress import check_invariants, setup
+from query_cache import bump
+
+
+def issue_direct(student_id, book_id):
+    # What issue_book does per call, keeping the loan id so the worker can return it later
+    with db.transaction() as conn:
+        loan_id, _, error = circulation.issue(conn, student_id, book_id, '2024-01-01')
+        if not error:
+            bump(*circulation.CIRCULATION_TABLES)
+    return loan_id, error
+
+
+def issue_grouped(student_id, book_id):
+    loan_id, _, error = write_queue.get_writer().submit(
+        circulation.issue, student_id, book_id, '2024-01-01', tables=circulation.CIRCULATION_TABLES).result()
+    return loan_id, error
+
+
+def worker(number, issue, book_ids, deadline, return_ratio, latencies, lock):
+    rng = random.Random(number)
+    student = f'G{number:03d}'
+    held, timings = [], []
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if held and rng.random() < return_ratio:
+            error = circulation.return_book(held.pop(rng.randrange(len(held))))
+            if error:
+                raise AssertionError(error)
+        else:
+            loan_id, error = issue(student, rng.choice(book_ids))
+            if not error:
+                held.append(loan_id)
+        timings.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(timings)
+
+
+def run(mode, durability, args, tmp):
+    path = os.path.join(tmp, f'{mode}-{durability}.db')
+    book_ids = setup(path, args.books, args.copies)
+    # Per-call commits get the same durability through the pool's synchronous setting
+    db.configure(path, synchronous=write_queue.SYNCHRONOUS[durability])
+    grouped = mode == 'group'
+    circulation.use_group_commit(grouped)
+    writer = write_queue.start(args.window_ms, durability=durability) if grouped else None
+    latencies, lock = [], threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    issue = issue_grouped if grouped else issue_direct
+    threads = [threading.Thread(target=worker, args=(i, issue, book_ids, deadline, args.return_ratio, latencies, lock))
+               for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    write_queue.shutdown()
+    circulation.use_group_commit(False)
+    violations = check_invariants()
+    db.close_all()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    line = (f"{mode:>6} {durability:>7}: {len(latencies) / elapsed:8.0f} ops/s  "
+            f"p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+    if writer:
+        stats = writer.stats
+        line += f"  {stats['groups']} commits, {stats['writes'] / max(stats['groups'], 1):.1f} writes/commit"
+    print(line)
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-call commits with the group-commit writer.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument('--copies', type=int, default=50)
+    parser.add_argument('--return-ratio', type=float, default=0.5)
+    parser.add_argument('--window-ms', type=float, default=write_queue.GROUP_WINDOW_MS)
+    parser.add_argument('--durability', nargs='+', default=['full', 'normal'], choices=list(write_queue.SYNCHRONOUS))
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for durability in args.durability:
+            for mode in ('direct', 'group'):
+                violations = run(mode, durability, args, tmp)
+                if violations:
+                    print(f"  {len(violations)} books violate copy counts, e.g. {violations[:5]}")
+                    failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circulation
+import db
+from catalog_import import CATALOG_COLUMNS, import_catalog
+
+# bookID 2 is on loan through the round trip, bookID 3 was lent and returned, bookID 4 never lent
+BOOK_IDS = [1, 2, 3, 4]
+
+
+def write_csv(path, book_ids):
+    pd.DataFrame([{'bookID': book_id, 'title': f'Round Trip {book_id}', 'authors': 'Trip Author',
+                   'average_rating': 4.0, 'language_code': 'eng', 'ratings_count': 10, 'publisher': 'Trip Press'}
+                  for book_id in book_ids], columns=['bookID'] + CATALOG_COLUMNS).to_csv(path, index=False)
+
+
+def run_import(path, book_ids):
+    write_csv(path, book_ids)
+    with db.connection() as conn:
+        return import_catalog(conn, path, force=True)
+
+
+def copy_counts():
+    with db.connection() as conn:
+        return {int(key): (copies, available) for key, copies, available in conn.execute('''
+        SELECT source_key, copies, available_copies FROM books
+        ''')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that a title dropped from books.csv and later re-added is lent again.')
+    parser.add_argument('--db', help='database file to use (default: a temporary one)')
+    args = parser.parse_args()
+
+    failures = []
+
+    def expect(label, actual, wanted):
+        if actual != wanted:
+            failures.append(f"{label}: expected {wanted}, got {actual}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(args.db or os.path.join(tmp, 'roundtrip.db'))
+        csv_path = os.path.join(tmp, 'books.csv')
+        run_import(csv_path, BOOK_IDS)
+        with db.connection() as conn:
+            ids = {int(key): book_id for book_id, key in conn.execute('SELECT bookID, source_key FROM books')}
+        _, error = circulation.issue_book('R001', ids[2])
+        expect('first loan of book 2', error, None)
+        _, error = circulation.issue_book('R001', ids[3])
+        expect('loan of book 3', error, None)
+        with db.connection() as conn:
+            returned = conn.execute('SELECT loan_id FROM book_loans WHERE book_id = ?', (ids[3],)).fetchone()[0]
+        expect('return of book 3', circulation.return_book(returned), None)
+
+        # Dropped from the file: titles with loan history are retired, the rest removed
+        stats = run_import(csv_path, [1])
+        expect('retired', stats['retired'], 2)
+        expect('removed', stats['removed'], 1)
+        counts = copy_counts()
+        expect('book 2 while retired', counts[2], (0, 0))
+        expect('book 3 while retired', counts[3], (0, 0))
+        _, error = circulation.issue_book('R002', ids[3])
+        expect('loan of a retired title refused', error is not None, True)
+
+        # Back in the file: lendable again, with the open loan still counted against book 2
+        stats = run_import(csv_path, BOOK_IDS)
+        expect('restored', stats['restored'], 2)
+        expect('added', stats['added'], 1)
+        counts = copy_counts()
+        expect('book 2 after restore', counts[2], (1, 0))
+        expect('book 3 after restore', counts[3], (1, 1))
+        _, error = circulation.issue_book('R002', ids[3])
+        expect('loan of restored book 3', error, None)
+        _, error = circulation.issue_book('R002', ids[2])
+        expect('second loan of book 2 refused while the first is out', error is not None, True)
+        with db.connection() as conn:
+            open_loan = conn.execute('''
+            SELECT loan_id FROM book_loans WHERE book_id = ? AND return_date IS NULL
+            ''', (ids[2],)).fetchone()[0]
+        expect('return of book 2', circulation.return_book(open_loan), None)
+        expect('book 2 after its return', copy_counts()[2], (1, 1))
+
+        # A second import of the same file restores nothing more
+        stats = run_import(csv_path, BOOK_IDS)
+        expect('restored on an unchanged catalog', stats['restored'], 0)
+        db.close_all()
+
+    for failure in failures:
+        print(f"  {failure}")
+    print(f"import round trip: {'FAILED' if failures else 'ok'}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of requests per scenario; issue_return is an issue followed by returning that loan
+MIX = {
+    'search': 0.35,
+    'availability_page': 0.2,
+    'book_availability': 0.1,
+    'popular': 0.1,
+    'student_recommendations': 0.1,
+    'student_loans': 0.1,
+    'issue_return': 0.05,
+}
+SEARCH_WORDS = ['dragon', 'river', 'night', 'garden', 'king', 'shadow', 'ocean', 'winter', 'secret', 'tower']
+
+
+class Client:
+    # One keep-alive HTTP/1.1 connection; enough protocol for this service's responses
+    def __init__(self, host, port, token=None):
+        self.host, self.port, self.token = host, port, token
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        headers = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(payload)}']
+        if self.token:
+            headers.append(f'Authorization: Bearer {self.token}')
+        self.writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + payload)
+        await self.writer.drain()
+        try:
+            head = await self.reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            await self.close()
+            raise ConnectionError('server closed the connection')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ')[1])
+        fields = dict(line.lower().split(': ', 1) for line in lines[1:] if line)
+        if fields.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n'))[:-2], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            data = b''.join(chunk[:-2] for chunk in chunks)
+        else:
+            data = await self.reader.readexactly(int(fields.get('content-length', 0)))
+        if fields.get('connection') == 'close':
+            await self.close()
+        return status, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def sample_ids(db_path, seed):
+    conn = sqlite3.connect(db_path)
+    try:
+        books = [row[0] for row in conn.execute('SELECT bookID FROM books ORDER BY random() LIMIT 2000')]
+        available = [row[0] for row in conn.execute(
+            'SELECT bookID FROM books WHERE available_copies > 0 ORDER BY random() LIMIT 2000')]
+        students = [row[0] for row in conn.execute('SELECT student_id FROM students ORDER BY random() LIMIT 2000')]
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    rng.shuffle(books)
+    return books, available or books, students
+
+
+async def scenario(client, name, rng, ids):
+    books, available, students = ids
+    if name == 'search':
+        return [await client.request('GET', f'/books/search?q={rng.choice(SEARCH_WORDS)}&by=title&limit=20')]
+    if name == 'availability_page':
+        return [await client.request('GET', f'/books/availability?after={rng.choice(books)}&limit=50')]
+    if name == 'book_availability':
+        return [await client.request('GET', f'/books/{rng.choice(books)}/availability')]
+    if name == 'popular':
+        return [await client.request('GET', '/recommendations/popular?n=10')]
+    if name == 'student_recommendations':
+        return [await client.request('GET', f'/students/{rng.choice(students)}/recommendations?n=5')]
+    if name == 'student_loans':
+        return [await client.request('GET', f'/students/{rng.choice(students)}/loans')]
+    issued = await client.request('POST', '/loans', {'student_id': rng.choice(students), 'book_id': rng.choice(available)})
+    if issued[0] != 201:
+        return [issued]
+    loan_id = json.loads(issued[1])['loan_id']
+    return [issued, await client.request('POST', f'/loans/{loan_id}/return')]
+
+
+async def worker(number, args, ids, deadline, latencies, statuses, failures):
+    rng = random.Random(args.seed + number)
+    names, weights = zip(*MIX.items())
+    client = Client(args.host, args.port, args.token)
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            responses = await scenario(client, name, rng, ids)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            failures[name] += 1
+            statuses[name]['error'] += 1
+            await client.close()
+            if args.verbose:
+                print(f'{name}: {e}')
+            continue
+        latencies[name].append(time.perf_counter() - started)
+        for status, _ in responses:
+            statuses[name][status] += 1
+    await client.close()
+
+
+async def wait_until_up(host, port, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        client = Client(host, port)
+        try:
+            status, _ = await client.request('GET', '/health')
+            await client.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        if time.perf_counter() > deadline:
+            raise SystemExit(f'service on {host}:{port} did not come up within {timeout}s')
+        await asyncio.sleep(0.2)
+
+
+async def run(args, ids):
+    await wait_until_up(args.host, args.port, args.startup_timeout)
+    latencies, failures = defaultdict(list), Counter()
+    statuses = defaultdict(Counter)
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    await asyncio.gather(*(worker(i, args, ids, deadline, latencies, statuses, failures)
+                           for i in range(args.concurrency)))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def report(elapsed, latencies, statuses, args):
+    scenarios = {}
+    total = 0
+    for name in MIX:
+        seconds = np.asarray(latencies.get(name, []))
+        total += len(seconds)
+        summary = {'requests': len(seconds), 'statuses': {str(k): v for k, v in sorted(statuses[name].items(), key=str)}}
+        if len(seconds):
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+            summary.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2),
+                           max_ms=round(seconds.max() * 1000, 2))
+        scenarios[name] = summary
+    result = {'seconds': round(elapsed, 2), 'concurrency': args.concurrency, 'scenarios_completed': total,
+              'throughput_per_s': round(total / elapsed, 1), 'scenarios': scenarios}
+    print(f"{args.concurrency} clients, {elapsed:.1f}s: {total} scenarios ({total / elapsed:.0f}/s)")
+    print(f'  {"scenario":26} {"count":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}  statuses')
+    for name, summary in scenarios.items():
+        print(f'  {name:26} {summary["requests"]:>7} {summary.get("p50_ms", 0):>8.1f} {summary.get("p95_ms", 0):>8.1f} '
+              f'{summary.get("p99_ms", 0):>8.1f}  {summary["statuses"]}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test a local BookHive HTTP service.')
+    parser.add_argument('--db', required=True, help='database the service uses; ids are sampled from it')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--spawn', action='store_true', help='start service.py on --db for the duration of the run')
+    parser.add_argument('--workers', type=int, default=16, help='worker threads for a spawned service')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--token', default=os.environ.get('BOOKHIVE_API_TOKEN'))
+    parser.add_argument('--startup-timeout', type=float, default=30.0)
+    parser.add_argument('--out', help='write the JSON summary here')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    ids = sample_ids(args.db, args.seed)
+    service = None
+    if args.spawn:
+        service = subprocess.Popen([sys.executable, os.path.join(ROOT, 'service.py'), '--db', args.db,
+                                    '--host', args.host, '--port', str(args.port), '--workers', str(args.workers)])
+    try:
+        elapsed, latencies, statuses = asyncio.run(run(args, ids))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+    result = report(elapsed, latencies, statuses, args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import db
+from migrations import migrate
+
+
+def setup(path, users):
+    db.configure(path)
+    migrate()
+    accounts = [(f'L{i:05d}', f'Login Student {i}', f'secret-{i}') for i in range(users)]
+    hashes = auth.hash_many([password for _, _, password in accounts])
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO students (student_id, name, password) VALUES (?, ?, ?)',
+                         [(student_id, name, stored) for (student_id, name, _), stored in zip(accounts, hashes)])
+        # The same accounts with plaintext passwords, for the old composite-key query
+        conn.execute('CREATE TABLE legacy_students AS SELECT * FROM students WHERE 0')
+        conn.executemany('INSERT INTO legacy_students (student_id, name, password) VALUES (?, ?, ?)', accounts)
+    return accounts
+
+
+def legacy_login(student_id, name, password):
+    # What check_credentials used to do: plaintext match on all three columns
+    with db.connection() as conn:
+        return conn.execute('''
+        SELECT * FROM legacy_students WHERE student_id = ? AND name = ? AND password = ?
+        ''', (student_id, name, password)).fetchone()
+
+
+def cold_login(student_id, name, password):
+    auth.forget('student', student_id)
+    return auth.authenticate('student', student_id, name, password)
+
+
+def warm_login(student_id, name, password):
+    return auth.authenticate('student', student_id, name, password)
+
+
+def worker(number, login, accounts, deadline, wrong_ratio, latencies, failures, lock):
+    rng = random.Random(number)
+    timings, failed = [], 0
+    while time.perf_counter() < deadline:
+        student_id, name, password = rng.choice(accounts)
+        wrong = rng.random() < wrong_ratio
+        started = time.perf_counter()
+        user = login(student_id, name, password + 'x' if wrong else password)
+        timings.append(time.perf_counter() - started)
+        if bool(user) == wrong:
+            failed += 1
+    with lock:
+        latencies.extend(timings)
+        failures.append(failed)
+
+
+def run(name, login, accounts, args):
+    latencies, failures, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(i, login, accounts, deadline, args.wrong_ratio, latencies, failures, lock))
+               for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:>24}: {len(latencies) / elapsed:9.0f} logins/s  p50 {p50:8.3f} ms  p99 {p99:8.3f} ms")
+    return sum(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput: plaintext lookup vs hashed, with and without the session cache.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=auth.ITERATIONS, help='PBKDF2 iterations for the test accounts')
+    parser.add_argument('--wrong-ratio', type=float, default=0.1, help='share of attempts with a wrong password')
+    args = parser.parse_args()
+
+    auth.ITERATIONS = args.iterations
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        accounts = setup(os.path.join(tmp, 'login.db'), args.users)
+        print(f"{args.users} accounts hashed at {args.iterations} iterations in {time.perf_counter() - started:.1f}s "
+              f"({auth.AUTH_WORKERS} auth workers, {args.threads} client threads)")
+        failed = run('plaintext, 3-column', legacy_login, accounts, args)
+        failed += run('hashed, no cache', cold_login, accounts, args)
+        # Steady state: every account has logged in once within the TTL
+        for account in accounts:
+            auth.authenticate('student', *account)
+        failed += run('hashed, session cache', warm_login, accounts, args)
+        db.close_all()
+    if failed:
+        print(f"  {failed} logins gave the wrong answer")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
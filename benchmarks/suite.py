@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Keep the content model built for each synthetic catalog out of the working directory
+_models = tempfile.TemporaryDirectory()
+os.environ['BOOKHIVE_MODEL_DIR'] = _models.name
+_snapshots = tempfile.TemporaryDirectory()
+os.environ['BOOKHIVE_SNAPSHOT_DIR'] = _snapshots.name
+
+import db
+import library
+import snapshots
+from catalog_import import import_catalog
+from migrations import migrate
+from policy import run_overdue_job
+from popularity import refresh_popularity
+from query_cache import clear_cache
+from rollups import date_bounds, fetch_loan_stats
+from similar_books import refresh_model
+from synthetic import SIZES, WORDS, dataset
+
+DEFAULT_REPEAT = 50
+# Cases that materialise the whole catalog or loan table; fewer repeats keep large runs bounded
+HEAVY_REPEAT = 3
+REGRESSION_THRESHOLD = 0.2
+
+
+class Context:
+    # Ids sampled once per dataset so every case draws from the same realistic pool
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        with db.connection() as conn:
+            self.book_ids = [row[0] for row in conn.execute('SELECT bookID FROM books ORDER BY random() LIMIT 1000')]
+            self.available = [row[0] for row in conn.execute('''
+            SELECT bookID FROM books WHERE available_copies > 0 ORDER BY random() LIMIT 1000
+            ''')]
+            self.students = [row[0] for row in conn.execute('SELECT student_id FROM students ORDER BY random() LIMIT 1000')]
+            self.first_day, self.last_day = date_bounds()
+
+    def book(self):
+        return self.rng.choice(self.book_ids)
+
+    def student(self):
+        return self.rng.choice(self.students)
+
+    def word(self):
+        return self.rng.choice(WORDS[6:])
+
+
+def issue_then_return(ctx):
+    # Paired so a run leaves copy counts as it found them; each pair adds one returned loan
+    student, book = ctx.student(), ctx.rng.choice(ctx.available)
+    started = time.perf_counter()
+    _, error = library.issue_book(student, book)
+    issued = time.perf_counter() - started
+    if error:
+        return {'issue_book': issued}
+    with db.connection() as conn:
+        loan_id = conn.execute('''
+        SELECT MAX(loan_id) FROM book_loans WHERE student_id = ? AND book_id = ?
+        ''', (student, book)).fetchone()[0]
+    started = time.perf_counter()
+    library.return_book(loan_id)
+    return {'issue_book': issued, 'return_book': time.perf_counter() - started}
+
+
+def bulk_issue_then_return(ctx, size=100):
+    loans = [(ctx.student(), ctx.rng.choice(ctx.available)) for _ in range(size)]
+    started = time.perf_counter()
+    results = library.issue_books(loans)
+    issued = time.perf_counter() - started
+    started = time.perf_counter()
+    library.return_books([result['loan_id'] for result in results if result['loan_id']])
+    return {f'issue_books[{size}]': issued, f'return_books[{size}]': time.perf_counter() - started}
+
+
+def issue_then_refresh(ctx):
+    # One new loan, so the refresh rewrites the catalog and that loan's month only
+    loan = library.issue_books([(ctx.student(), ctx.rng.choice(ctx.available))])[0]
+    started = time.perf_counter()
+    snapshots.refresh()
+    elapsed = time.perf_counter() - started
+    if loan['loan_id'] is not None:
+        library.return_books([loan['loan_id']])
+    return {'snapshot.refresh[incremental]': elapsed}
+
+
+# name -> (call, heavy). A call returns its result, or for paired write cases a dict of
+# case name -> seconds that it timed itself.
+CASES = {
+    'search_books[title]': (lambda ctx: library.search_books(ctx.word(), 'title'), False),
+    'search_books[authors]': (lambda ctx: library.search_books(ctx.rng.choice(['smith', 'tanaka', 'lee']), 'authors'), False),
+    'search_books[all fields]': (lambda ctx: library.search_books(f'{ctx.word()} {ctx.word()}', 'all fields'), False),
+    'search_books[fuzzy]': (lambda ctx: library.search_books(ctx.word()[:-1] + 'x', 'title'), False),
+    'search_books[average_rating]': (lambda ctx: library.search_books('4.5-4.6', 'average_rating'), False),
+    'fetch_books_availability[first page]': (lambda ctx: library.fetch_books_availability(None, library.PAGE_SIZE), False),
+    'fetch_books_availability[deep page]': (lambda ctx: library.fetch_books_availability(ctx.book(), library.PAGE_SIZE), False),
+    'fetch_books_page[rating desc]': (lambda ctx: library.fetch_books_page(None, library.PAGE_SIZE, 'average_rating', True), False),
+    'fetch_loaned_books[student]': (lambda ctx: library.fetch_loaned_books(ctx.student()), False),
+    'get_recommendations': (lambda ctx: library.get_recommendations(10), False),
+    'personal_recommendations': (lambda ctx: library.personal_recommendations(ctx.student()), False),
+    'issue_book+return_book': (issue_then_return, False),
+    'issue_books+return_books': (bulk_issue_then_return, False),
+    'dashboard[day]': (lambda ctx: fetch_loan_stats(ctx.first_day, ctx.last_day, 'day'), False),
+    'dashboard[week]': (lambda ctx: fetch_loan_stats(ctx.first_day, ctx.last_day, 'week'), False),
+    'dashboard[month]': (lambda ctx: fetch_loan_stats(ctx.first_day, ctx.last_day, 'month'), False),
+    'fetch_loaned_books_by_date': (lambda ctx: library.fetch_loaned_books_by_date(), False),
+    'fetch_return_data_by_date': (lambda ctx: library.fetch_return_data_by_date(), False),
+    'fetch_books': (lambda ctx: library.fetch_books(), True),
+    'fetch_loaned_books[all]': (lambda ctx: library.fetch_loaned_books(), True),
+    'fetch_return_data': (lambda ctx: library.fetch_return_data(), True),
+    'overdue_job': (lambda ctx: run_overdue_job(), False),
+    # The same reads from the memory-mapped Arrow snapshot
+    'snapshot.load_books': (lambda ctx: snapshots.load_books(), False),
+    'snapshot.load_loans[all]': (lambda ctx: snapshots.load_loans(), False),
+    'snapshot.load_loans[month]': (lambda ctx: snapshots.load_loans(start=ctx.last_day[:8] + '01', end=ctx.last_day), False),
+    'snapshot.monthly_activity': (lambda ctx: snapshots.monthly_activity(), False),
+    'snapshot.refresh[incremental]': (issue_then_refresh, False),
+}
+
+
+def summarize(samples, peak=None, rows=None):
+    seconds = np.asarray(samples)
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+    summary = {
+        'calls': len(seconds),
+        'p50_ms': round(p50, 3),
+        'p90_ms': round(p90, 3),
+        'p99_ms': round(p99, 3),
+        'mean_ms': round(seconds.mean() * 1000, 3),
+        'max_ms': round(seconds.max() * 1000, 3),
+        'throughput_per_s': round(len(seconds) / seconds.sum(), 1) if seconds.sum() else None,
+    }
+    if peak is not None:
+        summary['peak_python_kb'] = round(peak / 1024)
+    if rows is not None:
+        summary['rows'] = rows
+    return summary
+
+
+def _rows(result):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def run_case(ctx, call, repeat, warm):
+    samples, rows = {}, None
+    for _ in range(repeat):
+        if not warm:
+            clear_cache()
+        started = time.perf_counter()
+        result = call(ctx)
+        elapsed = time.perf_counter() - started
+        if isinstance(result, dict) and all(isinstance(value, float) for value in result.values()):
+            for name, seconds in result.items():
+                samples.setdefault(name, []).append(seconds)
+        else:
+            samples.setdefault(None, []).append(elapsed)
+            rows = _rows(result)
+    # One extra call under tracemalloc, kept out of the timings it would distort
+    if not warm:
+        clear_cache()
+    tracemalloc.start()
+    call(ctx)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {name: summarize(seconds, peak, rows) for name, seconds in samples.items()}
+
+
+def time_load(csv_path, repeat):
+    # load_dataset's synchronous work against a fresh database: the CSV import and the
+    # popularity refresh. The content-model refresh it starts runs in the background.
+    def load(path):
+        db.configure(path)
+        with db.connection() as conn:
+            import_catalog(conn, csv_path, force=True)
+        refresh_popularity()
+        db.close_all()
+
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(repeat):
+            started = time.perf_counter()
+            load(os.path.join(tmp, f'load-{i}.db'))
+            samples.append(time.perf_counter() - started)
+        tracemalloc.start()
+        load(os.path.join(tmp, 'load-traced.db'))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+def run_size(size, args):
+    path, csv_path, manifest = dataset(args.data_dir, size, args.seed, args.regenerate)
+    cases = {}
+    if 'load_dataset' not in args.skip:
+        print(f'[{size}] load_dataset', flush=True)
+        cases['load_dataset'] = time_load(csv_path, args.load_repeat)
+    db.close_all()
+    db.configure(path)
+    migrate()
+    clear_cache()
+    # Built once up front, as the app does after an import, so no case times the first fit
+    refresh_model()
+    snapshots.refresh()
+    ctx = Context(args.seed)
+    for name, (call, heavy) in CASES.items():
+        if name in args.skip or (args.only and name not in args.only):
+            continue
+        print(f'[{size}] {name}', flush=True)
+        repeat = min(args.repeat, HEAVY_REPEAT) if heavy else args.repeat
+        for case, summary in run_case(ctx, call, repeat, args.warm_cache).items():
+            cases[case or name] = summary
+    db.close_all()
+    return {'dataset': manifest, 'cases': cases}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results):
+    for size, run in results.items():
+        print(f'\n{size}: {run["dataset"]["params"]}')
+        print(f'  {"case":40} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"ops/s":>10} {"peak KB":>10}')
+        for name, summary in run['cases'].items():
+            print(f'  {name:40} {summary["p50_ms"]:>10.2f} {summary["p90_ms"]:>10.2f} {summary["p99_ms"]:>10.2f} '
+                  f'{summary["throughput_per_s"] or 0:>10.1f} {summary.get("peak_python_kb", 0):>10}')
+
+
+def run(args):
+    started = datetime.now()
+    results = {size: run_size(size, args) for size in args.sizes}
+    report = {
+        'meta': {
+            'started': started.isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'warm_cache': args.warm_cache,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            # ru_maxrss is KB on Linux: the process high-water mark, SQLite's page cache included
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'results': results,
+    }
+    print_table(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nwrote {args.out}')
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+    regressions = []
+    for size, run in current.items():
+        if size not in baseline:
+            continue
+        print(f'\n{size}')
+        print(f'  {"case":40} {"base p50":>10} {"p50":>10} {"change":>8}')
+        for name, summary in run['cases'].items():
+            before = baseline[size]['cases'].get(name)
+            if before is None or not before[args.metric]:
+                continue
+            change = summary[args.metric] / before[args.metric] - 1
+            flag = ' REGRESSION' if change > args.threshold else ''
+            print(f'  {name:40} {before[args.metric]:>10.2f} {summary[args.metric]:>10.2f} {change:>+8.0%}{flag}')
+            if flag:
+                regressions.append((size, name, change))
+    if regressions:
+        print(f'\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}')
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BookHive data-access functions on synthetic data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='generate (or reuse) datasets and time every case')
+    run_parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['tiny', 'small'])
+    run_parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--regenerate', action='store_true')
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument('--load-repeat', type=int, default=1)
+    run_parser.add_argument('--warm-cache', action='store_true',
+                            help='keep the query cache between calls instead of measuring the database')
+    run_parser.add_argument('--only', nargs='+', default=[], help='case names to run')
+    run_parser.add_argument('--skip', nargs='+', default=[], help='case names to skip')
+    run_parser.add_argument('--out', help='write the JSON report here')
+    compare_parser = commands.add_parser('compare', help='compare two JSON reports and fail on regressions')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p90_ms', 'p99_ms', 'mean_ms'])
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
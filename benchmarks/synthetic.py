@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from auth import hash_password
+from catalog_import import import_catalog
+from co_borrowing import rebuild_matrix
+from migrations import migrate
+from policy import backfill_due_dates
+from popularity import refresh_popularity
+from rollups import backfill, create_triggers
+
+SIZES = {
+    'tiny': {'books': 1000, 'loans': 10000, 'students': 500},
+    'small': {'books': 10000, 'loans': 100000, 'students': 5000},
+    'medium': {'books': 100000, 'loans': 1000000, 'students': 50000},
+    'large': {'books': 1000000, 'loans': 10000000, 'students': 200000},
+}
+# Zipf exponents: a few titles and a few heavy readers account for most loans
+BOOK_SKEW = 1.1
+STUDENT_SKEW = 0.9
+AUTHOR_SKEW = 1.0
+HISTORY_DAYS = 730
+MEAN_LOAN_DAYS = 14
+NEVER_RETURNED = 0.02
+INSERT_CHUNK = 200000
+
+WORDS = ('the of and a in to love war night river house dark star king queen shadow light garden city ocean '
+         'fire winter summer stone glass iron silver golden last first lost secret hidden silent broken empty '
+         'wild little great long white black red blue green road sea sky moon sun wind rain snow storm '
+         'dragon wolf raven tiger crown sword heart mind soul dream memory song story letter map island '
+         'mountain forest desert valley kingdom empire republic machine engine clock mirror door window bridge '
+         'tower castle library museum school hospital station harbour market street village world time').split()
+FIRST_NAMES = ('James Mary John Patricia Robert Jennifer Michael Linda William Elizabeth David Barbara Richard '
+               'Susan Joseph Jessica Thomas Sarah Charles Karen Haruki Chimamanda Gabriel Toni Orhan Elena Yuki '
+               'Ngozi Mateo Ingrid Kenji Amara Lars Priya Omar Sofia Dmitri Leila Tomas Aiko').split()
+LAST_NAMES = ('Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez Hernandez Lopez Gonzalez '
+              'Wilson Anderson Thomas Taylor Moore Jackson Martin Lee Perez Thompson White Harris Sanchez Clark '
+              'Ramirez Lewis Robinson Murakami Adichie Marquez Morrison Pamuk Ferrante Tanaka Okafor Silva '
+              'Lindqvist Sato Mensah Nilsson Sharma Haddad Rossi Volkov Karimi Novak Ito').split()
+PUBLISHERS = ('Penguin Books', 'Vintage', 'Tor Books', 'Del Rey', 'HarperCollins', 'Bantam', 'Scribner',
+              'Random House', 'Simon & Schuster', 'Oxford University Press', 'Faber & Faber', 'Picador',
+              'Orbit', 'Gollancz', 'Knopf', 'Little, Brown', 'Hachette', 'Macmillan', 'Anchor', 'Ballantine')
+LANGUAGES = (('eng', 0.7), ('en-US', 0.12), ('en-GB', 0.05), ('spa', 0.04), ('fre', 0.03), ('ger', 0.03),
+             ('jpn', 0.02), ('ita', 0.01))
+CSV_COLUMNS = ['bookID', 'title', 'authors', 'average_rating', 'isbn', 'isbn13', 'language_code', '  num_pages',
+               'ratings_count', 'text_reviews_count', 'publication_date', 'publisher']
+
+
+def zipf_choice(rng, n, size, skew):
+    # Bounded Zipf over ranks 0..n-1; rank 0 is the most frequent
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def write_catalog(csv_path, books, rng):
+    author_pool = [f'{rng.choice(FIRST_NAMES)} {chr(65 + i % 26)}. {rng.choice(LAST_NAMES)}'
+                   for i in range(max(books // 8, 50))]
+    authors = zipf_choice(rng, len(author_pool), (books, 2), AUTHOR_SKEW)
+    co_authored = rng.random(books) < 0.15
+    title_lengths = rng.integers(1, 6, books)
+    title_words = rng.integers(0, len(WORDS), (books, 5))
+    ratings = np.clip(rng.normal(3.9, 0.35, books), 1.0, 5.0).round(2)
+    ratings_count = (rng.pareto(1.1, books) * 20).astype(np.int64)
+    languages = rng.choice([code for code, _ in LANGUAGES], books, p=[weight for _, weight in LANGUAGES])
+    publishers = rng.integers(0, len(PUBLISHERS), books)
+    pages = rng.integers(40, 1200, books)
+    years = rng.integers(1900, 2024, books)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for i in range(books):
+            title = ' '.join(WORDS[w] for w in title_words[i, :title_lengths[i]]).title()
+            names = author_pool[authors[i, 0]]
+            if co_authored[i] and authors[i, 1] != authors[i, 0]:
+                names += '/' + author_pool[authors[i, 1]]
+            isbn13 = 9780000000000 + i
+            writer.writerow([i + 1, title, names, ratings[i], str(isbn13)[3:], isbn13, languages[i], pages[i],
+                             ratings_count[i], ratings_count[i] // 20, f'1/1/{years[i]}',
+                             PUBLISHERS[publishers[i]]])
+
+
+def generate_loans(rng, book_ids, students, loans, today):
+    books = np.asarray(book_ids)[rng.permutation(len(book_ids))]
+    book = books[zipf_choice(rng, len(books), loans, BOOK_SKEW)]
+    student = rng.permutation(students)[zipf_choice(rng, students, loans, STUDENT_SKEW)]
+    loaned_ago = np.sort(rng.integers(0, HISTORY_DAYS, loans))[::-1]
+    kept_for = np.ceil(rng.exponential(MEAN_LOAN_DAYS, loans)).astype(np.int64)
+    returned_ago = loaned_ago - kept_for
+    returned = (returned_ago >= 0) & (rng.random(loans) >= NEVER_RETURNED)
+    epoch = today.toordinal()
+    loan_dates = [date.fromordinal(epoch - int(days)).isoformat() for days in range(HISTORY_DAYS)]
+    for start in range(0, loans, INSERT_CHUNK):
+        end = min(start + INSERT_CHUNK, loans)
+        yield [(f'B{student[i] + 1:07d}', int(book[i]), loan_dates[loaned_ago[i]],
+                loan_dates[returned_ago[i]] if returned[i] else None) for i in range(start, end)]
+
+
+def generate(path, csv_path, books, loans, students, seed=0):
+    for stale in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    rng = np.random.default_rng(seed)
+    timings = {}
+    started = time.perf_counter()
+    write_catalog(csv_path, books, rng)
+    timings['csv'] = time.perf_counter() - started
+
+    db.configure(path)
+    migrate()
+    started = time.perf_counter()
+    with db.connection() as conn:
+        import_catalog(conn, csv_path, force=True)
+    timings['import'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    today = date.today()
+    with db.transaction() as conn:
+        # One hash shared by every synthetic student; deriving a key per row would dominate the load
+        password = hash_password('password')
+        conn.executemany('''
+        INSERT INTO students (student_id, name, password) VALUES (?, ?, ?)
+        ''', ((f'B{i + 1:07d}', f'Bench Student {i + 1}', password) for i in range(students)))
+        book_ids = [row[0] for row in conn.execute('SELECT bookID FROM books ORDER BY bookID')]
+        # The rollup triggers are per row; for a bulk load, backfilling once is far cheaper
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'loan_stats_%'").fetchall():
+            conn.execute(f'DROP TRIGGER {name}')
+        for chunk in generate_loans(rng, book_ids, students, loans, today):
+            conn.executemany('''
+            INSERT INTO book_loans (student_id, book_id, loan_date, return_date) VALUES (?, ?, ?, ?)
+            ''', chunk)
+        backfill(conn)
+        create_triggers(conn.cursor())
+        backfill_due_dates(conn)
+        # 1-4 copies per title, or more if the generated history keeps more than that on loan
+        conn.execute('''
+        UPDATE books SET copies = MAX(1 + bookID % 4, (
+            SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = books.bookID AND bl.return_date IS NULL))
+        ''')
+        conn.execute('''
+        UPDATE books SET available_copies = copies - (
+            SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = books.bookID AND bl.return_date IS NULL)
+        ''')
+    timings['loans'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with db.transaction() as conn:
+        rebuild_matrix(conn)
+        refresh_popularity(conn)
+    timings['derived'] = time.perf_counter() - started
+    with db.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return timings
+
+
+def dataset(data_dir, size, seed=0, regenerate=False):
+    # Reuses a previously generated database when its parameters match
+    params = dict(SIZES[size], seed=seed)
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'{size}-{seed}.db')
+    csv_path = os.path.join(data_dir, f'{size}-{seed}.csv')
+    manifest_path = path + '.json'
+    if not regenerate and os.path.exists(path) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            return path, csv_path, manifest
+    timings = generate(path, csv_path, params['books'], params['loans'], params['students'], seed)
+    manifest = {'params': params, 'generated_on': date.today().isoformat(), 'timings': timings}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return path, csv_path, manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a reproducible synthetic BookHive database.')
+    parser.add_argument('size', choices=SIZES)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--regenerate', action='store_true')
+    args = parser.parse_args()
+    path, _, manifest = dataset(args.data_dir, args.size, args.seed, args.regenerate)
+    print(f"{path}: {manifest['params']}")
+    for step, seconds in manifest.get('timings', {}).items():
+        print(f'  {step}: {seconds:.1f}s')
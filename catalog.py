@@ -0,0 +1,160 @@
+import threading
+
+import pandas as pd
+
+from db import connection, database_path, get_meta
+from query_cache import version
+
+PAGE_SIZE = 50
+COUNT_CAP = 10000
+CATALOG_COLUMNS = ['bookID', 'title', 'authors', 'average_rating', 'language_code', 'ratings_count', 'publisher']
+# Sortable columns; each is backed by an index whose implicit rowid suffix makes (column, bookID) a valid key
+SORT_COLUMNS = ('bookID', 'title', 'average_rating', 'ratings_count')
+# Bumped by catalog imports only, so loans and returns (which bump 'books') leave the shared frame alone
+CATALOG_TABLE = 'catalog'
+FRAME_CHUNK_SIZE = 50000
+# Text columns that may repeat enough to dictionary-encode. Each is converted only when its
+# distinct values are under CATEGORY_MAX_RATIO of the rows: a mostly unique column (authors
+# in many catalogs) would just copy its strings into the category index. Titles are nearly
+# unique everywhere, so they always stay plain strings.
+CATEGORY_COLUMNS = ('authors', 'language_code', 'publisher')
+CATEGORY_MAX_RATIO = 0.5
+
+# (database, catalog version, frame); replaced whole, so readers never see a half-built frame
+_shared = (None, None, None)
+_shared_lock = threading.Lock()
+
+
+def _filters(language=None, publisher=None, min_rating=None, max_rating=None):
+    clauses, params = [], []
+    if language:
+        clauses.append('language_code = ?')
+        params.append(language)
+    if publisher:
+        clauses.append('publisher = ?')
+        params.append(publisher)
+    if min_rating is not None:
+        clauses.append('average_rating >= ?')
+        params.append(min_rating)
+    if max_rating is not None:
+        clauses.append('average_rating <= ?')
+        params.append(max_rating)
+    return clauses, params
+
+
+def _keyset(sort, descending, after):
+    if after is None:
+        return [], []
+    value, book_id = after
+    if sort == 'bookID':
+        return [f"bookID {'<' if descending else '>'} ?"], [book_id]
+    # NULLs sort first ascending and last descending, as SQLite orders them
+    if value is None:
+        if descending:
+            return [f'{sort} IS NULL AND bookID < ?'], [book_id]
+        return [f'({sort} IS NULL AND bookID > ?) OR {sort} IS NOT NULL'], [book_id]
+    if descending:
+        return [f'(({sort}, bookID) < (?, ?) OR {sort} IS NULL)'], [value, book_id]
+    return [f'({sort}, bookID) > (?, ?)'], [value, book_id]
+
+
+def fetch_page(after=None, limit=PAGE_SIZE, sort='bookID', descending=False, **filters):
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+    clauses, params = _filters(**filters)
+    keyset_clauses, keyset_params = _keyset(sort, descending, after)
+    where = ' AND '.join(f'({clause})' for clause in clauses + keyset_clauses) or '1'
+    direction = 'DESC' if descending else 'ASC'
+    order = 'bookID' if sort == 'bookID' else f'{sort} {direction}, bookID'
+    with connection() as conn:
+        rows = conn.execute(f'''
+        SELECT {', '.join(CATALOG_COLUMNS)} FROM books
+        WHERE {where}
+        ORDER BY {order} {direction}
+        LIMIT ?
+        ''', [*params, *keyset_params, limit]).fetchall()
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = (last[CATALOG_COLUMNS.index(sort)], last[0])
+    return rows, next_cursor
+
+
+def estimate_count(**filters):
+    # Returns (count, exact). Unfiltered counts come from the import bookkeeping; filtered
+    # counts stop at COUNT_CAP so a broad filter never scans the whole catalog.
+    clauses, params = _filters(**filters)
+    with connection() as conn:
+        if not clauses:
+            stored = get_meta(conn.cursor(), 'book_count')
+            if stored is not None:
+                return int(stored), False
+        count = conn.execute(f'''
+        SELECT COUNT(*) FROM (SELECT 1 FROM books WHERE {' AND '.join(clauses) or '1'} LIMIT ?)
+        ''', [*params, COUNT_CAP + 1]).fetchone()[0]
+    if count > COUNT_CAP:
+        return COUNT_CAP, False
+    return count, True
+
+
+def fetch_availability_page(after_id=None, limit=PAGE_SIZE):
+    # Reads the maintained counters; no join against book_loans
+    with connection() as conn:
+        return conn.execute('''
+        SELECT bookID, title, authors,
+               CASE WHEN available_copies > 0 THEN 'Available' ELSE 'Loaned Out' END AS status,
+               available_copies, copies
+        FROM books
+        WHERE bookID > ?
+        ORDER BY bookID
+        LIMIT ?
+        ''', (after_id or 0, -1 if limit is None else limit)).fetchall()
+
+
+def _compact(frame):
+    # Ratings stay float64: as float32, 3.93 would print as 3.930000066757202 on the cards
+    frame = frame.astype({'title': 'string', 'average_rating': 'float64'})
+    for column in ('bookID', 'ratings_count'):
+        frame[column] = pd.to_numeric(frame[column], downcast='integer')
+    for column in CATEGORY_COLUMNS:
+        if len(frame) and frame[column].nunique() / len(frame) < CATEGORY_MAX_RATIO:
+            frame[column] = frame[column].astype('category')
+    return frame
+
+
+def build_frame():
+    # Read in chunks so the full-width intermediate never exists for the whole catalog at once
+    with connection() as conn:
+        chunks = list(pd.read_sql_query(f'''
+        SELECT {', '.join(CATALOG_COLUMNS)} FROM books ORDER BY bookID
+        ''', conn, chunksize=FRAME_CHUNK_SIZE))
+    if not chunks:
+        return _compact(pd.DataFrame(columns=CATALOG_COLUMNS))
+    return _compact(pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0])
+
+
+def shared_frame():
+    # One read-only catalog frame for every session in the process, rebuilt when an import
+    # bumps the catalog version. Copy-on-write means a session that modifies what it was
+    # given gets its own copy; the shared frame never changes.
+    global _shared
+    key = (database_path(), version(CATALOG_TABLE))
+    path, built_for, frame = _shared
+    if frame is not None and key[1] is not None and (path, built_for) == key:
+        return frame
+    with _shared_lock:
+        path, built_for, frame = _shared
+        if frame is not None and key[1] is not None and (path, built_for) == key:
+            return frame
+        frame = build_frame()
+        # Keyed by the version read before building: a write during the build only causes another rebuild
+        if key[1] is not None:
+            _shared = (*key, frame)
+    return frame
+
+
+def books_by_id(book_ids):
+    # Rows of the shared frame in the order given; IDs no longer in the catalog are skipped
+    frame = shared_frame()
+    positions = pd.Index(frame['bookID']).get_indexer(list(book_ids))
+    return frame.iloc[positions[positions >= 0]].reset_index(drop=True)
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+from author_index import sync_author_index
+from db import get_meta, set_meta
+from migrations import migrate
+from query_cache import bump
+
+CATALOG_COLUMNS = ['title', 'authors', 'average_rating', 'language_code', 'ratings_count', 'publisher']
+CHUNK_SIZE = 20000
+BATCH_SIZE = 5000
+
+_import_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_keys(chunk):
+    # Goodreads exports carry their own bookID; fall back to ISBN, then to the descriptive columns
+    if 'bookID' in chunk.columns:
+        keys = chunk['bookID']
+    elif 'isbn13' in chunk.columns:
+        keys = chunk['isbn13']
+    else:
+        keys = chunk['title'].astype(str) + '|' + chunk['authors'].astype(str) + '|' + chunk['publisher'].astype(str)
+    return keys.astype(str).str.strip()
+
+
+def _staging_records(chunk):
+    missing = [column for column in CATALOG_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"books.csv is missing columns: {', '.join(missing)}")
+    frame = pd.DataFrame({
+        'source_key': _source_keys(chunk),
+        'title': chunk['title'],
+        'authors': chunk['authors'],
+        'average_rating': pd.to_numeric(chunk['average_rating'], errors='coerce'),
+        'language_code': chunk['language_code'],
+        'ratings_count': pd.to_numeric(chunk['ratings_count'], errors='coerce').astype('Int64'),
+        'publisher': chunk['publisher'],
+    })
+    frame = frame[frame['source_key'] != '']
+    columns = [frame[name].astype(object).where(frame[name].notna(), None).tolist() for name in frame.columns]
+    return list(zip(*columns))
+
+
+def _stage_csv(cursor, csv_path, chunk_size):
+    cursor.execute('DROP TABLE IF EXISTS temp.books_staging')
+    cursor.execute('''
+    CREATE TEMP TABLE books_staging(
+        source_key TEXT PRIMARY KEY,
+        title TEXT,
+        authors TEXT,
+        average_rating FLOAT,
+        language_code TEXT,
+        ratings_count INTEGER,
+        publisher TEXT
+    )''')
+    for chunk in pd.read_csv(csv_path, on_bad_lines='skip', chunksize=chunk_size):
+        cursor.executemany('''
+        INSERT OR REPLACE INTO books_staging (source_key, title, authors, average_rating, language_code, ratings_count, publisher)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', _staging_records(chunk))
+    cursor.execute('CREATE INDEX temp.idx_books_staging_title ON books_staging(title)')
+
+
+def _adopt_legacy_rows(conn, cursor):
+    # Rows loaded by the old wipe-and-reinsert import have no source_key; match them by content
+    # so their bookIDs (and the loans pointing at them) survive the first incremental import.
+    legacy = cursor.execute('''
+    SELECT bookID, title, authors, publisher FROM books WHERE source_key IS NULL
+    ''').fetchall()
+    for start in range(0, len(legacy), BATCH_SIZE):
+        for book_id, title, authors, publisher in legacy[start:start + BATCH_SIZE]:
+            cursor.execute('''
+            UPDATE books SET source_key = (
+                SELECT s.source_key FROM books_staging s
+                WHERE s.title IS ? AND s.authors IS ? AND s.publisher IS ?
+                  AND NOT EXISTS (SELECT 1 FROM books b WHERE b.source_key = s.source_key)
+                LIMIT 1)
+            WHERE bookID = ?
+            ''', (title, authors, publisher, book_id))
+        conn.commit()
+
+
+def _apply_changes(conn, cursor, batch_size):
+    added = changed = removed = retired = restored = 0
+    last_rowid = cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM books_staging').fetchone()[0]
+    for low in range(0, last_rowid, batch_size):
+        high = low + batch_size
+        cursor.execute('''
+        UPDATE books
+        SET (title, authors, average_rating, language_code, ratings_count, publisher) = (
+            SELECT s.title, s.authors, s.average_rating, s.language_code, s.ratings_count, s.publisher
+            FROM books_staging s WHERE s.source_key = books.source_key)
+        WHERE source_key IN (SELECT s.source_key FROM books_staging s WHERE s.rowid > ? AND s.rowid <= ?)
+          AND NOT EXISTS (
+            SELECT 1 FROM books_staging s
+            WHERE s.source_key = books.source_key
+              AND s.title IS books.title AND s.authors IS books.authors
+              AND s.average_rating IS books.average_rating AND s.language_code IS books.language_code
+              AND s.ratings_count IS books.ratings_count AND s.publisher IS books.publisher)
+        ''', (low, high))
+        changed += cursor.rowcount
+        cursor.execute('''
+        INSERT INTO books (source_key, title, authors, average_rating, language_code, ratings_count, publisher)
+        SELECT s.source_key, s.title, s.authors, s.average_rating, s.language_code, s.ratings_count, s.publisher
+        FROM books_staging s
+        WHERE s.rowid > ? AND s.rowid <= ?
+          AND NOT EXISTS (SELECT 1 FROM books b WHERE b.source_key = s.source_key)
+        ORDER BY s.rowid
+        ''', (low, high))
+        added += cursor.rowcount
+        # A title retired by an earlier import is back in the file: lend it again, with one
+        # copy or as many as its open loans, whichever is more
+        cursor.execute('''
+        UPDATE books SET copies = MAX(1, o.open_loans), available_copies = MAX(1, o.open_loans) - o.open_loans
+        FROM (
+            SELECT b.bookID, COUNT(bl.loan_id) AS open_loans
+            FROM books b
+            JOIN books_staging s ON s.source_key = b.source_key
+            LEFT JOIN book_loans bl ON bl.book_id = b.bookID AND bl.return_date IS NULL
+            WHERE b.copies = 0 AND s.rowid > ? AND s.rowid <= ?
+            GROUP BY b.bookID) AS o
+        WHERE books.bookID = o.bookID
+        ''', (low, high))
+        restored += cursor.rowcount
+        conn.commit()
+
+    last_book_id = cursor.execute('SELECT COALESCE(MAX(bookID), 0) FROM books').fetchone()[0]
+    for low in range(0, last_book_id, batch_size):
+        cursor.execute('''
+        DELETE FROM books
+        WHERE bookID > ? AND bookID <= ?
+          AND NOT EXISTS (SELECT 1 FROM books_staging s WHERE s.source_key = books.source_key)
+          AND NOT EXISTS (SELECT 1 FROM book_loans bl WHERE bl.book_id = books.bookID)
+        ''', (low, low + batch_size))
+        removed += cursor.rowcount
+        # Books that loans still point at stay, so loan history keeps its titles; they are
+        # retired from circulation instead
+        cursor.execute('''
+        UPDATE books SET copies = 0, available_copies = 0
+        WHERE bookID > ? AND bookID <= ?
+          AND (copies != 0 OR available_copies != 0)
+          AND NOT EXISTS (SELECT 1 FROM books_staging s WHERE s.source_key = books.source_key)
+        ''', (low, low + batch_size))
+        retired += cursor.rowcount
+        conn.commit()
+    return added, changed, removed, retired, restored
+
+
+def import_catalog(conn, csv_path='books.csv', force=False, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    stats = {'skipped': True, 'added': 0, 'changed': 0, 'removed': 0, 'retired': 0, 'restored': 0}
+    with _import_lock:
+        migrate(conn)
+        cursor = conn.cursor()
+        # Books written outside an import since the last sync
+        sync_author_index(conn)
+        conn.commit()
+
+        stat = os.stat(csv_path)
+        if not force and get_meta(cursor, 'csv_size') == str(stat.st_size) \
+                and get_meta(cursor, 'csv_mtime_ns') == str(stat.st_mtime_ns):
+            return stats
+        fingerprint = file_sha256(csv_path)
+        if not force and get_meta(cursor, 'csv_sha256') == fingerprint:
+            # Touched but unchanged: remember the new mtime so the next check stays cheap
+            set_meta(cursor, csv_size=stat.st_size, csv_mtime_ns=stat.st_mtime_ns)
+            conn.commit()
+            return stats
+
+        try:
+            _stage_csv(cursor, csv_path, chunk_size)
+            conn.commit()
+            _adopt_legacy_rows(conn, cursor)
+            added, changed, removed, retired, restored = _apply_changes(conn, cursor, batch_size)
+            sync_author_index(conn)
+            book_count = cursor.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+            set_meta(cursor, csv_size=stat.st_size, csv_mtime_ns=stat.st_mtime_ns,
+                     csv_sha256=fingerprint, book_count=book_count)
+            # Cached book rows and the shared catalog frame are stale from this commit on
+            bump('books', 'catalog')
+            conn.commit()
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS temp.books_staging')
+
+    stats.update(skipped=False, added=added, changed=changed, removed=removed, retired=retired, restored=restored)
+    return stats
@@ -0,0 +1,228 @@
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+from co_borrowing import record_loan, record_loans
+from db import connection, transaction
+from policy import due_date
+from query_cache import bump
+from write_queue import get_writer
+
+# Tables whose cached reads a checkout or return invalidates
+CIRCULATION_TABLES = ('books', 'book_loans', 'loan_daily_stats')
+# Route single issues and returns through the group-commit writer instead of committing per call
+GROUP_COMMIT = os.environ.get('BOOKHIVE_GROUP_COMMIT', '0') == '1'
+
+
+def issue(conn, student_id, book_id, loan_date):
+    # Must run inside a write transaction. The conditional decrement is the reservation:
+    # two concurrent checkouts of the last copy cannot both see available_copies > 0.
+    cursor = conn.execute('''
+    UPDATE books SET available_copies = available_copies - 1
+    WHERE bookID = ? AND available_copies > 0
+    ''', (book_id,))
+    row = conn.execute('SELECT title FROM books WHERE bookID = ?', (book_id,)).fetchone()
+    if cursor.rowcount == 0:
+        if row is None:
+            return None, None, f"No book found with ID {book_id}"
+        return None, row[0], f"No copies of '{row[0]}' are available right now"
+    cursor = conn.execute('''
+    INSERT INTO book_loans (student_id, book_id, loan_date, due_date, return_date) VALUES (?, ?, ?, ?, NULL)
+    ''', (student_id, book_id, loan_date, due_date(loan_date)))
+    record_loan(conn, student_id, book_id)
+    return cursor.lastrowid, row[0], None
+
+
+def check_in(conn, loan_id, return_date):
+    # Must run inside a write transaction; the IS NULL guard makes a second return a no-op
+    cursor = conn.execute('''
+    UPDATE book_loans SET return_date = ? WHERE loan_id = ? AND return_date IS NULL
+    ''', (return_date, loan_id))
+    if cursor.rowcount == 0:
+        if conn.execute('SELECT 1 FROM book_loans WHERE loan_id = ?', (loan_id,)).fetchone() is None:
+            return f"No loan found with ID {loan_id}"
+        return f"Loan {loan_id} has already been returned"
+    conn.execute('''
+    UPDATE books SET available_copies = available_copies + 1
+    WHERE bookID = (SELECT book_id FROM book_loans WHERE loan_id = ?) AND available_copies < copies
+    ''', (loan_id,))
+    return None
+
+
+def use_group_commit(enabled=True):
+    global GROUP_COMMIT
+    GROUP_COMMIT = enabled
+
+
+def issue_book(student_id, book_id):
+    if GROUP_COMMIT:
+        # Blocks until the group holding this request has committed
+        _, title, error = get_writer().submit(
+            issue, student_id, book_id, datetime.now().date(), tables=CIRCULATION_TABLES).result()
+    else:
+        with transaction() as conn:
+            _, title, error = issue(conn, student_id, book_id, datetime.now().date())
+            if not error:
+                bump(*CIRCULATION_TABLES)
+    if error:
+        return None, error
+    return title, None
+
+
+def return_book(loan_id):
+    if GROUP_COMMIT:
+        return get_writer().submit(check_in, loan_id, datetime.now().date(), tables=CIRCULATION_TABLES).result()
+    with transaction() as conn:
+        error = check_in(conn, loan_id, datetime.now().date())
+        if not error:
+            bump(*CIRCULATION_TABLES)
+    return error
+
+
+def _lookup(conn, query, ids):
+    # One set-based query for the whole batch instead of a round trip per item
+    return {row[0]: row[1:] for row in conn.execute(query, (json.dumps(list(set(ids))),))}
+
+
+def issue_many(conn, loans, loan_date):
+    # Must run inside a write transaction. Takes (student_id, book_id) pairs and returns one
+    # result dict per pair, in order; rows with an error are skipped, the rest are applied.
+    loans = [(str(student_id), book_id) for student_id, book_id in loans]
+    students = _lookup(conn, '''
+    SELECT student_id FROM students WHERE student_id IN (SELECT value FROM json_each(?))
+    ''', [student_id for student_id, _ in loans])
+    books = _lookup(conn, '''
+    SELECT bookID, title, available_copies FROM books WHERE bookID IN (SELECT value FROM json_each(?))
+    ''', [book_id for _, book_id in loans])
+    remaining = {book_id: available for book_id, (_, available) in books.items()}
+    results, accepted = [], []
+    for student_id, book_id in loans:
+        result = {'student_id': student_id, 'book_id': book_id, 'loan_id': None, 'title': None, 'error': None}
+        results.append(result)
+        if book_id not in books:
+            result['error'] = f"No book found with ID {book_id}"
+            continue
+        result['title'] = books[book_id][0]
+        if student_id not in students:
+            result['error'] = f"No student found with ID {student_id}"
+        elif remaining[book_id] <= 0:
+            result['error'] = f"No copies of '{result['title']}' are available right now"
+        else:
+            remaining[book_id] -= 1
+            accepted.append(result)
+    if not accepted:
+        return results
+    conn.executemany('''
+    UPDATE books SET available_copies = available_copies - ? WHERE bookID = ?
+    ''', [(books[book_id][1] - left, book_id) for book_id, left in remaining.items() if left != books[book_id][1]])
+    # The write lock is held, so the rows inserted next are the only ones above the current maximum
+    first_id = conn.execute('SELECT COALESCE(MAX(loan_id), 0) FROM book_loans').fetchone()[0] + 1
+    due = due_date(loan_date)
+    conn.executemany('''
+    INSERT INTO book_loans (student_id, book_id, loan_date, due_date, return_date) VALUES (?, ?, ?, ?, NULL)
+    ''', [(result['student_id'], result['book_id'], loan_date, due) for result in accepted])
+    loan_ids = [row[0] for row in conn.execute('''
+    SELECT loan_id FROM book_loans WHERE loan_id >= ? ORDER BY loan_id
+    ''', (first_id,))]
+    for result, loan_id in zip(accepted, loan_ids):
+        result['loan_id'] = loan_id
+    record_loans(conn, [(result['student_id'], result['book_id']) for result in accepted])
+    return results
+
+
+def check_in_many(conn, loan_ids, return_date):
+    # Must run inside a write transaction; returns one result dict per loan id, in order
+    loans = _lookup(conn, '''
+    SELECT loan_id, book_id, return_date FROM book_loans WHERE loan_id IN (SELECT value FROM json_each(?))
+    ''', loan_ids)
+    results, returned = [], Counter()
+    seen = set()
+    for loan_id in loan_ids:
+        result = {'loan_id': loan_id, 'book_id': None, 'error': None}
+        results.append(result)
+        if loan_id not in loans:
+            result['error'] = f"No loan found with ID {loan_id}"
+            continue
+        book_id, returned_on = loans[loan_id]
+        result['book_id'] = book_id
+        if returned_on is not None or loan_id in seen:
+            result['error'] = f"Loan {loan_id} has already been returned"
+            continue
+        seen.add(loan_id)
+        returned[book_id] += 1
+    conn.executemany('''
+    UPDATE book_loans SET return_date = ? WHERE loan_id = ? AND return_date IS NULL
+    ''', [(return_date, loan_id) for loan_id in seen])
+    conn.executemany('''
+    UPDATE books SET available_copies = MIN(copies, available_copies + ?) WHERE bookID = ?
+    ''', [(count, book_id) for book_id, count in returned.items()])
+    return results
+
+
+def issue_books(loans):
+    with transaction() as conn:
+        results = issue_many(conn, loans, datetime.now().date())
+        bump(*CIRCULATION_TABLES)
+    return results
+
+
+def return_books(loan_ids):
+    with transaction() as conn:
+        results = check_in_many(conn, loan_ids, datetime.now().date())
+        bump(*CIRCULATION_TABLES)
+    return results
+
+
+def _loans_query(student_id=None):
+    if student_id:
+        return '''
+        SELECT book_loans.loan_id, books.title, books.authors, book_loans.loan_date, book_loans.due_date,
+               book_loans.return_date
+        FROM book_loans
+        JOIN books ON book_loans.book_id = books.bookID
+        WHERE book_loans.student_id = ?
+        ''', (student_id,)
+    return '''
+    SELECT book_loans.loan_id, books.title, books.authors, book_loans.loan_date, book_loans.due_date,
+           book_loans.return_date, book_loans.student_id
+    FROM book_loans
+    JOIN books ON book_loans.book_id = books.bookID
+    ''', ()
+
+
+def loaned_books(student_id=None):
+    with connection() as conn:
+        return conn.execute(*_loans_query(student_id)).fetchall()
+
+
+def iter_loaned_books(student_id=None, batch_size=1000):
+    # Yields batches so a full listing never has to sit in memory at once
+    with connection() as conn:
+        cursor = conn.execute(*_loans_query(student_id))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+
+def availability(book_id):
+    with connection() as conn:
+        return conn.execute('''
+        SELECT copies, available_copies FROM books WHERE bookID = ?
+        ''', (book_id,)).fetchone()
+
+
+def set_copies(book_id, copies):
+    if copies < 0:
+        raise ValueError("A book cannot have a negative number of copies")
+    with transaction() as conn:
+        # Copies already on loan stay on loan; only the shelf count moves
+        cursor = conn.execute('''
+        UPDATE books
+        SET available_copies = MAX(0, available_copies + (? - copies)), copies = ?
+        WHERE bookID = ?
+        ''', (copies, copies, book_id))
+        bump('books')
+    return cursor.rowcount == 1
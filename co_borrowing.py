@@ -0,0 +1,192 @@
+import argparse
+import json
+import math
+from collections import defaultdict
+
+import numpy as np
+import scipy.sparse as sp
+
+import db
+from db import connection, transaction
+
+# Only a student's most recent distinct books pair with a new loan, which bounds the
+# per-loan update cost and keeps one voracious reader from dominating the matrix.
+MAX_HISTORY = 200
+# Recommendations are seeded from this many of the student's latest books
+SEED_BOOKS = 50
+NEIGHBOURS_PER_BOOK = 100
+REBUILD_CHUNK = 500000
+
+
+def _upsert_pairs(conn, pairs):
+    conn.executemany('''
+    INSERT INTO book_cooccurrence (book_a, book_b, count) VALUES (?, ?, ?)
+    ON CONFLICT(book_a, book_b) DO UPDATE SET count = count + excluded.count
+    ''', pairs)
+
+
+def _upsert_borrowers(conn, counts):
+    conn.executemany('''
+    INSERT INTO book_borrowers (book_id, borrowers) VALUES (?, ?)
+    ON CONFLICT(book_id) DO UPDATE SET borrowers = borrowers + excluded.borrowers
+    ''', counts)
+
+
+def record_loan(conn, student_id, book_id):
+    # Called inside the issuing transaction, after the loan row is inserted
+    previous = conn.execute('''
+    SELECT COUNT(*) FROM book_loans WHERE student_id = ? AND book_id = ?
+    ''', (student_id, book_id)).fetchone()[0]
+    if previous > 1:
+        return
+    others = [row[0] for row in conn.execute('''
+    SELECT book_id FROM book_loans
+    WHERE student_id = ? AND book_id != ?
+    GROUP BY book_id
+    ORDER BY MAX(loan_date) DESC
+    LIMIT ?
+    ''', (student_id, book_id, MAX_HISTORY))]
+    _upsert_pairs(conn, [(book_id, other, 1) for other in others] + [(other, book_id, 1) for other in others])
+    _upsert_borrowers(conn, [(book_id, 1)])
+
+
+def record_loans(conn, loans):
+    # Batch form of record_loan for (student_id, book_id) rows already inserted in this
+    # transaction; pairs each first-time book with the student's earlier books and with
+    # the other first-time books of the same batch, as issuing them one by one would.
+    batch = defaultdict(list)
+    for student_id, book_id in loans:
+        batch[student_id].append(book_id)
+    history = defaultdict(list)
+    for student_id, book_id, count in conn.execute('''
+    SELECT student_id, book_id, COUNT(*) FROM book_loans
+    WHERE student_id IN (SELECT value FROM json_each(?))
+    GROUP BY student_id, book_id
+    ORDER BY student_id, MAX(loan_date) DESC
+    ''', (json.dumps(list(batch)),)):
+        history[student_id].append((book_id, count))
+    pairs, borrowers = defaultdict(int), []
+    for student_id, book_ids in batch.items():
+        issued = {book_id: book_ids.count(book_id) for book_id in book_ids}
+        first_time = [book_id for book_id, count in history[student_id] if count == issued.get(book_id)]
+        earlier = [book_id for book_id, _ in history[student_id] if book_id not in first_time][:MAX_HISTORY]
+        for i, book_id in enumerate(first_time):
+            for other in earlier + first_time[:i]:
+                pairs[book_id, other] += 1
+                pairs[other, book_id] += 1
+        borrowers.extend((book_id, 1) for book_id in first_time)
+    _upsert_pairs(conn, [(a, b, count) for (a, b), count in pairs.items()])
+    _upsert_borrowers(conn, borrowers)
+
+
+def _flush(conn, histories):
+    # One chunk of students: C = X^T X over a compact student x book matrix
+    books = sorted({book_id for history in histories for book_id in history})
+    column = {book_id: i for i, book_id in enumerate(books)}
+    rows = np.repeat(np.arange(len(histories)), [len(history) for history in histories])
+    cols = np.fromiter((column[book_id] for history in histories for book_id in history), dtype=np.int64,
+                       count=len(rows))
+    x = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(histories), len(books)))
+    counts = (x.T @ x).tocoo()
+    ids = np.asarray(books, dtype=np.int64)
+    # The diagonal is capped like the histories; rebuild_matrix counts borrowers separately
+    off = counts.row != counts.col
+    _upsert_pairs(conn, zip(ids[counts.row[off]].tolist(), ids[counts.col[off]].tolist(),
+                            counts.data[off].tolist()))
+
+
+def rebuild_matrix(conn, chunk_size=REBUILD_CHUNK):
+    conn.execute('DELETE FROM book_cooccurrence')
+    conn.execute('DELETE FROM book_borrowers')
+    # Every borrower counts, however long their history; only the pairs below are capped
+    conn.execute('''
+    INSERT INTO book_borrowers (book_id, borrowers)
+    SELECT book_id, COUNT(DISTINCT student_id) FROM book_loans GROUP BY book_id
+    ''')
+    # Pairs come from each student's latest MAX_HISTORY distinct books as they stand now.
+    # record_loan paired each loan with the latest books at the time it was issued, so past
+    # the cap the two disagree: a long-history student's older pairs are in the incremental
+    # matrix but not in a rebuilt one. Borrower counts agree either way.
+    cursor = conn.execute('''
+    SELECT student_id, book_id FROM book_loans
+    GROUP BY student_id, book_id
+    ORDER BY student_id, MAX(loan_date) DESC
+    ''')
+    histories, current, student, pending = [], [], None, 0
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for student_id, book_id in rows:
+            if student_id != student:
+                if current:
+                    histories.append(current)
+                    pending += len(current)
+                current, student = [], student_id
+                if pending >= chunk_size:
+                    _flush(conn, histories)
+                    histories, pending = [], 0
+            if len(current) < MAX_HISTORY:
+                current.append(book_id)
+    if current:
+        histories.append(current)
+    if histories:
+        _flush(conn, histories)
+
+
+def rebuild(chunk_size=REBUILD_CHUNK):
+    with transaction() as conn:
+        rebuild_matrix(conn, chunk_size)
+        return conn.execute('SELECT COUNT(*) FROM book_cooccurrence').fetchone()[0]
+
+
+def _score(conn, seeds):
+    borrowers = dict(conn.execute(f'''
+    SELECT book_id, borrowers FROM book_borrowers WHERE book_id IN ({', '.join('?' * len(seeds))})
+    ''', seeds).fetchall())
+    scores = defaultdict(float)
+    for seed in seeds:
+        seed_borrowers = borrowers.get(seed)
+        if not seed_borrowers:
+            continue
+        for other, count, other_borrowers in conn.execute('''
+        SELECT c.book_b, c.count, b.borrowers
+        FROM book_cooccurrence c
+        JOIN book_borrowers b ON b.book_id = c.book_b
+        WHERE c.book_a = ?
+        ORDER BY c.count DESC
+        LIMIT ?
+        ''', (seed, NEIGHBOURS_PER_BOOK)):
+            # Cosine over borrower sets, so blockbusters don't top every list
+            scores[other] += count / math.sqrt(seed_borrowers * other_borrowers)
+    for seed in seeds:
+        scores.pop(seed, None)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def also_borrowed(book_id, k=10):
+    with connection() as conn:
+        return _score(conn, [book_id])[:k]
+
+
+def recommend_for_student(student_id, k=10):
+    with connection() as conn:
+        seeds = [row[0] for row in conn.execute('''
+        SELECT book_id FROM book_loans
+        WHERE student_id = ?
+        GROUP BY book_id
+        ORDER BY MAX(loan_date) DESC
+        LIMIT ?
+        ''', (student_id, SEED_BOOKS))]
+        if not seeds:
+            return []
+        return _score(conn, seeds)[:k]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the book co-borrowing matrix from book_loans.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--chunk-size', type=int, default=REBUILD_CHUNK)
+    args = parser.parse_args()
+    db.configure(args.db)
+    print(f'{rebuild(args.chunk_size)} co-borrowed pairs')
@@ -0,0 +1,93 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from query_cache import cached
+from rollups import fetch_loan_stats
+
+# Points drawn per chart; longer series are reduced with LTTB, which keeps the visual shape
+POINT_BUDGET = 600
+FIGURE_SIZE = (6.4, 4.8)
+FIGURE_DPI = 100
+
+_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='dashboard')
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points, first and last included
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(df, x, columns, budget=POINT_BUDGET):
+    # Union of each series' LTTB picks, so every line keeps its own peaks
+    if len(df) <= budget:
+        return df
+    xs = pd.to_datetime(df[x]).to_numpy(dtype='datetime64[D]').astype(np.int64).astype(float)
+    share = max(budget // len(columns), 3)
+    keep = np.unique(np.concatenate([lttb(xs, df[column].to_numpy(dtype=float), share) for column in columns]))
+    return df.iloc[keep].reset_index(drop=True)
+
+
+def line_png(df, x, y, title):
+    # Object-oriented Agg API only: no pyplot global state, so figures can render on threads
+    fig = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(pd.to_datetime(df[x]), df[y])
+    ax.set_title(title)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Count')
+    fig.autofmt_xdate()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def combined_figure(df):
+    combined = df.rename(columns={'period': 'Date', 'loans': 'Count_loaned', 'returns': 'Count_returned',
+                                  'open_balance': 'Open_loans'})
+    fig = px.line(combined, x='Date', y=['Count_loaned', 'Count_returned', 'Open_loans'],
+                  labels={'value': 'Count', 'variable': 'Type'})
+    fig.update_layout(title='Loaned vs Returned Books Over Time', xaxis_title='Date', yaxis_title='Count')
+    return fig
+
+
+@cached('loan_daily_stats')
+def dashboard_figures(start=None, end=None, granularity='day'):
+    # Cached against the rollup's version, so an unchanged dashboard reuses the rendered
+    # PNGs and figure instead of rebuilding them on every rerun
+    stats = fetch_loan_stats(start, end, granularity)
+    if stats.empty:
+        return None
+    loans = downsample(stats, 'period', ['loans'])
+    returns = downsample(stats, 'period', ['returns'])
+    combined = downsample(stats, 'period', ['loans', 'returns', 'open_balance'])
+    # The three renders are independent; build them side by side
+    loaned = _pool.submit(line_png, loans, 'period', 'loans', 'Books Loaned Over Time')
+    returned = _pool.submit(line_png, returns, 'period', 'returns', 'Books Returned Over Time')
+    figure = _pool.submit(combined_figure, combined)
+    return {
+        'loaned': loaned.result(),
+        'returned': returned.result(),
+        'combined': figure.result(),
+        'points': len(stats),
+    }
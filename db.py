@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from instrumentation import connection_factory
+
+DEFAULT_DB_PATH = os.environ.get('BOOKHIVE_DB', 'students.db')
+POOL_SIZE = int(os.environ.get('BOOKHIVE_DB_POOL_SIZE', 8))
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 5.0
+
+# Applied to every pooled connection. WAL lets readers and the single writer proceed
+# concurrently; synchronous=NORMAL is durable across application crashes in WAL mode.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
+class ConnectionPool:
+    def __init__(self, path=DEFAULT_DB_PATH, size=POOL_SIZE, pragmas=None):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE, factory=connection_factory())
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            # Mirror the old connect/close behaviour: uncommitted work is discarded
+            conn.rollback()
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        # Nested use on the same thread shares one connection so callers can compose
+        # data-access functions inside a single transaction.
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._checkin(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=None, pool_size=None, **pragmas):
+    global _pool
+    with _pool_lock:
+        old = _pool
+        _pool = ConnectionPool(path or (old.path if old else DEFAULT_DB_PATH),
+                               pool_size or (old.size if old else POOL_SIZE),
+                               pragmas or (old.pragmas if old else None))
+    if old is not None:
+        old.close()
+    return _pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def database_path():
+    return get_pool().path
+
+
+@contextmanager
+def connection():
+    with get_pool().connection() as conn:
+        yield conn
+
+
+@contextmanager
+def transaction(immediate=True):
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def get_meta(cursor, key, default=None):
+    row = cursor.execute('SELECT value FROM catalog_meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(cursor, **values):
+    cursor.executemany('''
+    INSERT INTO catalog_meta (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', [(key, str(value)) for key, value in values.items()])
+
+
+def close_all():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,281 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, wraps
+
+import pandas as pd
+
+ENABLED = os.environ.get('BOOKHIVE_INSTRUMENT', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('BOOKHIVE_SLOW_QUERY_MS', 100))
+SLOW_LOG_SIZE = 200
+# Upper bounds of the latency histogram buckets in ms; one more bucket catches the rest
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Iterating a cursor reads it in batches so rows are counted without a Python call per row
+ITER_BATCH = 256
+
+_lock = threading.Lock()
+_functions = {}
+_queries = {}
+_pages = {}
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+_context = threading.local()
+
+
+class Stat:
+    __slots__ = ('calls', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms, rows=None):
+        self.calls += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.rows += rows or 0
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th call; exact enough to spot outliers
+        target = q * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + (self.max_ms,), self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'histogram': list(self.buckets),
+        }
+
+
+def _add(table, key, ms, rows=None):
+    with _lock:
+        stat = table.get(key)
+        if stat is None:
+            stat = table[key] = Stat()
+        stat.add(ms, rows)
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql):
+    # Literals become ?, IN lists of any length collapse to one shape, whitespace folds
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+    return ' '.join(sql.split())
+
+
+def _record_query(function, sql, ms, rows):
+    query = normalize_sql(sql)
+    _add(_queries, (function, query), ms, rows)
+    if ms >= SLOW_QUERY_MS:
+        with _lock:
+            _slow.append({'at': datetime.now().isoformat(timespec='seconds'), 'function': function,
+                          'sql': query, 'ms': round(ms, 3), 'rows': rows})
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # A SELECT's cost is spread over execute and the fetches, so it is recorded once the
+    # statement is finished with: read to the end, replaced by the next execute, or dropped.
+    _pending = None
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            _record_query(*pending)
+
+    def _timed(self, method, sql, *args):
+        self._finish()
+        function = getattr(_context, 'function', None) or '-'
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            if self.description is None:
+                _record_query(function, sql, ms, max(self.rowcount, 0))
+            else:
+                self._pending = [function, sql, ms, 0]
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self._timed(super().executescript, script)
+
+    def _fetched(self, started, rows, exhausted):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += (time.perf_counter() - started) * 1000
+            pending[3] += rows
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+def _rows(result):
+    if isinstance(result, tuple) and result and isinstance(result[0], (list, pd.DataFrame)):
+        result = result[0]
+    return len(result) if isinstance(result, (list, pd.DataFrame)) else None
+
+
+def timed(func):
+    # Records the call and attributes the SQL it runs to it; nested timed calls keep
+    # their own name for their own queries.
+    if not ENABLED:
+        return func
+    name = func.__qualname__ if func.__module__ == '__main__' else f'{func.__module__}.{func.__qualname__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_context, 'function', None)
+        _context.function = name
+        started = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            _context.function = outer
+            _add(_functions, name, (time.perf_counter() - started) * 1000, _rows(result))
+    return wrapper
+
+
+def name_page(name):
+    _context.page = name
+
+
+@contextmanager
+def page_render():
+    # Times one script run; the page records its own name through name_page
+    _context.page = None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ENABLED:
+            _add(_pages, _context.page or 'unknown', (time.perf_counter() - started) * 1000)
+
+
+def set_slow_query_ms(ms):
+    global SLOW_QUERY_MS
+    SLOW_QUERY_MS = float(ms)
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+        _queries.clear()
+        _pages.clear()
+        _slow.clear()
+
+
+def snapshot():
+    with _lock:
+        return {
+            'taken_at': datetime.now().isoformat(timespec='seconds'),
+            'slow_query_ms': SLOW_QUERY_MS,
+            'buckets_ms': list(BUCKETS_MS),
+            'functions': {name: stat.summary() for name, stat in _functions.items()},
+            'queries': [dict(function=function, sql=sql, **stat.summary())
+                        for (function, sql), stat in _queries.items()],
+            'pages': {name: stat.summary() for name, stat in _pages.items()},
+            'slow_queries': list(_slow),
+        }
+
+
+def export_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def frames(data=None):
+    # DataFrames for display or CSV export, slowest first
+    data = data or snapshot()
+    columns = ['calls', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'rows']
+
+    def table(rows, key):
+        df = pd.DataFrame(rows, columns=key + columns + ['histogram'])
+        return df.sort_values('total_ms', ascending=False).reset_index(drop=True)
+
+    return {
+        'functions': table([dict(function=name, **summary) for name, summary in data['functions'].items()], ['function']),
+        'queries': table(data['queries'], ['function', 'sql']),
+        'pages': table([dict(page=name, **summary) for name, summary in data['pages'].items()], ['page']),
+        'slow_queries': pd.DataFrame(data['slow_queries'], columns=['at', 'function', 'sql', 'ms', 'rows']),
+    }
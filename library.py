@@ -2,294 +2,364 @@ import streamlit as st
 import sqlite3
 from streamlit_option_menu import option_menu
 import pandas as pd
-import numpy as np
 from streamlit_card import card
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
-import matplotlib.pyplot as plt
 import plotly.express as px
-import seaborn as sns
-
-def load_dataset():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS books(
-        bookID INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT,
-        authors TEXT,
-        average_rating FLOAT,
-        language_code TEXT,
-        ratings_count INTEGER,
-        publisher TEXT
-    )''')
-    try:
-        df = pd.read_csv('books.csv', on_bad_lines='skip')
-    except pd.errors.ParserError as e:
-        st.error(f"Error loading CSV: {e}")
-        return
-
-    cursor.execute('DELETE FROM books')  # Clear the table before reloading the data
-
-    for row in df.itertuples():
-        cursor.execute('''
-        INSERT INTO books (title, authors, average_rating, language_code, ratings_count, publisher)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (row.title, row.authors, row.average_rating, row.language_code, row.ratings_count, row.publisher))
-    conn.commit()
-    conn.close()
+from catalog_import import import_catalog
+from db import connection
+from migrations import migrate
+import search
+from similar_books import refresh_model_in_background
+import auth
+import circulation
+from query_cache import bump, cache_stats, cached
+from instrumentation import name_page, page_render, timed
+import instrumentation
+from recommendations import HISTORY_SIZE, also_borrowed_books, for_student, loan_history, popular, similar_books
+from popularity import refresh_popularity
+from rollups import date_bounds, fetch_loan_stats
+from dashboard import dashboard_figures
+import snapshots
+from policy import assess, last_run, overdue_report, run_overdue_job
+from catalog import COUNT_CAP, PAGE_SIZE, SORT_COLUMNS, books_by_id, estimate_count, fetch_availability_page, fetch_page, shared_frame
+
+# Search and recommendation results: cards per row, and cards fetched per "Load more"
+CARD_COLUMNS = 3
+RESULT_PAGE_SIZE = 12
+
+
+@timed
+def load_dataset(force=False):
+    with connection() as conn:
+        try:
+            stats = import_catalog(conn, 'books.csv', force=force)
+        except (pd.errors.ParserError, ValueError) as e:
+            st.error(f"Error loading CSV: {e}")
+            return None
+    if not stats['skipped']:
+        bump('books')
+        refresh_popularity()
+        refresh_model_in_background()
+    return stats
 
 
 def create_user():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS students (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        student_id VARCHAR UNIQUE,
-        name TEXT,
-        password VARCHAR
-    )
-    ''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS librarystaff (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        employee_id VARCHAR UNIQUE,
-        name TEXT,
-        password VARCHAR
-    )
-    ''')
+    migrate()
     test_data = [
         ('S001', 'Alice', 'password123'),
         ('S002', 'Bob', 'password456'),
         ('S003', 'Charlie', 'password789')
     ]
-    cursor.executemany('''
-    INSERT OR IGNORE INTO students (student_id, name, password) VALUES (?, ?, ?)
-    ''', test_data)
-    conn.commit()
-    conn.close()
-
-
+    with connection() as conn:
+        existing = {row[0] for row in conn.execute('SELECT student_id FROM students WHERE student_id IN (?, ?, ?)',
+                                                   [student_id for student_id, _, _ in test_data])}
+    # Only missing accounts pay for hashing a password
+    for student_id, name, password in test_data:
+        if student_id not in existing:
+            try:
+                auth.register('student', student_id, name, password)
+            except sqlite3.IntegrityError:
+                pass
+
+
+@timed
 def student_register(student_id, name, password):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    INSERT INTO students (student_id, name, password) VALUES (?, ?, ?)
-    ''', (student_id, name, password))
-    conn.commit()
-    conn.close()
+    auth.register('student', student_id, name, password)
 
 
+@timed
 def check_credentials(student_id, name, password):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT * FROM students WHERE student_id = ? AND name = ? AND password = ?
-    ''', (student_id, name, password))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    return auth.authenticate('student', student_id, name, password)
 
 
+@timed
 def admin_register(employee_id, name, password):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    INSERT INTO librarystaff (employee_id, name, password) VALUES (?, ?, ?)
-    ''', (employee_id, name, password))
-    conn.commit()
-    conn.close()
+    auth.register('admin', employee_id, name, password)
 
 
+@timed
 def check_admin_credentials(employee_id, name, password):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT * FROM librarystaff WHERE employee_id = ? AND name = ? AND password = ?
-    ''', (employee_id, name, password))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    return auth.authenticate('admin', employee_id, name, password)
 
 
+@timed
 def fetch_books():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT * FROM books
-    ''')
-    books = cursor.fetchall()
-    conn.close()
-    return books
-
-def fetch_loaned_books_by_date():
-    conn = sqlite3.connect('students.db')
-    query = '''
-    SELECT loan_date, COUNT(*) as count
-    FROM book_loans
-    GROUP BY loan_date
-    ORDER BY loan_date
-    '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-
-
-def get_recommendations(n=10):
-    conn = sqlite3.connect('students.db')
-    query = '''
-    SELECT title, authors, average_rating FROM books
-    WHERE average_rating < 5
-    ORDER BY average_rating DESC
-    '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    df = df.sample(frac=1).reset_index(drop=True)  # Shuffle the DataFrame
-    return df.head(n)
-
-
-def random_personal_recommendations(user_id, n=5):
-    books = fetch_books()
-    if not books:
-        return []
-    df = pd.DataFrame(books, columns=['bookID', 'title', 'authors', 'average_rating', 'language_code', 'ratings_count', 'publisher'])
-    random_books = df.sample(n)
-    return random_books
+    # The process-wide catalog frame, shared by every session rather than rebuilt per session
+    return shared_frame()
+
+@timed
+@cached('loan_daily_stats')
+def fetch_loaned_books_by_date(start=None, end=None):
+    stats = fetch_loan_stats(start, end)
+    return stats.loc[stats['loans'] > 0, ['period', 'loans']].rename(columns={'period': 'loan_date', 'loans': 'count'}).reset_index(drop=True)
+
+
+
+# Offline reports read the memory-mapped Arrow snapshot, not the live database
+@timed
+def snapshot_monthly_activity():
+    return snapshots.monthly_activity()
+
+@timed
+def snapshot_top_books(n=10):
+    return snapshots.top_books(n=n)
+
+@timed
+def snapshot_language_share():
+    return snapshots.language_share()
+
+@timed
+def get_recommendations(n=10, randomize=True):
+    return popular(n, randomize=randomize)
+
+
+@timed
+def fetch_similar_books(book_id, n=10):
+    return similar_books(book_id, n)
+
+
+@timed
+def fetch_loan_history(student_id, limit=HISTORY_SIZE):
+    return loan_history(student_id, limit)
+
+
+@timed
+def fetch_also_borrowed(book_id, n=10):
+    return also_borrowed_books(book_id, n)
 
 
-def search_books(keyword, search_by):
-    conn = sqlite3.connect('students.db')
-    query = f"SELECT * FROM books WHERE {search_by} LIKE ?"
-    df = pd.read_sql_query(query, conn, params=[f"%{keyword}%"])
-    conn.close()
-    return df
+@timed
+def personal_recommendations(user_id, n=5):
+    return for_student(user_id, n)
+
+
+@timed
+def search_books(keyword, search_by, limit=None, offset=0):
+    return search.search_books(keyword, search_by, limit=limit, offset=offset)
+
+@timed
+@cached('books')
+def count_search_results(keyword, search_by):
+    return search.count_books(keyword, search_by)
 
 def create_book_loans():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS book_loans(
-                   loan_id INTEGER PRIMARY KEY AUTOINCREMENT ,
-                   student_id VARCHAR,
-                   book_id INTEGER,
-                   loan_date DATE,
-                   return_date DATE,
-                   FOREIGN KEY(student_id) REFERENCES students(student_id),
-                   FOREIGN KEY (book_id) REFERENCES books(bookID))''')
-    conn.commit()
-    conn.close()
+    migrate()
 
 
+@timed
 def issue_book(student_id, book_id):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    loan_date = datetime.now().date()
-    
-    # Check if the book exists
-    cursor.execute('''
-    SELECT title FROM books WHERE bookID = ?
-    ''', (book_id,))
-    book_name_row = cursor.fetchone()
-    if book_name_row is None:
-        conn.close()
-        return None, f"No book found with ID {book_id}"
-    
-    book_name = book_name_row[0]
-
-    # Issue the book
-    cursor.execute('''
-    INSERT INTO book_loans (student_id, book_id, loan_date, return_date) VALUES(?,?,?,NULL)''', (student_id, book_id, loan_date))
-    conn.commit()
-    conn.close()
-    return book_name, None
+    return circulation.issue_book(student_id, book_id)
 
+@timed
 def return_book(loan_id):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    return_date = datetime.now().date()
-    cursor.execute('''
-        UPDATE book_loans 
-        SET return_date = ?
-        WHERE loan_id = ?
-        ''', (return_date, loan_id))
-    conn.commit()
-    conn.close()
-
-def fetch_return_data_by_date():
-    conn = sqlite3.connect('students.db')
-    query = '''
-    SELECT return_date, COUNT(*) as count
-    FROM book_loans
-    WHERE return_date IS NOT NULL
-    GROUP BY return_date
-    ORDER BY return_date
-    '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    return circulation.return_book(loan_id)
+
+@timed
+def issue_books(loans):
+    return circulation.issue_books(loans)
+
+@timed
+def return_books(loan_ids):
+    return circulation.return_books(loan_ids)
+
+def bulk_loans_from_csv(uploaded, action):
+    # Issue expects student_id and book_id columns, Return expects loan_id
+    columns = ['student_id', 'book_id'] if action == "Issue" else ['loan_id']
+    df = pd.read_csv(uploaded, dtype=str)
+    df.columns = df.columns.str.strip().str.lower()
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        return None, f"CSV is missing column(s): {', '.join(missing)}"
+    ids = df[columns[-1]].str.strip()
+    valid = ids.str.fullmatch(r'\d+').fillna(False)
+    if action == "Issue":
+        loans = list(zip(df.loc[valid, 'student_id'].str.strip(), ids[valid].astype(int)))
+        results = issue_books(loans)
+    else:
+        results = return_books(ids[valid].astype(int).tolist())
+    # Explicit columns keep 'error' present when the CSV has no rows
+    result_columns = ['student_id', 'book_id', 'loan_id', 'title', 'error'] if action == "Issue" else ['loan_id', 'book_id', 'error']
+    results = pd.DataFrame(results, columns=result_columns)
+    if not valid.all():
+        invalid = pd.DataFrame({columns[-1]: ids[~valid], 'error': 'Not a valid ID'})
+        results = pd.concat([results, invalid], ignore_index=True)
+    return results, None
+
+@timed
+@cached('loan_daily_stats')
+def fetch_return_data_by_date(start=None, end=None):
+    stats = fetch_loan_stats(start, end)
+    return stats.loc[stats['returns'] > 0, ['period', 'returns']].rename(columns={'period': 'return_date', 'returns': 'count'}).reset_index(drop=True)
 
 
 
+@timed
+@cached('books', 'book_loans')
 def fetch_loaned_books(student_id=None):
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    if student_id:
-        cursor.execute('''
-        SELECT book_loans.loan_id, books.title, books.authors, book_loans.loan_date, book_loans.return_date
-        FROM book_loans
-        JOIN books ON book_loans.book_id = books.bookID
-        WHERE book_loans.student_id = ?
-        ''', (student_id,))
-    else:
-        cursor.execute('''
-        SELECT book_loans.loan_id, books.title, books.authors, book_loans.loan_date, book_loans.return_date, book_loans.student_id
-        FROM book_loans
-        JOIN books ON book_loans.book_id = books.bookID
-        ''')
-    books = cursor.fetchall()
-    conn.close()
-    return books
+    return circulation.loaned_books(student_id)
+
+def with_loan_status(df):
+    # Status, days overdue and fine for every row at once, from the Due Date and Return Date columns
+    assessed = assess(df, due_column='Due Date', return_column='Return Date')
+    return assessed.rename(columns={'status': 'Status', 'days_overdue': 'Days Overdue', 'fine': 'Fine'})
+
+@timed
+def fetch_overdue_report(student_id=None):
+    return overdue_report(student_id)
+
+@timed
+def run_overdue_check():
+    return run_overdue_job()
 
+@timed
+@cached('books', 'book_loans', 'students')
 def fetch_return_data():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT bl.loan_id, bl.student_id, s.name, bl.book_id, b.title, bl.loan_date, bl.return_date
-    FROM book_loans bl
-    JOIN students s ON bl.student_id = s.student_id
-    JOIN books b ON bl.book_id = b.bookID
-    WHERE bl.return_date IS NOT NULL
-    ''')
-    return_data = cursor.fetchall()
-    conn.close()
-    return return_data
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT bl.loan_id, bl.student_id, s.name, bl.book_id, b.title, bl.loan_date, bl.return_date
+        FROM book_loans bl
+        JOIN students s ON bl.student_id = s.student_id
+        JOIN books b ON bl.book_id = b.bookID
+        WHERE bl.return_date IS NOT NULL
+        ''')
+        return cursor.fetchall()
 
+@timed
+@cached('students')
 def fetch_all_users():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT student_id, name FROM students')
-    students = cursor.fetchall()
-    conn.close()
-    return students
-
-def fetch_books_availability():
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT b.bookID, b.title, b.authors, 
-           CASE 
-               WHEN bl.loan_id IS NULL THEN 'Available' 
-               ELSE 'Loaned Out' 
-           END AS status
-    FROM books b
-    LEFT JOIN book_loans bl ON b.bookID = bl.book_id AND bl.return_date IS NULL
-    ''')
-    books_availability = cursor.fetchall()
-    conn.close()
-    return books_availability
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_id, name FROM students')
+        return cursor.fetchall()
+
+@timed
+@cached('books')
+def fetch_books_availability(after_id=None, limit=None):
+    return fetch_availability_page(after_id, limit)
+
+
+@timed
+def fetch_book_availability(book_id):
+    return circulation.availability(book_id)
+
+
+@timed
+@cached('books')
+def fetch_books_page(after=None, limit=PAGE_SIZE, sort='bookID', descending=False, **filters):
+    return fetch_page(after, limit, sort, descending, **filters)
+
+
+def catalog_pager(key, signature=None):
+    # Keeps the stack of keyset cursors for the pages visited so far; a new signature
+    # (sort or filter change) starts again from the first page.
+    state = st.session_state.setdefault(key, {'signature': signature, 'cursors': [None], 'next': None})
+    if state['signature'] != signature:
+        state.update(signature=signature, cursors=[None], next=None)
+    return state
+
+
+def pager_controls(key, state):
+    previous_col, page_col, next_col = st.columns([1, 2, 1])
+    if previous_col.button("Previous", key=f"{key}_prev", disabled=len(state['cursors']) == 1):
+        state['cursors'].pop()
+        st.rerun()
+    page_col.write(f"Page {len(state['cursors'])}")
+    if next_col.button("Next", key=f"{key}_next", disabled=state['next'] is None):
+        state['cursors'].append(state['next'])
+        st.rerun()
+
+
+def count_caption(total, exact, noun):
+    if exact:
+        st.caption(f"{total} {noun}")
+    elif total == COUNT_CAP:
+        st.caption(f"More than {COUNT_CAP} {noun}")
+    else:
+        st.caption(f"About {total} {noun}")
+
+
+def book_cards(key, books):
+    # Rows of CARD_COLUMNS cards; positional keys keep books with the same title apart
+    for position, (_, row) in enumerate(books.iterrows()):
+        if position % CARD_COLUMNS == 0:
+            columns = st.columns(CARD_COLUMNS)
+        with columns[position % CARD_COLUMNS]:
+            card(
+                title=row['title'],
+                text=f"by {row['authors']} (Rating: {row['average_rating']})",
+                styles={
+                    "card": {
+                        "width": "100%",
+                        "height": "300px"
+                    }
+                },
+                key=f"{key}_{position}"
+            )
+
+
+def result_view(key, fetch, signature, count=None):
+    # fetch(limit, offset) returns one page of books. Pages already loaded stay in the
+    # session, so "Load more" fetches and renders only what was asked for; a new signature
+    # (query or options change) starts again from the first page.
+    state = st.session_state.setdefault(key, {'signature': signature, 'pages': [], 'done': False})
+    if state['signature'] != signature:
+        state.update(signature=signature, pages=[], done=False)
+
+    def load_page():
+        loaded = sum(len(page) for page in state['pages'])
+        page = fetch(RESULT_PAGE_SIZE, loaded)
+        # Only the IDs stay in the session; the cards read their text from the shared catalog frame
+        state['pages'].append(page['bookID'].tolist())
+        total, exact = count if count else (None, False)
+        state['done'] = len(page) < RESULT_PAGE_SIZE or (exact and loaded + len(page) >= total)
+
+    if not state['pages']:
+        load_page()
+    if count:
+        count_caption(*count, "results")
+    for number, page in enumerate(state['pages']):
+        book_cards(f"{key}_{number}", books_by_id(page))
+    if not state['done'] and st.button("Load more", key=f"{key}_more"):
+        load_page()
+        st.rerun()
+
+
+def frame_result_view(key, books):
+    # Recommendation lists arrive whole and small; they page through the same card grid
+    result_view(key, lambda limit, offset: books.iloc[offset:offset + limit], tuple(books['bookID']), (len(books), True))
+
+
+def book_database_view(key):
+    sort_col, order_col, language_col, rating_col = st.columns(4)
+    sort = sort_col.selectbox("Sort by", SORT_COLUMNS, key=f"{key}_sort")
+    descending = order_col.checkbox("Descending", key=f"{key}_desc")
+    language = language_col.text_input("Language code", key=f"{key}_language").strip() or None
+    min_rating = rating_col.slider("Minimum rating", 0.0, 5.0, 0.0, 0.1, key=f"{key}_rating") or None
+    filters = {'language': language, 'min_rating': min_rating}
+
+    state = catalog_pager(key, (sort, descending, language, min_rating))
+    books, state['next'] = fetch_books_page(state['cursors'][-1], PAGE_SIZE, sort, descending, **filters)
+    if not books:
+        st.write("No books available in the library.")
+        return
+    count_caption(*estimate_count(**filters), "books")
+    df = pd.DataFrame(books, columns=['Book ID', 'Title', 'Authors', 'Average Rating', 'Language Code', 'Ratings Count', 'Publisher'])
+    st.dataframe(df)
+    pager_controls(key, state)
+
+
+def book_availability_view(key):
+    state = catalog_pager(key)
+    after = state['cursors'][-1]
+    book_avail = fetch_books_availability(after, PAGE_SIZE)
+    state['next'] = book_avail[-1][0] if len(book_avail) == PAGE_SIZE else None
+    if book_avail:
+        df = pd.DataFrame(book_avail,columns=['Book ID', 'Title', 'Authors', 'Status', 'Available Copies', 'Copies'])
+        st.dataframe(df)
+        pager_controls(key, state)
+    else:
+        st.write("No books found in the database")
 def main():
     st.sidebar.title("NAVIGATION BAR")
     with st.sidebar.expander("Menu", expanded=True):
@@ -301,6 +371,7 @@ def main():
             default_index=0
         )
 
+    name_page(page)
     if page == "Register":
         st.title("STUDENT LIBRARY MANAGEMENT SYSTEM")
         st.header("Register according to your role in the organization")
@@ -375,85 +446,84 @@ def main():
     
     elif page == "Library":
         st.header("Library")
-        load_dataset()  
-        books = fetch_books()
-        if books:
+        import_stats = load_dataset()
+        if import_stats and not import_stats['skipped']:
+            st.info(f"Catalog updated: {import_stats['added']} added, {import_stats['changed']} changed, {import_stats['removed']} removed, {import_stats['retired']} retired, {import_stats['restored']} restored.")
+        total_books, _ = estimate_count()
+        if total_books:
             with st.expander("Book Database", expanded=True):
-                df = pd.DataFrame(books, columns=['Book ID', 'Title', 'Authors', 'Average Rating', 'Language Code', 'Ratings Count', 'Publisher'])
-                st.dataframe(df)
+                book_database_view("library_books")
 
             selected2 = option_menu("LIBRARY ENGINE", ["Popularity-Based Recommendations", "Personal Recommendations", "Book Search"], 
                                     icons=['broadcast', 'person', 'search'], 
                                     menu_icon="cast", default_index=0, orientation="horizontal")
+            name_page(f"{page} / {selected2}")
             
             if selected2 == "Popularity-Based Recommendations":
                 st.write("### Popularity-based Recommendations")
                 num_recommendations = st.slider("Number of recommendations", 1, 20, 10)
                 if st.button("Get Popular Books"):
-                    recommendations = get_recommendations(num_recommendations)
+                    # Kept in the session so reruns from "Load more" page through the same draw
+                    st.session_state["popular_books"] = get_recommendations(num_recommendations)
+                recommendations = st.session_state.get("popular_books")
+                if recommendations is not None:
                     if not recommendations.empty:
                         st.write("### Popular Books")
-                        for index, row in recommendations.iterrows():
-                            res = card(
-                                title=row['title'],
-                                text=f"by {row['authors']} (Rating: {row['average_rating']})",
-                                styles={
-                                    "card": {
-                                        "width": "100%",
-                                        "height": "300px"
-                                    }
-                                }
-                            )
-                            st.markdown(res)
+                        frame_result_view("popular_results", recommendations)
                     else:
                         st.warning("No books found in the database.")
                     
             if selected2 == "Personal Recommendations":
                 st.write("### Personal Recommendations")
-                user_id = st.text_input("Enter your user ID for personal recommendations")
+                user_id = st.text_input("Enter your user ID for personal recommendations", value=st.session_state.get("user_id", ""))
                 num_recommendations = st.selectbox("Number of personal recommendations", [5, 10, 15, 20])
+                similar_to = st.number_input("Or find books similar to Book ID", min_value=0, step=1)
                 if st.button("Get Personal Recommendations"):
-                    if user_id:
-                        recommendations = random_personal_recommendations(user_id, num_recommendations)
-                        if not recommendations.empty:
-                            st.write("### Recommended Books for You")
-                            for index, row in recommendations.iterrows():
-                                res = card(
-                                    title=row['title'],
-                                    text=f"by {row['authors']} (Rating: {row['average_rating']})",
-                                    styles={
-                                        "card": {
-                                            "width": "100%",
-                                            "height": "300px"
-                                        }
-                                    }
-                                )
-                                st.markdown(res)
-                        else:
-                            st.warning("No books found in the database.")
+                    if similar_to:
+                        st.session_state["personal_books"] = ('similar', int(similar_to), fetch_similar_books(int(similar_to), num_recommendations), fetch_also_borrowed(int(similar_to), num_recommendations))
+                    elif user_id:
+                        st.session_state["personal_books"] = ('student', user_id, personal_recommendations(user_id, num_recommendations), None)
                     else:
+                        st.session_state.pop("personal_books", None)
                         st.error("Please enter your user ID.")
+                personal = st.session_state.get("personal_books")
+                if personal and personal[0] == 'similar':
+                    _, book_id, recommendations, also = personal
+                    if not recommendations.empty:
+                        st.write(f"### Books Similar to Book {book_id}")
+                        frame_result_view("similar_results", recommendations)
+                    else:
+                        st.warning(f"No book found with ID {book_id}")
+                    if not also.empty:
+                        st.write("### Students Who Borrowed This Also Borrowed")
+                        frame_result_view("also_borrowed_results", also)
+                elif personal:
+                    recommendations = personal[2]
+                    if not recommendations.empty:
+                        st.write("### Recommended Books for You")
+                        frame_result_view("personal_results", recommendations)
+                    else:
+                        st.warning("No books found in the database.")
 
             if selected2 == "Book Search":
                 st.write("### Book Search")
-                search_by = st.selectbox("Search by", ["authors", "publisher", "average_rating"])
-                keyword = st.text_input(f"Enter the {search_by}")
+                search_by = st.selectbox("Search by", ["all fields", "title", "authors", "publisher", "average_rating"])
+                if search_by == "average_rating":
+                    keyword = st.text_input("Enter a minimum rating or a range such as 3.5-4.2")
+                else:
+                    keyword = st.text_input(f"Enter the {search_by}")
                 if st.button("Search"):
-                    results = search_books(keyword, search_by)
-                    if not results.empty:
+                    st.session_state["book_search"] = (keyword, search_by)
+                query = st.session_state.get("book_search")
+                if query:
+                    try:
+                        count = count_search_results(*query)
+                    except ValueError as e:
+                        st.error(str(e))
+                        count = (0, True)
+                    if count[0]:
                         st.write("### Search Results")
-                        for index, row in results.iterrows():
-                            res = card(
-                                title=row['title'],
-                                text=f"by {row['authors']} (Rating: {row['average_rating']})",
-                                styles={
-                                    "card": {
-                                        "width": "100%",
-                                        "height": "300px"
-                                    }
-                                }
-                            )
-                            st.markdown(res)
+                        result_view("search_results", lambda limit, offset: search_books(*query, limit=limit, offset=offset), query, count)
                     else:
                         st.warning("No books found for the given search criteria.")
     elif page == "Book Loans":
@@ -465,20 +535,10 @@ def main():
                 st.write(f"Logged in as {st.session_state['user_name']} (Student)")
 
                 with st.expander("Book Database", expanded=True):
-                    books = fetch_books()
-                    if books:
-                        df = pd.DataFrame(books, columns=['Book ID', 'Title', 'Authors', 'Average Rating', 'Language Code', 'Ratings Count', 'Publisher'])
-                        st.dataframe(df)
-                    else:
-                        st.write("No books available in the library.")
+                    book_database_view("loans_books")
                 
                 with st.expander("Book Availability",expanded=True):
-                    book_avail = fetch_books_availability()
-                    if book_avail:
-                        df = pd.DataFrame(book_avail,columns=['Book ID', 'Title', 'Authors', 'Status'])
-                        st.dataframe(df)
-                    else:
-                        st.write("No books found in the database")
+                    book_availability_view("loans_availability")
 
                 with st.expander("Issue Book", expanded=True):
                     book_id = st.number_input("Book ID", min_value=1, step=1)
@@ -492,24 +552,44 @@ def main():
                 with st.expander("Return Book", expanded=True):
                     loan_id = st.number_input("Loan ID", min_value=1, step=1)
                     if st.button("Return Book"):
-                        return_book(loan_id)
-                        st.success(f"Book with Loan ID {loan_id} returned successfully.")
+                        error_message = return_book(loan_id)
+                        if error_message:
+                            st.error(error_message)
+                        else:
+                            st.success(f"Book with Loan ID {loan_id} returned successfully.")
 
                 with st.expander("My Loaned Books", expanded=True):
                     loaned_books = fetch_loaned_books(student_id)
                     if loaned_books:
-                        df = pd.DataFrame(loaned_books, columns=['Loan ID', 'Title', 'Authors', 'Loan Date', 'Return Date'])
+                        df = with_loan_status(pd.DataFrame(loaned_books, columns=['Loan ID', 'Title', 'Authors', 'Loan Date', 'Due Date', 'Return Date']))
                         st.dataframe(df)
+                        overdue = df[df['Status'] == 'Overdue']
+                        if not overdue.empty:
+                            st.warning(f"{len(overdue)} overdue loan(s), {overdue['Fine'].sum():.2f} in fines so far. Please return them as soon as possible.")
                     else:
                         st.write("You have no loaned books.")
 
             elif st.session_state["user_role"] == "admin":
                 st.write(f"Logged in as {st.session_state['user_name']} (Admin)")
 
+                with st.expander("Bulk Issue / Return", expanded=False):
+                    action = st.radio("Action", ["Issue", "Return"], horizontal=True)
+                    uploaded = st.file_uploader("CSV with student_id, book_id columns (Issue) or a loan_id column (Return)", type="csv")
+                    if uploaded is not None and st.button(f"{action} Books"):
+                        results, error_message = bulk_loans_from_csv(uploaded, action)
+                        if error_message:
+                            st.error(error_message)
+                        else:
+                            failed = results['error'].notna().sum()
+                            st.success(f"{len(results) - failed} of {len(results)} processed.")
+                            if failed:
+                                st.warning(f"{failed} row(s) could not be processed.")
+                            st.dataframe(results)
+
                 with st.expander("View All Loaned Books", expanded=True):
                     loaned_books = fetch_loaned_books()
                     if loaned_books:
-                        df = pd.DataFrame(loaned_books, columns=['Loan ID', 'Title', 'Authors', 'Loan Date', 'Return Date', 'Student ID'])
+                        df = with_loan_status(pd.DataFrame(loaned_books, columns=['Loan ID', 'Title', 'Authors', 'Loan Date', 'Due Date', 'Return Date', 'Student ID']))
                         st.dataframe(df)
                     else:
                         st.write("No loaned books found.")
@@ -517,6 +597,25 @@ def main():
                     if not loaned_by_date.empty:
                         st.write("### Loaned Books by date")
                         st.line_chart(loaned_by_date.set_index('loan_date'))
+                with st.expander("Overdue Loans", expanded=True):
+                    if st.button("Run overdue check now"):
+                        result = run_overdue_check()
+                        st.success(f"{result['overdue']} overdue loans as of {result['as_of']}, {result['fines']:.2f} in fines.")
+                    as_of, run_at = last_run()
+                    if as_of:
+                        st.caption(f"As of {as_of}, checked at {run_at}. Schedule policy.py nightly to keep this current.")
+                        overdue = fetch_overdue_report()
+                        if not overdue.empty:
+                            count_col, fines_col = st.columns(2)
+                            count_col.metric("Overdue loans", len(overdue))
+                            fines_col.metric("Fines outstanding", f"{overdue['fine'].sum():.2f}")
+                            df = overdue.rename(columns={'loan_id': 'Loan ID', 'student_id': 'Student ID', 'name': 'Student Name', 'book_id': 'Book ID', 'title': 'Book Title', 'loan_date': 'Loan Date', 'due_date': 'Due Date', 'days_overdue': 'Days Overdue', 'fine': 'Fine'})
+                            st.dataframe(df)
+                        else:
+                            st.write("No overdue loans.")
+                    else:
+                        st.write("The overdue check has not run yet.")
+
                 with st.expander("Loaning Information",expanded=True):
                     return_data =  fetch_return_data()
                     if return_data:
@@ -546,37 +645,80 @@ def main():
             
             elif st.session_state["user_role"] == "admin":
                 st.subheader("Admin Dashboard")
+
+                with st.expander("Query cache"):
+                    cache = cache_stats()
+                    hits_col, misses_col, rate_col, size_col = st.columns(4)
+                    hits_col.metric("Hits", cache['hits'])
+                    misses_col.metric("Misses", cache['misses'])
+                    rate_col.metric("Hit rate", f"{cache['hit_rate']:.0%}")
+                    size_col.metric("Size", f"{cache['bytes'] / 2**20:.1f} MB", f"{cache['entries']} entries", delta_color="off")
+                    st.write(f"{cache['evictions']} evictions, {cache['invalidations']} invalidated by writes")
+
+                with st.expander("Performance"):
+                    slow_ms = st.number_input("Slow query threshold (ms)", min_value=1.0, value=float(instrumentation.SLOW_QUERY_MS), step=10.0)
+                    if slow_ms != instrumentation.SLOW_QUERY_MS:
+                        instrumentation.set_slow_query_ms(slow_ms)
+                    perf = instrumentation.frames()
+                    histogram_index = [f"<= {bound} ms" for bound in instrumentation.BUCKETS_MS] + [f"> {instrumentation.BUCKETS_MS[-1]} ms"]
+                    for label, key, name_column in [("Page renders", 'pages', 'page'), ("Functions", 'functions', 'function')]:
+                        st.write(f"#### {label}")
+                        if perf[key].empty:
+                            st.write("Nothing recorded yet.")
+                            continue
+                        st.dataframe(perf[key].drop(columns='histogram'))
+                        selected = st.selectbox("Latency histogram for", perf[key][name_column], key=f"perf_{key}")
+                        buckets = perf[key].loc[perf[key][name_column] == selected, 'histogram'].iloc[0]
+                        fig = px.bar(x=histogram_index, y=buckets, labels={'x': 'Latency', 'y': 'Calls'})
+                        st.plotly_chart(fig)
+                    st.write("#### Queries")
+                    st.dataframe(perf['queries'].drop(columns='histogram'))
+                    st.write(f"#### Slow queries (>= {instrumentation.SLOW_QUERY_MS:g} ms)")
+                    st.dataframe(perf['slow_queries'])
+                    json_col, csv_col, reset_col = st.columns(3)
+                    json_col.download_button("Export JSON", instrumentation.export_json(), file_name="bookhive-performance.json", mime="application/json")
+                    csv_col.download_button("Export queries CSV", perf['queries'].to_csv(index=False), file_name="bookhive-queries.csv", mime="text/csv")
+                    if reset_col.button("Reset statistics"):
+                        instrumentation.reset()
+                        st.rerun()
+
+                with st.expander("Offline analytics"):
+                    manifest = snapshots.read_manifest()
+                    if st.button("Refresh snapshot"):
+                        result = snapshots.refresh()
+                        st.success(f"Snapshot refreshed: {result['written']} loan partitions rewritten, {result['removed']} removed.")
+                        manifest = snapshots.read_manifest()
+                    if manifest:
+                        st.write(f"Snapshot taken {manifest['taken_at']}: {manifest['books']} books, {manifest['loans']} loans in {len(manifest['loan_partitions'])} monthly partitions.")
+                        monthly = snapshot_monthly_activity()
+                        st.bar_chart(monthly, x='month', y=['loans', 'returned'])
+                        st.dataframe(monthly)
+                        top_col, language_col = st.columns(2)
+                        top_col.dataframe(snapshot_top_books())
+                        language_col.dataframe(snapshot_language_share())
+                    else:
+                        st.write("No snapshot yet. Refresh one here or run snapshots.py on a schedule.")
                 
-                loan_data = fetch_loaned_books_by_date()
-                return_data = fetch_return_data_by_date()
+                first_day, last_day = date_bounds()
+                if first_day:
+                    first_day = datetime.strptime(first_day, '%Y-%m-%d').date()
+                    last_day = datetime.strptime(last_day, '%Y-%m-%d').date()
+                    date_range = st.date_input("Date range", (first_day, last_day), min_value=first_day, max_value=last_day)
+                    start, end = date_range if len(date_range) == 2 else (date_range[0], last_day)
+                    granularity = st.radio("Group by", ["day", "week", "month"], horizontal=True)
+                    figures = dashboard_figures(start, end, granularity)
+                else:
+                    figures = None
 
-                if not loan_data.empty and not return_data.empty:
-                    loan_df = loan_data.rename(columns={'loan_date': 'Date', 'count': 'Count'})
-                    return_df = return_data.rename(columns={'return_date': 'Date', 'count': 'Count'})
-                    
-                    
+                if figures:
                     st.subheader("Books Loaned Over Time")
-                    fig, ax = plt.subplots()
-                    loan_df.plot(x='Date', y='Count', ax=ax, legend=False)
-                    ax.set_title('Books Loaned Over Time')
-                    ax.set_xlabel('Date')
-                    ax.set_ylabel('Count')
-                    st.pyplot(fig)
-
+                    st.image(figures['loaned'])
 
                     st.subheader("Books Returned Over Time")
-                    fig, ax = plt.subplots()
-                    return_df.plot(x='Date', y='Count', ax=ax, legend=False)
-                    ax.set_title('Books Returned Over Time')
-                    ax.set_xlabel('Date')
-                    ax.set_ylabel('Count')
-                    st.pyplot(fig)
+                    st.image(figures['returned'])
 
                     st.subheader("Loaned vs Returned Books Over Time ")
-                    combined_df = loan_df.merge(return_df, on='Date', how='outer', suffixes=('_loaned', '_returned')).fillna(0)
-                    fig = px.line(combined_df, x='Date', y=['Count_loaned', 'Count_returned'], labels={'value': 'Count', 'variable': 'Type'})
-                    fig.update_layout(title='Loaned vs Returned Books Over Time', xaxis_title='Date', yaxis_title='Count')
-                    st.plotly_chart(fig)
+                    st.plotly_chart(figures['combined'])
                 else:
                     st.write("No data available for loans and returns.")
             else:
@@ -585,4 +727,5 @@ def main():
 if __name__ == '__main__':
     create_user()
     create_book_loans()
-    main()
\ No newline at end of file
+    with page_render():
+        main()
\ No newline at end of file
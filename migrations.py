@@ -0,0 +1,426 @@
+import argparse
+import sqlite3
+from datetime import datetime
+
+import auth
+import author_index
+import db
+import policy
+from co_borrowing import rebuild_matrix
+from popularity import refresh_popularity
+from rollups import backfill, create_triggers
+
+
+def _table_columns(cursor, table):
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+
+
+def create_core_tables(cursor):
+    # Matches the tables the app used to create ad hoc, so existing databases upgrade in place
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id VARCHAR UNIQUE,
+        name TEXT,
+        password VARCHAR
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS librarystaff (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id VARCHAR UNIQUE,
+        name TEXT,
+        password VARCHAR
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS books(
+        bookID INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        authors TEXT,
+        average_rating FLOAT,
+        language_code TEXT,
+        ratings_count INTEGER,
+        publisher TEXT,
+        source_key TEXT
+    )''')
+    if 'source_key' not in _table_columns(cursor, 'books'):
+        cursor.execute('ALTER TABLE books ADD COLUMN source_key TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_books_source_key ON books(source_key)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_meta(
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_loans(
+        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id VARCHAR,
+        book_id INTEGER,
+        loan_date DATE,
+        return_date DATE,
+        FOREIGN KEY(student_id) REFERENCES students(student_id),
+        FOREIGN KEY (book_id) REFERENCES books(bookID))''')
+
+
+def add_loan_indexes(cursor):
+    # Open loans per book: availability checks and the LEFT JOIN in fetch_books_availability
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_loans_open_book
+    ON book_loans(book_id) WHERE return_date IS NULL''')
+    # A student's loan history, newest last
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_loans_student_date
+    ON book_loans(student_id, loan_date)''')
+    # Covering indexes for the per-day loan and return aggregates
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_loans_loan_date
+    ON book_loans(loan_date)''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_loans_return_date
+    ON book_loans(return_date) WHERE return_date IS NOT NULL''')
+    # No ANALYZE here. On a new, near-empty database it froze statistics that later misled
+    # the planner; without sqlite_stat1 the planner's defaults pick the indexes HOT_QUERIES
+    # checks. Databases that ran the earlier version of this step keep its sqlite_stat1 rows
+    # until an ANALYZE against real data replaces them.
+
+
+def _fts_triggers(cursor, table):
+    columns = 'title, authors, publisher'
+    values = 'new.title, new.authors, new.publisher'
+    old_values = 'old.title, old.authors, old.publisher'
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.bookID, {values});
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.bookID, {old_values});
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF title, authors, publisher ON books BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.bookID, {old_values});
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.bookID, {values});
+    END''')
+    cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+
+
+def add_search_index(cursor):
+    # External-content FTS5 tables over books, kept in sync by triggers so both the
+    # catalog import and any direct writes are indexed.
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, authors, publisher,
+        content='books', content_rowid='bookID',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''')
+    _fts_triggers(cursor, 'books_fts')
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_trigram USING fts5(
+            title, authors, publisher,
+            content='books', content_rowid='bookID',
+            tokenize='trigram'
+        )''')
+    except sqlite3.OperationalError:
+        # The trigram tokenizer needs SQLite 3.34+; search falls back to word matching only
+        pass
+    else:
+        _fts_triggers(cursor, 'books_trigram')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_rating ON books(average_rating)')
+
+
+def add_catalog_sort_indexes(cursor):
+    # Keyset pagination sorts on these; the implicit bookID suffix makes each a unique key
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_title ON books(title)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_ratings_count ON books(ratings_count)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_language ON books(language_code)')
+
+
+def add_co_borrowing(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_cooccurrence(
+        book_a INTEGER NOT NULL,
+        book_b INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (book_a, book_b)
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_cooccurrence_rank
+    ON book_cooccurrence(book_a, count DESC)''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_borrowers(
+        book_id INTEGER PRIMARY KEY,
+        borrowers INTEGER NOT NULL
+    )''')
+    rebuild_matrix(cursor.connection)
+
+
+def add_popularity(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_popularity(
+        bookID INTEGER PRIMARY KEY,
+        score REAL NOT NULL,
+        rank INTEGER NOT NULL
+    )''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_popularity_rank ON book_popularity(rank)')
+    refresh_popularity(cursor.connection)
+
+
+def add_loan_rollup(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS loan_daily_stats(
+        day TEXT PRIMARY KEY,
+        loans INTEGER NOT NULL DEFAULT 0,
+        returns INTEGER NOT NULL DEFAULT 0,
+        open_balance INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    create_triggers(cursor)
+    backfill(cursor.connection)
+
+
+def add_copy_counts(cursor):
+    columns = _table_columns(cursor, 'books')
+    if 'copies' not in columns:
+        cursor.execute('ALTER TABLE books ADD COLUMN copies INTEGER NOT NULL DEFAULT 1')
+    if 'available_copies' not in columns:
+        cursor.execute('ALTER TABLE books ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 1')
+    # A title already lent out more than once owns at least that many copies
+    cursor.execute('''
+    UPDATE books SET copies = MAX(copies, (
+        SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = books.bookID AND bl.return_date IS NULL))
+    ''')
+    cursor.execute('''
+    UPDATE books SET available_copies = MAX(0, copies - (
+        SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = books.bookID AND bl.return_date IS NULL))
+    ''')
+
+
+def add_table_versions(cursor):
+    # Shared by every process on the database, so a write from one invalidates cached
+    # reads in all of them
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS table_versions(
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+
+
+def add_author_index(cursor):
+    # books.authors stays as imported; these tables split it into one row per name so
+    # author lookups, per-author listings and aggregates are index ranges, not substring scans
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS authors(
+        author_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_key TEXT NOT NULL UNIQUE
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS publishers(
+        publisher_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_key TEXT NOT NULL UNIQUE
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_authors(
+        author_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (author_id, book_id)
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_authors_book ON book_authors(book_id)')
+    if 'publisher_id' not in _table_columns(cursor, 'books'):
+        cursor.execute('ALTER TABLE books ADD COLUMN publisher_id INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_publisher_id ON books(publisher_id)')
+    # Lifetime loans per book, for per-author loan counts; student_id second so the
+    # co-borrowing per-(student, book) check stays a point lookup
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_loans_book ON book_loans(book_id, student_id)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS author_index_queue(
+        book_id INTEGER PRIMARY KEY
+    )''')
+    author_index.create_triggers(cursor)
+    cursor.execute('INSERT OR IGNORE INTO author_index_queue (book_id) SELECT bookID FROM books')
+    author_index.sync_author_index(cursor.connection)
+
+
+def add_due_dates(cursor):
+    if 'due_date' not in _table_columns(cursor, 'book_loans'):
+        cursor.execute('ALTER TABLE book_loans ADD COLUMN due_date DATE')
+    policy.backfill_due_dates(cursor.connection)
+    # Overdue means open and past due: a range scan on this partial index
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_loans_open_due
+    ON book_loans(due_date) WHERE return_date IS NULL''')
+    # Written by the nightly overdue job, read by the loan pages
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS overdue_loans(
+        loan_id INTEGER PRIMARY KEY,
+        student_id VARCHAR,
+        book_id INTEGER,
+        loan_date DATE,
+        due_date DATE,
+        days_overdue INTEGER NOT NULL,
+        fine REAL NOT NULL
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_overdue_student ON overdue_loans(student_id)')
+
+
+def hash_passwords(cursor):
+    # Replaces plaintext passwords with salted hashes; key derivation runs on auth's worker pool
+    for table, _ in auth.ROLES.values():
+        rows = [(row_id, password) for row_id, password in cursor.execute(
+            f'SELECT id, password FROM {table} WHERE password IS NOT NULL') if not auth.is_hashed(password)]
+        hashes = auth.hash_many([str(password) for _, password in rows])
+        cursor.executemany(f'UPDATE {table} SET password = ? WHERE id = ?',
+                           [(stored, row_id) for (row_id, _), stored in zip(rows, hashes)])
+
+
+# Append only: each entry is applied once, in order, and recorded in PRAGMA user_version.
+MIGRATIONS = [
+    (1, 'core tables', create_core_tables),
+    (2, 'book_loans indexes', add_loan_indexes),
+    (3, 'full-text search', add_search_index),
+    (4, 'catalog sort indexes', add_catalog_sort_indexes),
+    (5, 'co-borrowing matrix', add_co_borrowing),
+    (6, 'popularity ranking', add_popularity),
+    (7, 'daily loan rollup', add_loan_rollup),
+    (8, 'copy counts', add_copy_counts),
+    (9, 'table versions', add_table_versions),
+    (10, 'author and publisher index', add_author_index),
+    (11, 'due dates', add_due_dates),
+    (12, 'hashed passwords', hash_passwords),
+]
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _apply(conn, target):
+    applied = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Re-read inside the write lock so concurrent sessions don't apply a step twice
+        current = schema_version(conn)
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )''')
+        for version, name, step in MIGRATIONS:
+            if current < version <= target:
+                step(cursor)
+                cursor.execute('INSERT OR REPLACE INTO schema_migrations VALUES (?, ?, ?)',
+                               (version, name, datetime.now().isoformat(timespec='seconds')))
+                cursor.execute(f'PRAGMA user_version = {version}')
+                applied.append(version)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return applied
+
+
+def migrate(conn=None, target=None):
+    target = target if target is not None else MIGRATIONS[-1][0]
+    if conn is None:
+        with db.connection() as conn:
+            return migrate(conn, target)
+    if schema_version(conn) >= target:
+        return []
+    return _apply(conn, target)
+
+
+# Hot queries and the index each must use; guards against a schema or query change
+# silently turning one of them back into a full table scan.
+HOT_QUERIES = [
+    ('fetch_loaned_books(student_id)', '''
+    SELECT book_loans.loan_id, books.title, books.authors, book_loans.loan_date, book_loans.return_date
+    FROM book_loans
+    JOIN books ON book_loans.book_id = books.bookID
+    WHERE book_loans.student_id = ?
+    ''', ('S001',), 'idx_loans_student_date'),
+    ('fetch_books_availability', '''
+    SELECT bookID, title, authors, available_copies, copies FROM books WHERE bookID > ? ORDER BY bookID LIMIT ?
+    ''', (0, 50), 'INTEGER PRIMARY KEY'),
+    ('checkout', '''
+    UPDATE books SET available_copies = available_copies - 1 WHERE bookID = ? AND available_copies > 0
+    ''', (1,), 'INTEGER PRIMARY KEY'),
+    ('fetch_books_page(sort=title)', '''
+    SELECT bookID, title FROM books WHERE ((title, bookID) > (?, ?)) ORDER BY title ASC, bookID ASC LIMIT ?
+    ''', ('M', 0, 50), 'idx_books_title'),
+    ('fetch_loan_stats', '''
+    SELECT day, loans, returns, open_balance FROM loan_daily_stats WHERE day >= ? AND day <= ?
+    ''', ('2024-01-01', '2024-12-31'), 'PRIMARY KEY'),
+    ('refresh_popularity(recent loans)', '''
+    SELECT book_id, COUNT(*) FROM book_loans INDEXED BY idx_loans_loan_date
+    WHERE loan_date >= date('now', ?) GROUP BY book_id
+    ''', ('-30 days',), 'idx_loans_loan_date'),
+    ('search_catalog', '''
+    SELECT b.bookID, bm25(books_fts) AS score FROM books_fts
+    JOIN books b ON b.bookID = books_fts.rowid
+    WHERE books_fts MATCH ? ORDER BY score LIMIT 20
+    ''', ('"tolkien"*',), 'books_fts'),
+    ('search_catalog(rating range)', '''
+    SELECT b.bookID FROM books b WHERE 1 AND b.average_rating >= ? ORDER BY b.average_rating DESC LIMIT 20
+    ''', (4.0,), 'idx_books_rating'),
+    ('also_borrowed', '''
+    SELECT c.book_b, c.count, b.borrowers FROM book_cooccurrence c
+    JOIN book_borrowers b ON b.book_id = c.book_b
+    WHERE c.book_a = ? ORDER BY c.count DESC LIMIT ?
+    ''', (1, 100), 'idx_cooccurrence_rank'),
+    ('get_recommendations', '''
+    SELECT b.bookID, b.title, p.score FROM book_popularity p CROSS JOIN books b ON b.bookID = p.bookID
+    WHERE p.rank <= ? ORDER BY random() LIMIT ?
+    ''', (50, 10), 'idx_popularity_rank'),
+    ('find_authors', '''
+    SELECT author_id, name FROM authors WHERE name_key >= ? AND name_key < ? ORDER BY name_key LIMIT ?
+    ''', ('tol', 'tol\U0010ffff', 20), 'sqlite_autoindex_authors_1'),
+    ('books_by_author', '''
+    SELECT b.bookID, b.title FROM book_authors ba JOIN books b ON b.bookID = ba.book_id WHERE ba.author_id = ?
+    ''', (1,), 'PRIMARY KEY'),
+    ('author_stats(loans)', '''
+    SELECT COUNT(*) FROM book_loans bl WHERE bl.book_id = ?
+    ''', (1,), 'idx_loans_book'),
+    ('overdue job', '''
+    SELECT loan_id, due_date FROM book_loans WHERE return_date IS NULL AND due_date < ?
+    ''', ('2024-01-01',), 'idx_loans_open_due'),
+    ('authenticate(student)', '''
+    SELECT name, password FROM students WHERE student_id = ?
+    ''', ('S001',), 'sqlite_autoindex_students_1'),
+    ('authenticate(admin)', '''
+    SELECT name, password FROM librarystaff WHERE employee_id = ?
+    ''', ('E001',), 'sqlite_autoindex_librarystaff_1'),
+]
+
+
+def explain(conn, query, params=()):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+def check_query_plans(conn):
+    failures = []
+    for name, query, params, index in HOT_QUERIES:
+        plan = explain(conn, query, params)
+        if not any(index in detail for detail in plan):
+            failures.append(f"{name}: expected {index}, got {'; '.join(plan)}")
+    if failures:
+        raise AssertionError('Hot queries not using their indexes:\n' + '\n'.join(failures))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply BookHive schema migrations.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--check', action='store_true', help='verify hot queries use their indexes')
+    args = parser.parse_args()
+    db.configure(args.db)
+    with db.connection() as conn:
+        before = schema_version(conn)
+        applied = migrate(conn)
+        print(f'schema version {before} -> {schema_version(conn)} (applied {applied or "nothing"})')
+        if args.check:
+            try:
+                check_query_plans(conn)
+            except AssertionError as e:
+                raise SystemExit(str(e))
+            print('query plans OK')
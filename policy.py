@@ -0,0 +1,112 @@
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db
+from db import connection, get_meta, set_meta, transaction
+from query_cache import bump, cached
+
+# Circulation policy: loan period, days of grace before a fine starts, daily rate and the
+# most a single loan can accrue
+LOAN_DAYS = int(os.environ.get('BOOKHIVE_LOAN_DAYS', 14))
+GRACE_DAYS = int(os.environ.get('BOOKHIVE_GRACE_DAYS', 0))
+FINE_PER_DAY = float(os.environ.get('BOOKHIVE_FINE_PER_DAY', 0.25))
+MAX_FINE = float(os.environ.get('BOOKHIVE_MAX_FINE', 20.0))
+
+
+def due_date(loan_date):
+    return date.fromisoformat(str(loan_date)) + timedelta(days=LOAN_DAYS)
+
+
+def backfill_due_dates(conn):
+    # Loans written before due dates existed, or by a bulk load that left them out
+    return conn.execute('''
+    UPDATE book_loans SET due_date = date(loan_date, ?) WHERE due_date IS NULL AND loan_date IS NOT NULL
+    ''', (f'+{LOAN_DAYS} days',)).rowcount
+
+
+def assess(loans, today=None, due_column='due_date', return_column='return_date'):
+    # One vectorized pass over a frame of loans. Open loans are measured against today,
+    # returned ones against their return date.
+    today = pd.Timestamp(today or date.today())
+    due = pd.to_datetime(loans[due_column], format='%Y-%m-%d', errors='coerce')
+    returned = pd.to_datetime(loans[return_column], format='%Y-%m-%d', errors='coerce')
+    days_overdue = (returned.fillna(today) - due).dt.days.fillna(0).clip(lower=0).astype(int)
+    fine = np.minimum((days_overdue - GRACE_DAYS).clip(lower=0) * FINE_PER_DAY, MAX_FINE).round(2)
+    status = np.select(
+        [returned.notna() & (days_overdue > 0), returned.notna(), days_overdue > 0],
+        ['Returned late', 'Returned', 'Overdue'], 'On loan')
+    return loans.assign(days_overdue=days_overdue, fine=fine, status=status)
+
+
+def compute_overdue(conn, today):
+    # Set-based: the open-loan due_date index yields exactly the overdue rows, and SQLite
+    # computes days and fines for all of them in one statement
+    conn.execute('DELETE FROM overdue_loans')
+    conn.execute('''
+    INSERT INTO overdue_loans (loan_id, student_id, book_id, loan_date, due_date, days_overdue, fine)
+    SELECT loan_id, student_id, book_id, loan_date, due_date, days,
+           MIN(:max_fine, ROUND(MAX(0, days - :grace) * :rate, 2))
+    FROM (
+        SELECT loan_id, student_id, book_id, loan_date, due_date,
+               CAST(julianday(:today) - julianday(due_date) AS INTEGER) AS days
+        FROM book_loans
+        WHERE return_date IS NULL AND due_date < :today
+    )
+    ''', {'today': today, 'grace': GRACE_DAYS, 'rate': FINE_PER_DAY, 'max_fine': MAX_FINE})
+    return conn.execute('SELECT COUNT(*), TOTAL(fine) FROM overdue_loans').fetchone()
+
+
+def run_overdue_job(today=None):
+    # The nightly batch: replaces overdue_loans with the open loans overdue as of `today`
+    today = str(today or date.today())
+    with transaction() as conn:
+        backfill_due_dates(conn)
+        count, fines = compute_overdue(conn, today)
+        set_meta(conn.cursor(), overdue_as_of=today, overdue_run_at=datetime.now().isoformat(timespec='seconds'))
+        bump('overdue_loans')
+    return {'as_of': today, 'overdue': count, 'fines': round(fines, 2)}
+
+
+@cached('overdue_loans')
+def last_run():
+    with connection() as conn:
+        cursor = conn.cursor()
+        return get_meta(cursor, 'overdue_as_of'), get_meta(cursor, 'overdue_run_at')
+
+
+@cached('overdue_loans', 'students', 'books')
+def overdue_report(student_id=None):
+    # The last batch's results, worst first
+    query = '''
+    SELECT o.loan_id, o.student_id, s.name, o.book_id, b.title, o.loan_date, o.due_date, o.days_overdue, o.fine
+    FROM overdue_loans o
+    LEFT JOIN students s ON s.student_id = o.student_id
+    LEFT JOIN books b ON b.bookID = o.book_id
+    '''
+    params = []
+    if student_id:
+        query += ' WHERE o.student_id = ?'
+        params.append(student_id)
+    query += ' ORDER BY o.days_overdue DESC, o.loan_id'
+    with connection() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Nightly overdue check: recompute overdue loans and fines.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--date', help='evaluate as of this day (YYYY-MM-DD); defaults to today')
+    parser.add_argument('--out', help='also write the overdue list to this CSV file')
+    args = parser.parse_args()
+    db.configure(args.db)
+    started = time.perf_counter()
+    result = run_overdue_job(args.date)
+    elapsed = time.perf_counter() - started
+    print(f"{result['overdue']} overdue loans as of {result['as_of']}, {result['fines']:.2f} in fines ({elapsed:.2f}s)")
+    if args.out:
+        overdue_report().to_csv(args.out, index=False)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from db import connection, get_meta, set_meta, transaction
+from query_cache import bump
+
+# Votes needed before a book's own rating outweighs the catalog mean; None uses the
+# MIN_VOTES_QUANTILE of ratings_count across the catalog.
+MIN_VOTES = None
+MIN_VOTES_QUANTILE = 0.8
+# Bonus per log-unit of loans in the last RECENT_DAYS, on the 0-5 rating scale
+LOAN_WEIGHT = 0.25
+RECENT_DAYS = 30
+REFRESH_INTERVAL = 3600
+POOL_FACTOR = 5
+
+_refresh_lock = threading.Lock()
+
+
+def compute_scores(conn, min_votes=MIN_VOTES, loan_weight=LOAN_WEIGHT, recent_days=RECENT_DAYS):
+    books = pd.read_sql_query('SELECT bookID, average_rating, ratings_count FROM books', conn)
+    if books.empty:
+        return books.assign(score=pd.Series(dtype=float))
+    ratings = books['average_rating'].to_numpy(dtype=float, na_value=np.nan)
+    votes = np.nan_to_num(books['ratings_count'].to_numpy(dtype=float, na_value=np.nan))
+    mean_rating = np.nanmean(ratings) if np.isfinite(ratings).any() else 0.0
+    ratings = np.where(np.isfinite(ratings), ratings, mean_rating)
+    if min_votes is None:
+        min_votes = max(float(np.quantile(votes, MIN_VOTES_QUANTILE)), 1.0)
+    # Bayesian average: shrink thinly-rated books towards the catalog mean
+    score = (votes * ratings + min_votes * mean_rating) / (votes + min_votes)
+    if loan_weight:
+        # Pinned: without ANALYZE the planner would rather walk idx_loans_book for the GROUP BY
+        recent = pd.read_sql_query('''
+        SELECT book_id AS bookID, COUNT(*) AS loans FROM book_loans INDEXED BY idx_loans_loan_date
+        WHERE loan_date >= date('now', ?)
+        GROUP BY book_id
+        ''', conn, params=[f'-{recent_days} days'])
+        loans = books[['bookID']].merge(recent, on='bookID', how='left')['loans'].fillna(0).to_numpy(dtype=float)
+        score = score + loan_weight * np.log1p(loans)
+    return books[['bookID']].assign(score=score)
+
+
+def refresh_popularity(conn=None, **options):
+    if conn is None:
+        with transaction() as conn:
+            count = refresh_popularity(conn, **options)
+            bump('book_popularity')
+        return count
+    scores = compute_scores(conn, **options)
+    order = np.lexsort((scores['bookID'].to_numpy(), -scores['score'].to_numpy()))
+    ranked = scores.iloc[order]
+    conn.execute('DELETE FROM book_popularity')
+    conn.executemany('''
+    INSERT INTO book_popularity (bookID, score, rank) VALUES (?, ?, ?)
+    ''', zip(ranked['bookID'].tolist(), ranked['score'].tolist(), range(1, len(ranked) + 1)))
+    set_meta(conn.cursor(), popularity_refreshed_at=time.time())
+    return len(ranked)
+
+
+def _refresh_stale():
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        refresh_popularity()
+    finally:
+        _refresh_lock.release()
+
+
+def refresh_if_stale(max_age=REFRESH_INTERVAL):
+    # Ratings only move on import, but the loan blend drifts; refresh it in the background
+    with connection() as conn:
+        refreshed_at = float(get_meta(conn.cursor(), 'popularity_refreshed_at', 0))
+    if time.time() - refreshed_at > max_age:
+        threading.Thread(target=_refresh_stale, name='popularity-refresh', daemon=True).start()
+
+
+def top_books(n=10, randomize=True, pool=None):
+    refresh_if_stale()
+    with connection() as conn:
+        if not randomize:
+            return pd.read_sql_query('''
+            SELECT b.bookID, b.title, b.authors, b.average_rating, p.score
+            FROM book_popularity p CROSS JOIN books b ON b.bookID = p.bookID
+            ORDER BY p.rank
+            LIMIT ?
+            ''', conn, params=[n])
+        # Sample n of the top `pool` inside SQLite; only the pool is ever read. CROSS JOIN
+        # pins the join order so the rank index drives the query.
+        return pd.read_sql_query('''
+        SELECT bookID, title, authors, average_rating, score FROM (
+            SELECT b.bookID, b.title, b.authors, b.average_rating, p.score, p.rank
+            FROM book_popularity p CROSS JOIN books b ON b.bookID = p.bookID
+            WHERE p.rank <= ?
+            ORDER BY random()
+            LIMIT ?
+        ) ORDER BY rank
+        ''', conn, params=[pool or max(n * POOL_FACTOR, 50), n])
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import pandas as pd
+
+from db import database_path, transaction
+
+MAX_BYTES = int(os.environ.get('BOOKHIVE_CACHE_BYTES', 64 * 1024 * 1024))
+MAX_ENTRIES = 2048
+
+_versions_lock = threading.Lock()
+# Versions live in the table_versions table so writes from other processes (the HTTP
+# service, a second app server) invalidate this one's cache too. A private connection
+# watches PRAGMA data_version and only re-reads the table after some connection commits.
+_monitor = None
+_data_version = None
+_versions = {}
+
+
+def bump(*tables):
+    # Call inside the writing transaction, or right after it commits, so readers of
+    # those tables miss from then on
+    with transaction() as conn:
+        conn.executemany('''
+        INSERT INTO table_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+        ''', [(table,) for table in tables])
+
+
+def _refresh_versions():
+    global _monitor, _data_version, _versions
+    path = database_path()
+    if _monitor is None or _monitor[0] != path:
+        if _monitor is not None:
+            _monitor[1].close()
+        _monitor = (path, sqlite3.connect(path, check_same_thread=False))
+        _data_version = None
+        _cache.clear()
+    conn = _monitor[1]
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    if data_version != _data_version:
+        try:
+            _versions = dict(conn.execute('SELECT name, version FROM table_versions'))
+        except sqlite3.OperationalError:
+            # Not migrated yet: nothing is versioned, so nothing may be served from cache
+            _versions = None
+        _data_version = data_version
+
+
+def version(*tables):
+    with _versions_lock:
+        _refresh_versions()
+        if _versions is None:
+            return None
+        return tuple(_versions.get(table, 0) for table in tables)
+
+
+def estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                # Written since it was cached: drop it now rather than waiting for LRU
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, versions, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = QueryCache()
+
+
+def cached(*tables):
+    # Results are shared across sessions and must be treated as read-only by callers
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+            versions = version(*tables)
+            if versions is None:
+                return func(*args, **kwargs)
+            hit, value = _cache.get(key, versions)
+            if hit:
+                return value
+            value = func(*args, **kwargs)
+            _cache.put(key, versions, value)
+            return value
+        wrapper.tables = tables
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,61 @@
+import pandas as pd
+
+from co_borrowing import also_borrowed, recommend_for_student
+from db import connection
+from popularity import top_books
+from similar_books import similar_to_book, similar_to_books
+
+HISTORY_SIZE = 50
+BOOK_COLUMNS = ['bookID', 'title', 'authors', 'average_rating', 'language_code', 'ratings_count', 'publisher']
+
+
+def books_with_scores(scored):
+    if not scored:
+        return pd.DataFrame(columns=BOOK_COLUMNS + ['score'])
+    ids = [book_id for book_id, _ in scored]
+    with connection() as conn:
+        df = pd.read_sql_query(f'''
+        SELECT {', '.join(BOOK_COLUMNS)}
+        FROM books WHERE bookID IN ({', '.join('?' * len(ids))})
+        ''', conn, params=ids)
+    df['score'] = df['bookID'].map(dict(scored))
+    return df.sort_values('score', ascending=False).reset_index(drop=True)
+
+
+def popular(n=10, randomize=True):
+    return top_books(n, randomize=randomize)
+
+
+def similar_books(book_id, n=10):
+    return books_with_scores(similar_to_book(book_id, n))
+
+
+def also_borrowed_books(book_id, n=10):
+    return books_with_scores(also_borrowed(book_id, n))
+
+
+def loan_history(student_id, limit=HISTORY_SIZE):
+    with connection() as conn:
+        rows = conn.execute('''
+        SELECT book_id FROM book_loans WHERE student_id = ? ORDER BY loan_date DESC LIMIT ?
+        ''', (student_id, limit)).fetchall()
+    return list(dict.fromkeys(row[0] for row in rows))
+
+
+def for_student(student_id, n=5):
+    history = loan_history(student_id)
+    if not history:
+        # Nothing borrowed yet: fall back to what is popular
+        return popular(n)
+    # Co-borrowing signal first, topped up with content similarity for thin histories
+    scored = recommend_for_student(student_id, n)
+    seen = {book_id for book_id, _ in scored}
+    top_score = scored[-1][1] if scored else 1.0
+    for book_id, score in similar_to_books(history, n):
+        if len(scored) >= n:
+            break
+        if book_id not in seen:
+            # Keep content matches below every co-borrowed book
+            scored.append((book_id, score * top_score * 0.5))
+            seen.add(book_id)
+    return books_with_scores(scored)
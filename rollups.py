@@ -0,0 +1,104 @@
+import argparse
+
+import pandas as pd
+
+import db
+from db import connection, transaction
+from query_cache import bump, cached
+
+GRANULARITIES = {
+    'day': 'day',
+    # Monday of the day's week
+    'week': "date(day, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', day)",
+}
+
+
+def _delta(day, column, sign):
+    # Seed a missing day with the running balance of the latest earlier day, then shift the
+    # counter on that day and the open-loan balance on that day and every later one.
+    balance = sign if column == 'loans' else -sign
+    return f'''
+        INSERT OR IGNORE INTO loan_daily_stats (day, loans, returns, open_balance)
+        VALUES ({day}, 0, 0, COALESCE(
+            (SELECT open_balance FROM loan_daily_stats WHERE day < {day} ORDER BY day DESC LIMIT 1), 0));
+        UPDATE loan_daily_stats SET {column} = {column} + ({sign}) WHERE day = {day};
+        UPDATE loan_daily_stats SET open_balance = open_balance + ({balance}) WHERE day >= {day};'''
+
+
+def create_triggers(cursor):
+    triggers = {
+        'loan_stats_insert_loan': ('AFTER INSERT ON book_loans WHEN new.loan_date IS NOT NULL',
+                                   _delta('new.loan_date', 'loans', 1)),
+        'loan_stats_insert_return': ('AFTER INSERT ON book_loans WHEN new.return_date IS NOT NULL',
+                                     _delta('new.return_date', 'returns', 1)),
+        'loan_stats_delete_loan': ('AFTER DELETE ON book_loans WHEN old.loan_date IS NOT NULL',
+                                   _delta('old.loan_date', 'loans', -1)),
+        'loan_stats_delete_return': ('AFTER DELETE ON book_loans WHEN old.return_date IS NOT NULL',
+                                     _delta('old.return_date', 'returns', -1)),
+        # NULL days are no-ops here: INSERT OR IGNORE skips the NULL key and the UPDATEs match nothing
+        'loan_stats_update_loan': ('AFTER UPDATE OF loan_date ON book_loans WHEN old.loan_date IS NOT new.loan_date',
+                                   _delta('old.loan_date', 'loans', -1) + _delta('new.loan_date', 'loans', 1)),
+        'loan_stats_update_return': ('AFTER UPDATE OF return_date ON book_loans '
+                                     'WHEN old.return_date IS NOT new.return_date',
+                                     _delta('old.return_date', 'returns', -1) + _delta('new.return_date', 'returns', 1)),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body}\n    END')
+
+
+def backfill(conn):
+    conn.execute('DELETE FROM loan_daily_stats')
+    conn.execute('''
+    INSERT INTO loan_daily_stats (day, loans, returns, open_balance)
+    SELECT day, loans, returns, SUM(loans - returns) OVER (ORDER BY day)
+    FROM (
+        SELECT day, SUM(loans) AS loans, SUM(returns) AS returns
+        FROM (
+            SELECT loan_date AS day, 1 AS loans, 0 AS returns FROM book_loans WHERE loan_date IS NOT NULL
+            UNION ALL
+            SELECT return_date, 0, 1 FROM book_loans WHERE return_date IS NOT NULL
+        )
+        GROUP BY day
+    )
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM loan_daily_stats').fetchone()[0]
+
+
+def backfill_loan_daily_stats():
+    with transaction() as conn:
+        days = backfill(conn)
+        bump('loan_daily_stats')
+    return days
+
+
+@cached('loan_daily_stats')
+def fetch_loan_stats(start=None, end=None, granularity='day'):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity}")
+    period = GRANULARITIES[granularity]
+    # SQLite returns open_balance from the row holding MAX(day), i.e. the balance at period end
+    query = f'''
+    SELECT {period} AS period, SUM(loans) AS loans, SUM(returns) AS returns, open_balance, MAX(day) AS last_day
+    FROM loan_daily_stats
+    WHERE day >= ? AND day <= ?
+    GROUP BY period
+    ORDER BY period
+    '''
+    with connection() as conn:
+        df = pd.read_sql_query(query, conn, params=[str(start or '0000-00-00'), str(end or '9999-12-31')])
+    return df.drop(columns='last_day')
+
+
+@cached('loan_daily_stats')
+def date_bounds():
+    with connection() as conn:
+        return conn.execute('SELECT MIN(day), MAX(day) FROM loan_daily_stats').fetchone()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the loan_daily_stats rollup from book_loans.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    args = parser.parse_args()
+    db.configure(args.db)
+    print(f'{backfill_loan_daily_stats()} days rolled up')
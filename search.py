@@ -0,0 +1,183 @@
+import re
+
+import pandas as pd
+
+from catalog import COUNT_CAP
+from db import connection
+
+SEARCH_FIELDS = ('title', 'authors', 'publisher')
+# bm25 column weights, in SEARCH_FIELDS order: a title hit outranks an author hit outranks a publisher hit
+FIELD_WEIGHTS = (10.0, 5.0, 1.0)
+BOOK_COLUMNS = 'b.bookID, b.title, b.authors, b.average_rating, b.language_code, b.ratings_count, b.publisher'
+FUZZY_CANDIDATES = 200
+FUZZY_MIN_SIMILARITY = 0.3
+
+
+def _tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def _trigrams(text):
+    grams = set()
+    for token in _tokens(text):
+        grams.update(token[i:i + 3] for i in range(len(token) - 2))
+    return grams
+
+
+def _column_filter(fields, expression):
+    if not fields or set(fields) == set(SEARCH_FIELDS):
+        return expression
+    return '{' + ' '.join(fields) + '} : (' + expression + ')'
+
+
+def build_match_query(text, fields=None, prefix=True):
+    tokens = _tokens(text)
+    if not tokens:
+        return None
+    # Quote every token so user input can never be parsed as FTS5 syntax
+    terms = [f'"{token}"*' if prefix else f'"{token}"' for token in tokens]
+    return _column_filter(fields, ' '.join(terms))
+
+
+def build_trigram_query(text, fields=None):
+    grams = sorted(_trigrams(text))
+    if not grams:
+        return None
+    return _column_filter(fields, ' OR '.join(f'"{gram}"' for gram in grams))
+
+
+def parse_rating_range(text):
+    # "4" means at least 4, "3.5-4.2" an inclusive range
+    numbers = re.findall(r'\d+(?:\.\d+)?', str(text))
+    if not numbers:
+        raise ValueError(f"Not a rating or rating range: {text!r}")
+    low = float(numbers[0])
+    high = float(numbers[1]) if len(numbers) > 1 else None
+    if high is not None and high < low:
+        low, high = high, low
+    return low, high
+
+
+def _rating_predicate(min_rating, max_rating):
+    clauses, params = [], []
+    if min_rating is not None:
+        clauses.append('b.average_rating >= ?')
+        params.append(min_rating)
+    if max_rating is not None:
+        clauses.append('b.average_rating <= ?')
+        params.append(max_rating)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def trigram_available(conn):
+    return conn.execute('''
+    SELECT 1 FROM sqlite_master WHERE name = 'books_trigram'
+    ''').fetchone() is not None
+
+
+def _ranked(conn, table, match, rating_sql, rating_params, limit, offset):
+    query = f'''
+    SELECT {BOOK_COLUMNS}, bm25({table}, {', '.join(map(str, FIELD_WEIGHTS))}) AS score
+    FROM {table}
+    JOIN books b ON b.bookID = {table}.rowid
+    WHERE {table} MATCH ?{rating_sql}
+    ORDER BY score
+    LIMIT ? OFFSET ?
+    '''
+    return pd.read_sql_query(query, conn, params=[match, *rating_params, limit, offset])
+
+
+def _has_match(conn, match, rating_sql, rating_params):
+    return conn.execute(f'''
+    SELECT 1 FROM books_fts JOIN books b ON b.bookID = books_fts.rowid
+    WHERE books_fts MATCH ?{rating_sql} LIMIT 1
+    ''', [match, *rating_params]).fetchone() is not None
+
+
+def _fuzzy(conn, text, fields, rating_sql, rating_params, limit, offset):
+    match = build_trigram_query(text, fields)
+    if match is None or not trigram_available(conn):
+        return None
+    candidates = _ranked(conn, 'books_trigram', match, rating_sql, rating_params, FUZZY_CANDIDATES, 0)
+    if candidates.empty:
+        return candidates
+    # bm25 over OR-ed trigrams favours long fields; re-rank by trigram overlap with the query
+    wanted = _trigrams(text)
+    haystack = candidates[list(fields)].fillna('').astype(str).agg(' '.join, axis=1)
+    candidates['score'] = [-len(wanted & _trigrams(value)) / len(wanted) for value in haystack]
+    candidates = candidates[candidates['score'] <= -FUZZY_MIN_SIMILARITY]
+    candidates = candidates.sort_values('score', kind='stable')
+    return candidates.iloc[offset:offset + limit].reset_index(drop=True)
+
+
+def search_catalog(text='', fields=None, min_rating=None, max_rating=None, limit=20, offset=0, fuzzy=True):
+    fields = list(fields or SEARCH_FIELDS)
+    unknown = set(fields) - set(SEARCH_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot search by {', '.join(sorted(unknown))}")
+    limit = -1 if limit is None else limit
+    rating_sql, rating_params = _rating_predicate(min_rating, max_rating)
+    with connection() as conn:
+        match = build_match_query(text, fields)
+        if match is None:
+            # No text: a pure rating range, answered from idx_books_rating
+            query = f'''
+            SELECT {BOOK_COLUMNS}, NULL AS score FROM books b
+            WHERE 1{rating_sql}
+            ORDER BY b.average_rating DESC
+            LIMIT ? OFFSET ?
+            '''
+            return pd.read_sql_query(query, conn, params=[*rating_params, limit, offset])
+        if fuzzy and not _has_match(conn, match, rating_sql, rating_params):
+            # Nothing matched word-for-word: retry on character trigrams to tolerate typos
+            fallback = _fuzzy(conn, text, fields, rating_sql, rating_params,
+                              FUZZY_CANDIDATES if limit < 0 else limit, offset)
+            if fallback is not None:
+                return fallback
+        return _ranked(conn, 'books_fts', match, rating_sql, rating_params, limit, offset)
+
+
+def count_catalog(text='', fields=None, min_rating=None, max_rating=None, fuzzy=True):
+    # Returns (count, exact) for the same hits search_catalog pages through; like
+    # estimate_count it stops at COUNT_CAP, so a broad query never counts the whole index.
+    fields = list(fields or SEARCH_FIELDS)
+    unknown = set(fields) - set(SEARCH_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot search by {', '.join(sorted(unknown))}")
+    rating_sql, rating_params = _rating_predicate(min_rating, max_rating)
+    with connection() as conn:
+        match = build_match_query(text, fields)
+        if match is None:
+            hits = f'SELECT 1 FROM books b WHERE 1{rating_sql} LIMIT ?'
+            params = rating_params
+        else:
+            if fuzzy and not _has_match(conn, match, rating_sql, rating_params):
+                fallback = _fuzzy(conn, text, fields, rating_sql, rating_params, FUZZY_CANDIDATES, 0)
+                if fallback is not None:
+                    # Typo-tolerant hits are already bounded by FUZZY_CANDIDATES
+                    return len(fallback), True
+            hits = f'''
+            SELECT 1 FROM books_fts JOIN books b ON b.bookID = books_fts.rowid
+            WHERE books_fts MATCH ?{rating_sql} LIMIT ?
+            '''
+            params = [match, *rating_params]
+        count = conn.execute(f'SELECT COUNT(*) FROM ({hits})', [*params, COUNT_CAP + 1]).fetchone()[0]
+    if count > COUNT_CAP:
+        return COUNT_CAP, False
+    return count, True
+
+
+def _search_args(keyword, search_by):
+    # search_by is a SEARCH_FIELDS name, 'all fields', or 'average_rating' for a rating range
+    if search_by == 'average_rating':
+        min_rating, max_rating = parse_rating_range(keyword)
+        return {'min_rating': min_rating, 'max_rating': max_rating}
+    return {'text': keyword, 'fields': None if search_by == 'all fields' else [search_by]}
+
+
+def search_books(keyword, search_by='all fields', limit=None, offset=0):
+    return search_catalog(**_search_args(keyword, search_by), limit=limit, offset=offset)
+
+
+def count_books(keyword, search_by='all fields'):
+    return count_catalog(**_search_args(keyword, search_by))
@@ -0,0 +1,482 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import author_index
+import circulation
+import db
+import instrumentation
+import policy
+from catalog import fetch_availability_page
+from migrations import migrate
+from recommendations import also_borrowed_books, for_student, popular, similar_books
+from search import search_books
+
+HOST = os.environ.get('BOOKHIVE_SERVICE_HOST', '127.0.0.1')
+PORT = int(os.environ.get('BOOKHIVE_SERVICE_PORT', 8080))
+# Blocking SQLite work runs on this many threads; every endpoint limit below fits inside it
+WORKERS = int(os.environ.get('BOOKHIVE_SERVICE_WORKERS', 16))
+# Requests in flight per endpoint group. A streaming listing holds its slot (and one worker
+# thread) until the last row is written, so those groups get the smallest limits.
+ENDPOINT_LIMITS = {
+    'search': 8,
+    'catalog': 8,
+    'recommendations': 4,
+    'listing': 2,
+    'circulation': 4,
+    'meta': 2,
+}
+# How long a request waits for a slot before it is turned away with 503
+QUEUE_TIMEOUT = 2.0
+KEEPALIVE_TIMEOUT = 15.0
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_PAGE = 1000
+MAX_BULK = 10000
+STREAM_BATCH = 1000
+# Write endpoints require "Authorization: Bearer <token>" when this is set
+API_TOKEN = os.environ.get('BOOKHIVE_API_TOKEN')
+
+logger = logging.getLogger('bookhive.service')
+
+AVAILABILITY_COLUMNS = ['bookID', 'title', 'authors', 'status', 'available_copies', 'copies']
+LOAN_COLUMNS = ['loan_id', 'title', 'authors', 'loan_date', 'due_date', 'return_date', 'student_id']
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = unquote(parts.path)
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+        self.params = {}
+        self.keep_alive = True
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise HTTPError(400, 'Request body is not valid JSON')
+
+    def int_arg(self, name, default=None, minimum=None, maximum=None):
+        value = self.query.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise HTTPError(400, f"'{name}' must be an integer")
+        if minimum is not None and value < minimum or maximum is not None and value > maximum:
+            raise HTTPError(400, f"'{name}' must be between {minimum} and {maximum}")
+        return value
+
+
+class Stream:
+    # A listing sent as a chunked JSON array; batches() is a blocking generator of row lists
+    # and runs start to finish on one worker thread, which keeps its pooled connection.
+    def __init__(self, batches, columns):
+        self.batches = batches
+        self.columns = columns
+
+
+def _records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _authorize(request):
+    if API_TOKEN is None:
+        return
+    supplied = request.headers.get('authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {API_TOKEN}'.encode()):
+        raise HTTPError(401, 'Missing or invalid API token')
+
+
+def health(request):
+    with db.connection() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+    return {'status': 'ok', 'schema_version': version}
+
+
+def metrics(request):
+    return instrumentation.snapshot()
+
+
+def search(request):
+    search_by = request.query.get('by', 'all fields')
+    keyword = request.query.get('q', '').strip()
+    if not keyword:
+        raise HTTPError(400, "'q' is required")
+    try:
+        results = search_books(keyword, search_by, limit=request.int_arg('limit', 20, 1, MAX_PAGE),
+                               offset=request.int_arg('offset', 0, 0))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    return {'results': _records(results)}
+
+
+def availability_listing(request):
+    limit = request.int_arg('limit', minimum=1, maximum=MAX_PAGE)
+    after = request.int_arg('after', 0, 0)
+    if limit is not None:
+        rows = fetch_availability_page(after, limit)
+        return {
+            'results': [dict(zip(AVAILABILITY_COLUMNS, row)) for row in rows],
+            'next': rows[-1][0] if len(rows) == limit else None,
+        }
+
+    def batches():
+        cursor = after
+        while True:
+            rows = fetch_availability_page(cursor, STREAM_BATCH)
+            if rows:
+                yield rows
+            if len(rows) < STREAM_BATCH:
+                return
+            cursor = rows[-1][0]
+    return Stream(batches, AVAILABILITY_COLUMNS)
+
+
+def book_availability(request):
+    row = circulation.availability(request.params['book_id'])
+    if row is None:
+        raise HTTPError(404, f"No book found with ID {request.params['book_id']}")
+    copies, available = row
+    return {'bookID': request.params['book_id'], 'copies': copies, 'available_copies': available}
+
+
+def similar(request):
+    return {'results': _records(similar_books(request.params['book_id'], request.int_arg('n', 10, 1, 100)))}
+
+
+def also_borrowed(request):
+    return {'results': _records(also_borrowed_books(request.params['book_id'], request.int_arg('n', 10, 1, 100)))}
+
+
+def popular_books(request):
+    randomize = request.query.get('randomize', '1') not in ('0', 'false', 'no')
+    return {'results': _records(popular(request.int_arg('n', 10, 1, 100), randomize=randomize))}
+
+
+def student_recommendations(request):
+    return {'results': _records(for_student(request.params['student_id'], request.int_arg('n', 5, 1, 100)))}
+
+
+def author_lookup(request):
+    name = request.query.get('q', '').strip()
+    if not name:
+        raise HTTPError(400, "'q' is required")
+    prefix = request.query.get('prefix', '0') not in ('0', 'false', 'no')
+    return {'results': _records(author_index.find_authors(name, prefix, request.int_arg('limit', 20, 1, MAX_PAGE)))}
+
+
+def author_books(request):
+    return {'results': _records(author_index.books_by_author(
+        request.params['author_id'], request.int_arg('limit', 50, 1, MAX_PAGE), request.int_arg('offset', 0, 0)))}
+
+
+def author_summary(request):
+    stats = author_index.author_stats([request.params['author_id']])
+    if stats.empty:
+        raise HTTPError(404, f"No author found with ID {request.params['author_id']}")
+    return _records(stats)[0]
+
+
+def loan_listing(request):
+    student_id = request.params.get('student_id')
+    columns = LOAN_COLUMNS if student_id is None else LOAN_COLUMNS[:-1]
+    return Stream(lambda: circulation.iter_loaned_books(student_id, STREAM_BATCH), columns)
+
+
+def overdue_listing(request):
+    as_of, _ = policy.last_run()
+    return {'as_of': as_of, 'results': _records(policy.overdue_report(request.query.get('student_id')))}
+
+
+def issue(request):
+    _authorize(request)
+    body = request.json()
+    if not isinstance(body, dict) or 'student_id' not in body or not isinstance(body.get('book_id'), int):
+        raise HTTPError(400, "Expected {\"student_id\": ..., \"book_id\": <int>}")
+    # The batch path also checks the student exists and reports the new loan id
+    result, = circulation.issue_books([(body['student_id'], body['book_id'])])
+    if result['error']:
+        raise HTTPError(409, result['error'])
+    return 201, result
+
+
+def return_loan(request):
+    _authorize(request)
+    error = circulation.return_book(request.params['loan_id'])
+    if error:
+        raise HTTPError(409, error)
+    return {'loan_id': request.params['loan_id'], 'returned': True}
+
+
+def _bulk_items(request, key):
+    body = request.json()
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        raise HTTPError(400, f"Expected {{\"{key}\": [...]}}")
+    if len(items) > MAX_BULK:
+        raise HTTPError(413, f"At most {MAX_BULK} items per request")
+    return items
+
+
+def bulk_issue(request):
+    _authorize(request)
+    loans = []
+    for item in _bulk_items(request, 'loans'):
+        if not isinstance(item, dict) or 'student_id' not in item or not isinstance(item.get('book_id'), int):
+            raise HTTPError(400, "Each loan needs a student_id and an integer book_id")
+        loans.append((item['student_id'], item['book_id']))
+    return {'results': circulation.issue_books(loans)}
+
+
+def bulk_return(request):
+    _authorize(request)
+    loan_ids = _bulk_items(request, 'loan_ids')
+    if not all(isinstance(loan_id, int) for loan_id in loan_ids):
+        raise HTTPError(400, "loan_ids must be integers")
+    return {'results': circulation.return_books(loan_ids)}
+
+
+# (method, path pattern, endpoint group, handler). Path parameters named *_id are integers
+# except student_id, which is the free-form ID students register with.
+ROUTES = [
+    ('GET', r'/health', 'meta', health),
+    ('GET', r'/metrics', 'meta', metrics),
+    ('GET', r'/books/search', 'search', search),
+    ('GET', r'/books/availability', 'catalog', availability_listing),
+    ('GET', r'/books/(?P<book_id>\d+)/availability', 'catalog', book_availability),
+    ('GET', r'/books/(?P<book_id>\d+)/similar', 'recommendations', similar),
+    ('GET', r'/books/(?P<book_id>\d+)/also-borrowed', 'recommendations', also_borrowed),
+    ('GET', r'/authors', 'catalog', author_lookup),
+    ('GET', r'/authors/(?P<author_id>\d+)/books', 'catalog', author_books),
+    ('GET', r'/authors/(?P<author_id>\d+)/stats', 'catalog', author_summary),
+    ('GET', r'/recommendations/popular', 'recommendations', popular_books),
+    ('GET', r'/students/(?P<student_id>[^/]+)/recommendations', 'recommendations', student_recommendations),
+    ('GET', r'/students/(?P<student_id>[^/]+)/loans', 'listing', loan_listing),
+    ('GET', r'/loans', 'listing', loan_listing),
+    ('GET', r'/loans/overdue', 'listing', overdue_listing),
+    ('POST', r'/loans', 'circulation', issue),
+    ('POST', r'/loans/bulk', 'circulation', bulk_issue),
+    ('POST', r'/loans/(?P<loan_id>\d+)/return', 'circulation', return_loan),
+    ('POST', r'/returns/bulk', 'circulation', bulk_return),
+]
+
+
+def _route_name(method, pattern):
+    # '/books/(?P<book_id>\d+)/similar' -> 'GET /books/{book_id}/similar', for metrics
+    return method + ' ' + re.sub(r'\(\?P<(\w+)>[^)]*\)', r'{\1}', pattern)
+
+
+_ROUTES = [(method, re.compile(pattern + '$'), group, handler, _route_name(method, pattern))
+           for method, pattern, group, handler in ROUTES]
+
+
+def route(request):
+    allowed = False
+    for method, pattern, group, handler, name in _ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if method != request.method:
+            allowed = True
+            continue
+        request.params = {name: value if name == 'student_id' else int(value)
+                          for name, value in match.groupdict().items()}
+        return group, handler, name
+    raise HTTPError(405 if allowed else 404)
+
+
+def _encode(payload):
+    return json.dumps(payload, default=str, separators=(',', ':')).encode()
+
+
+class Service:
+    def __init__(self, workers=WORKERS, limits=None):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bookhive-service')
+        self.limits = dict(ENDPOINT_LIMITS, **(limits or {}))
+        self.semaphores = {group: asyncio.Semaphore(limit) for group, limit in self.limits.items()}
+
+    def _call(self, handler, request, name):
+        with instrumentation.page_render():
+            instrumentation.name_page(name)
+            return handler(request)
+
+    async def _respond(self, writer, status, body, keep_alive, extra=()):
+        headers = [
+            f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+            'Content-Type: application/json; charset=utf-8',
+            f'Content-Length: {len(body)}',
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *extra,
+        ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+
+    async def _stream(self, writer, stream, keep_alive):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=4)
+        stopped = threading.Event()
+
+        def produce():
+            # Runs on a worker thread; the bounded queue keeps a slow client from
+            # buffering the whole listing in memory
+            try:
+                for rows in stream.batches():
+                    if stopped.is_set():
+                        return
+                    asyncio.run_coroutine_threadsafe(queue.put(rows), loop).result()
+                item = None
+            except Exception as e:
+                item = e
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        producer = loop.run_in_executor(self.executor, produce)
+        writer.write(('HTTP/1.1 200 OK\r\n'
+                      'Content-Type: application/json; charset=utf-8\r\n'
+                      'Transfer-Encoding: chunked\r\n'
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode())
+        prefix = b'['
+        try:
+            while True:
+                rows = await queue.get()
+                if isinstance(rows, Exception):
+                    # Headers are gone; cutting the connection short is the only signal left
+                    raise rows
+                if rows is None:
+                    break
+                chunk = prefix + b','.join(_encode(dict(zip(stream.columns, row))) for row in rows)
+                prefix = b','
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+            tail = prefix.replace(b',', b'') + b']'
+            writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(tail), tail))
+            await writer.drain()
+        finally:
+            stopped.set()
+            while not queue.empty():
+                queue.get_nowait()
+            await producer
+
+    async def dispatch(self, request, writer, keep_alive):
+        loop = asyncio.get_running_loop()
+        try:
+            group, handler, name = route(request)
+            semaphore = self.semaphores[group]
+            try:
+                await asyncio.wait_for(semaphore.acquire(), QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HTTPError(503, f"Too many concurrent '{group}' requests")
+            try:
+                try:
+                    result = await loop.run_in_executor(self.executor, self._call, handler, request, name)
+                except HTTPError:
+                    raise
+                except Exception:
+                    logger.exception('%s failed', name)
+                    raise HTTPError(500)
+                if isinstance(result, Stream):
+                    await self._stream(writer, result, keep_alive)
+                    return
+            finally:
+                semaphore.release()
+        except HTTPError as e:
+            extra = ('Retry-After: 1',) if e.status == 503 else ()
+            await self._respond(writer, e.status, _encode({'error': str(e)}), keep_alive, extra)
+            return
+        status, payload = result if isinstance(result, tuple) else (200, result)
+        await self._respond(writer, status, _encode(payload), keep_alive)
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(400, 'Malformed request line')
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPError(400, 'Malformed Content-Length header')
+        if length < 0:
+            raise HTTPError(400, 'Malformed Content-Length header')
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length else b''
+        request = Request(method.upper(), target, headers, body)
+        request.keep_alive = (headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1')
+        return request
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except HTTPError as e:
+                    await self._respond(writer, e.status, _encode({'error': str(e)}), False)
+                    break
+                if request is None:
+                    break
+                await self.dispatch(request, writer, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            # Typically a listing that failed after its headers were sent
+            logger.exception('Connection aborted')
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        print(f"BookHive service on http://{host}:{port} ({self.workers} workers)", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the BookHive data layer as a JSON HTTP API.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    db.configure(args.db, pool_size=args.workers)
+    migrate()
+    service = Service(args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pickle
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from db import connection, get_meta
+
+MODEL_DIR = os.environ.get('BOOKHIVE_MODEL_DIR', 'models')
+CHUNK_SIZE = 20000
+# Rows scored per cosine_similarity call; bounds retrieval memory to one dense block of scores
+BLOCK_SIZE = 50000
+# Past this share of changed rows the vocabulary and IDF weights are refitted from scratch
+REFIT_FRACTION = 0.2
+TEXT_WEIGHT = 1.0
+LANGUAGE_WEIGHT = 0.3
+RATING_WEIGHT = 0.2
+
+_model = None
+_refresh_lock = threading.Lock()
+
+
+def _catalog_chunks():
+    with connection() as conn:
+        cursor = conn.execute('''
+        SELECT bookID, title, authors, publisher, language_code, average_rating FROM books ORDER BY bookID
+        ''')
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+def _document(row):
+    _, title, authors, publisher, _, _ = row
+    return ' '.join(str(value) for value in (title, (authors or '').replace('/', ' '), publisher) if value)
+
+
+def _signature(row):
+    digest = hashlib.blake2b(repr(row[1:]).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def _catalog_version():
+    with connection() as conn:
+        return get_meta(conn.cursor(), 'csv_sha256')
+
+
+def _vectorize(vectorizer, languages, rows):
+    text = vectorizer.transform([_document(row) for row in rows]) * TEXT_WEIGHT
+    language_index = {code: i for i, code in enumerate(languages)}
+    hits = [(i, language_index[row[4]]) for i, row in enumerate(rows) if row[4] in language_index]
+    language = sp.csr_matrix(
+        (np.full(len(hits), LANGUAGE_WEIGHT, dtype=np.float32),
+         ([i for i, _ in hits], [j for _, j in hits])),
+        shape=(len(rows), len(languages)))
+    ratings = np.array([[(row[5] or 0.0) / 5.0 * RATING_WEIGHT] for row in rows], dtype=np.float32)
+    features = sp.hstack([text, language, sp.csr_matrix(ratings)], format='csr')
+    # Unit rows, so a dot product is the cosine similarity
+    return normalize(features, copy=False)
+
+
+class ContentModel:
+    def __init__(self, vectorizer, languages, matrix, book_ids, signatures, version):
+        self.vectorizer = vectorizer
+        self.languages = languages
+        self.matrix = matrix
+        self.book_ids = book_ids
+        self.signatures = signatures
+        self.version = version
+        self.rows = {book_id: row for row, book_id in enumerate(book_ids.tolist())}
+
+    @classmethod
+    def build(cls):
+        with connection() as conn:
+            if conn.execute('SELECT 1 FROM books LIMIT 1').fetchone() is None:
+                return None
+        vectorizer = TfidfVectorizer(sublinear_tf=True, min_df=1, dtype=np.float32)
+        vectorizer.fit(_document(row) for rows in _catalog_chunks() for row in rows)
+        with connection() as conn:
+            languages = [row[0] for row in conn.execute('''
+            SELECT DISTINCT language_code FROM books WHERE language_code IS NOT NULL ORDER BY language_code
+            ''')]
+        blocks, ids, signatures = [], [], []
+        for rows in _catalog_chunks():
+            blocks.append(_vectorize(vectorizer, languages, rows))
+            ids.extend(row[0] for row in rows)
+            signatures.extend(_signature(row) for row in rows)
+        return cls(vectorizer, languages, sp.vstack(blocks, format='csr'), np.asarray(ids, dtype=np.int64),
+                   np.asarray(signatures, dtype=np.int64), _catalog_version())
+
+    def refreshed(self):
+        # Re-vectorize only rows whose content changed; the vocabulary stays fixed until a full refit
+        ids, signatures, fresh_rows = [], [], []
+        for rows in _catalog_chunks():
+            for row in rows:
+                signature = _signature(row)
+                ids.append(row[0])
+                signatures.append(signature)
+                current = self.rows.get(row[0])
+                if current is None or self.signatures[current] != signature:
+                    fresh_rows.append(row)
+        removed = len(set(self.rows) - set(ids))
+        if len(fresh_rows) + removed > REFIT_FRACTION * max(len(ids), 1):
+            return ContentModel.build()
+        fresh_ids = {row[0] for row in fresh_rows}
+        kept = [book_id for book_id in ids if book_id not in fresh_ids]
+        parts = [self.matrix[[self.rows[book_id] for book_id in kept]]]
+        if fresh_rows:
+            parts.append(_vectorize(self.vectorizer, self.languages, fresh_rows))
+        order = kept + [row[0] for row in fresh_rows]
+        signature_of = dict(zip(ids, signatures))
+        return ContentModel(self.vectorizer, self.languages, sp.vstack(parts, format='csr'),
+                            np.asarray(order, dtype=np.int64),
+                            np.asarray([signature_of[book_id] for book_id in order], dtype=np.int64),
+                            _catalog_version())
+
+    def top_k(self, query, k, exclude=()):
+        excluded = {self.rows[book_id] for book_id in exclude if book_id in self.rows}
+        best_rows, best_scores = [], []
+        for start in range(0, self.matrix.shape[0], BLOCK_SIZE):
+            scores = cosine_similarity(query, self.matrix[start:start + BLOCK_SIZE]).ravel()
+            for row in excluded:
+                if start <= row < start + len(scores):
+                    scores[row - start] = -np.inf
+            keep = min(k, len(scores))
+            candidates = np.argpartition(-scores, keep - 1)[:keep]
+            best_rows.append(candidates + start)
+            best_scores.append(scores[candidates])
+        if not best_rows:
+            return []
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [(int(self.book_ids[rows[i]]), float(scores[i])) for i in order if np.isfinite(scores[i])]
+
+    def save(self, directory=MODEL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'content_model.pkl')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'vectorizer': self.vectorizer, 'languages': self.languages, 'matrix': self.matrix,
+                         'book_ids': self.book_ids, 'signatures': self.signatures, 'version': self.version},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory=MODEL_DIR):
+        try:
+            with open(os.path.join(directory, 'content_model.pkl'), 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(state['vectorizer'], state['languages'], state['matrix'], state['book_ids'],
+                   state['signatures'], state['version'])
+
+
+def refresh_model():
+    global _model
+    with _refresh_lock:
+        current = _model or ContentModel.load()
+        if current is None:
+            model = ContentModel.build()
+        elif current.version == _catalog_version():
+            model = current
+        else:
+            model = current.refreshed()
+        if model is not None and model is not current:
+            model.save()
+        _model = model
+    return model
+
+
+def refresh_model_in_background():
+    threading.Thread(target=refresh_model, name='similar-books-refresh', daemon=True).start()
+
+
+def get_model():
+    if _model is None:
+        refresh_model()
+    return _model
+
+
+def similar_to_book(book_id, k=10):
+    model = get_model()
+    if model is None or book_id not in model.rows:
+        return []
+    query = model.matrix[model.rows[book_id]]
+    return model.top_k(query, k, exclude=(book_id,))
+
+
+def similar_to_books(book_ids, k=10):
+    model = get_model()
+    if model is None:
+        return []
+    rows = [model.rows[book_id] for book_id in book_ids if book_id in model.rows]
+    if not rows:
+        return []
+    profile = sp.csr_matrix(model.matrix[rows].mean(axis=0))
+    return model.top_k(profile, k, exclude=book_ids)
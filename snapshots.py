@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+
+import db
+from db import transaction
+
+SNAPSHOT_DIR = os.environ.get('BOOKHIVE_SNAPSHOT_DIR', 'snapshots')
+BATCH_SIZE = 50000
+MANIFEST = 'manifest.json'
+BOOKS_FILE = 'books.arrow'
+LOANS_DIR = 'loans'
+# Hive's name for a NULL partition value; pyarrow reads it back as null
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+BOOK_SCHEMA = pa.schema([
+    ('bookID', pa.int64()),
+    ('title', pa.string()),
+    ('authors', pa.string()),
+    ('average_rating', pa.float64()),
+    ('language_code', pa.string()),
+    ('ratings_count', pa.int64()),
+    ('publisher', pa.string()),
+    ('copies', pa.int64()),
+    ('available_copies', pa.int64()),
+])
+LOAN_SCHEMA = pa.schema([
+    ('loan_id', pa.int64()),
+    ('student_id', pa.string()),
+    ('book_id', pa.int64()),
+    ('loan_date', pa.date32()),
+    ('return_date', pa.date32()),
+])
+PARTITIONING = ds.partitioning(pa.schema([('loan_month', pa.string())]), flavor='hive')
+
+_refresh_lock = threading.Lock()
+
+
+def _batches(cursor, schema):
+    # Rows go straight from fetchmany into Arrow columns; no per-row Python objects survive a batch
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(schema, columns):
+            if pa.types.is_date32(field.type):
+                parsed = pc.strptime(pa.array(values, pa.string()), format='%Y-%m-%d', unit='s', error_is_null=True)
+                arrays.append(parsed.cast(pa.date32()))
+            else:
+                arrays.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _write_ipc(path, schema, batches):
+    # Uncompressed IPC files can be memory-mapped and read without copying
+    tmp = f'{path}.tmp'
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+
+
+def _loan_fingerprints(conn):
+    # One aggregate per month: any new, returned, edited or deleted loan changes its month's row
+    rows = conn.execute('''
+    SELECT substr(loan_date, 1, 7) AS month, COUNT(*), SUM(loan_id), COUNT(return_date),
+           TOTAL(julianday(return_date)), TOTAL(book_id)
+    FROM book_loans
+    GROUP BY month
+    ''').fetchall()
+    return {month or NULL_PARTITION: list(fingerprint) for month, *fingerprint in rows}
+
+
+def _loan_rows(conn, month):
+    columns = 'SELECT loan_id, CAST(student_id AS TEXT), book_id, loan_date, return_date FROM book_loans'
+    if month == NULL_PARTITION:
+        return conn.execute(f'{columns} WHERE loan_date IS NULL ORDER BY loan_id')
+    # Prefix range on the loan_date index: '2024-03' <= day < '2024-03~'
+    return conn.execute(f'{columns} WHERE loan_date >= ? AND loan_date < ? ORDER BY loan_id', (month, month + '~'))
+
+
+def read_manifest(directory=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def refresh(directory=SNAPSHOT_DIR):
+    # The catalog is rewritten whole; loan months are rewritten only when their fingerprint
+    # changed, so a nightly refresh appends the new month and touches little else.
+    with _refresh_lock:
+        manifest = read_manifest(directory) or {}
+        previous = manifest.get('loan_partitions', {})
+        loans_dir = os.path.join(directory, LOANS_DIR)
+        os.makedirs(loans_dir, exist_ok=True)
+        written = 0
+        # One read transaction, so the catalog and every partition come from the same database state
+        with transaction(immediate=False) as conn:
+            books = conn.execute(f'SELECT {", ".join(BOOK_SCHEMA.names)} FROM books ORDER BY bookID')
+            _write_ipc(os.path.join(directory, BOOKS_FILE), BOOK_SCHEMA, _batches(books, BOOK_SCHEMA))
+            book_rows = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+            fingerprints = _loan_fingerprints(conn)
+            for month, fingerprint in fingerprints.items():
+                if previous.get(month) == fingerprint:
+                    continue
+                partition = os.path.join(loans_dir, f'loan_month={month}')
+                os.makedirs(partition, exist_ok=True)
+                _write_ipc(os.path.join(partition, 'part-0.arrow'), LOAN_SCHEMA,
+                           _batches(_loan_rows(conn, month), LOAN_SCHEMA))
+                written += 1
+        removed = [month for month in previous if month not in fingerprints]
+        for month in removed:
+            shutil.rmtree(os.path.join(loans_dir, f'loan_month={month}'), ignore_errors=True)
+        manifest = {
+            'taken_at': datetime.now().isoformat(timespec='seconds'),
+            'database': db.database_path(),
+            'books': book_rows,
+            'loans': sum(fingerprint[0] for fingerprint in fingerprints.values()),
+            'loan_partitions': fingerprints,
+        }
+        tmp = os.path.join(directory, f'{MANIFEST}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+    return {'partitions': len(fingerprints), 'written': written, 'removed': len(removed),
+            'books': book_rows, 'loans': manifest['loans']}
+
+
+def _filesystem():
+    return LocalFileSystem(use_mmap=True)
+
+
+def books_dataset(directory=SNAPSHOT_DIR):
+    return ds.dataset(os.path.abspath(os.path.join(directory, BOOKS_FILE)), format='ipc', filesystem=_filesystem())
+
+
+def loans_dataset(directory=SNAPSHOT_DIR):
+    return ds.dataset(os.path.abspath(os.path.join(directory, LOANS_DIR)), format='ipc',
+                      partitioning=PARTITIONING, filesystem=_filesystem())
+
+
+def load_books(columns=None, filter=None, directory=SNAPSHOT_DIR):
+    # Projected columns are views onto the mapped file; only a filter materialises new arrays
+    return books_dataset(directory).to_table(columns=columns, filter=filter)
+
+
+def _day(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def loan_filter(start=None, end=None):
+    # The loan_month terms prune whole partitions before any file is opened
+    terms = []
+    if start is not None:
+        start = _day(start)
+        terms += [ds.field('loan_month') >= start.strftime('%Y-%m'), ds.field('loan_date') >= start]
+    if end is not None:
+        end = _day(end)
+        terms += [ds.field('loan_month') <= end.strftime('%Y-%m'), ds.field('loan_date') <= end]
+    expression = None
+    for term in terms:
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def load_loans(columns=None, start=None, end=None, filter=None, directory=SNAPSHOT_DIR):
+    expression = loan_filter(start, end)
+    if filter is not None:
+        expression = filter if expression is None else expression & filter
+    return loans_dataset(directory).to_table(columns=columns, filter=expression)
+
+
+def top_books(start=None, end=None, n=10, directory=SNAPSHOT_DIR):
+    loans = load_loans(['book_id'], start, end, directory=directory)
+    counts = loans.group_by('book_id').aggregate([('book_id', 'count')]).rename_columns({'book_id_count': 'loans'})
+    counts = counts.sort_by([('loans', 'descending'), ('book_id', 'ascending')]).slice(0, n)
+    books = load_books(['bookID', 'title', 'authors'], ds.field('bookID').isin(counts['book_id']), directory)
+    top = counts.join(books, 'book_id', 'bookID').sort_by([('loans', 'descending'), ('book_id', 'ascending')])
+    return top.select(['book_id', 'title', 'authors', 'loans']).to_pandas()
+
+
+def monthly_activity(start=None, end=None, directory=SNAPSHOT_DIR):
+    loans = load_loans(['loan_month', 'loan_date', 'return_date'], start, end, directory=directory)
+    loans = loans.append_column('days_out', pc.days_between(loans['loan_date'], loans['return_date']))
+    monthly = loans.group_by('loan_month').aggregate([
+        ('loan_date', 'count'), ('return_date', 'count'), ('days_out', 'mean')])
+    monthly = monthly.rename_columns({'loan_month': 'month', 'loan_date_count': 'loans', 'return_date_count': 'returned', 'days_out_mean': 'mean_days_out'}).sort_by('month')
+    return monthly.select(['month', 'loans', 'returned', 'mean_days_out']).to_pandas()
+
+
+def language_share(start=None, end=None, directory=SNAPSHOT_DIR):
+    loans = load_loans(['book_id'], start, end, directory=directory)
+    books = load_books(['bookID', 'language_code'], directory=directory)
+    joined = loans.join(books, 'book_id', 'bookID')
+    share = joined.group_by('language_code').aggregate([('book_id', 'count')]).rename_columns({'book_id_count': 'loans'})
+    return share.sort_by([('loans', 'descending')]).select(['language_code', 'loans']).to_pandas()
+
+
+def export_parquet(destination, directory=SNAPSHOT_DIR):
+    # Compressed copies for tools outside the app; the IPC files stay the fast local format
+    os.makedirs(destination, exist_ok=True)
+    pq.write_table(load_books(directory=directory), os.path.join(destination, 'books.parquet'))
+    ds.write_dataset(loans_dataset(directory), os.path.join(destination, LOANS_DIR), format='parquet',
+                     partitioning=PARTITIONING, existing_data_behavior='delete_matching')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh the Arrow snapshot of the catalog and loan history.')
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help='snapshot directory')
+    parser.add_argument('--parquet', help='also export the snapshot as Parquet to this directory')
+    parser.add_argument('--report', action='store_true', help='print the offline reports after refreshing')
+    args = parser.parse_args()
+    db.configure(args.db)
+    result = refresh(args.dir)
+    print(f"{result['books']} books, {result['loans']} loans in {result['partitions']} monthly partitions "
+          f"({result['written']} rewritten, {result['removed']} removed)")
+    if args.parquet:
+        export_parquet(args.parquet, args.dir)
+    if args.report:
+        print(monthly_activity(directory=args.dir).to_string(index=False))
+        print(top_books(directory=args.dir).to_string(index=False))
+        print(language_share(directory=args.dir).to_string(index=False))
@@ -0,0 +1,151 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+from query_cache import bump
+
+# How long the writer keeps collecting requests after the first one arrives, and the most
+# it puts in one commit
+GROUP_WINDOW_MS = float(os.environ.get('BOOKHIVE_GROUP_WINDOW_MS', 2))
+MAX_GROUP = int(os.environ.get('BOOKHIVE_MAX_GROUP', 256))
+# What a resolved future promises. 'full' fsyncs the WAL at every group commit and survives
+# power loss; 'normal' (the pool default) survives application crashes; 'off' leaves
+# syncing to the OS.
+DURABILITY = os.environ.get('BOOKHIVE_WRITE_DURABILITY', 'normal')
+SYNCHRONOUS = {'full': 'FULL', 'normal': 'NORMAL', 'off': 'OFF'}
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    # One thread owns the write path: concurrent submissions are applied back to back in a
+    # single transaction, each inside its own savepoint, and every caller's future is
+    # resolved once that transaction has committed.
+    def __init__(self, window_ms=GROUP_WINDOW_MS, max_group=MAX_GROUP, durability=DURABILITY):
+        if durability not in SYNCHRONOUS:
+            raise ValueError(f"Unknown durability {durability!r}; expected one of {', '.join(SYNCHRONOUS)}")
+        self.window = window_ms / 1000
+        self.max_group = max_group
+        self.durability = durability
+        self.pool = db.get_pool()
+        self.stats = {'groups': 0, 'writes': 0, 'largest_group': 0, 'failed_groups': 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='bookhive-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, tables=()):
+        # func(conn, *args) runs on the writer thread inside the group's transaction;
+        # `tables` are bumped once per group, if the request changed any rows, so cached
+        # reads see the writes
+        future = Future()
+        self._queue.put((func, args, tables, future))
+        return future
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        group = [first]
+        deadline = time.perf_counter() + self.window
+        while len(group) < self.max_group:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            group.append(item)
+        return group
+
+    def _commit(self, conn, group):
+        outcomes, tables = [], set()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for func, args, item_tables, future in group:
+                # A failing request rolls back only its own changes
+                conn.execute('SAVEPOINT group_item')
+                changes = conn.total_changes
+                try:
+                    outcomes.append((future, func(conn, *args), None))
+                    # A request that was refused or found nothing to do leaves cached reads valid
+                    if conn.total_changes > changes:
+                        tables.update(item_tables)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO group_item')
+                    outcomes.append((future, None, e))
+                conn.execute('RELEASE group_item')
+            if tables:
+                bump(*sorted(tables))
+            conn.commit()
+        except Exception as e:
+            # The commit itself failed: nothing in the group was written
+            if conn.in_transaction:
+                conn.rollback()
+            self.stats['failed_groups'] += 1
+            for _, _, _, future in group:
+                future.set_exception(e)
+            return
+        self.stats['groups'] += 1
+        self.stats['writes'] += len(group)
+        self.stats['largest_group'] = max(self.stats['largest_group'], len(group))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _run(self):
+        # The writer keeps one connection from its pool for its lifetime, at the chosen durability
+        with self.pool.connection() as conn:
+            default = conn.execute('PRAGMA synchronous').fetchone()[0]
+            conn.execute(f'PRAGMA synchronous = {SYNCHRONOUS[self.durability]}')
+            try:
+                while True:
+                    first = self._queue.get()
+                    if first is _STOP:
+                        return
+                    self._commit(conn, self._collect(first))
+            finally:
+                conn.execute(f'PRAGMA synchronous = {default}')
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start(window_ms=GROUP_WINDOW_MS, max_group=MAX_GROUP, durability=DURABILITY):
+    # Replaces the running writer, if any, with one using these settings
+    global _writer
+    writer = GroupCommitWriter(window_ms, max_group, durability)
+    with _writer_lock:
+        previous, _writer = _writer, writer
+    if previous is not None:
+        previous.close()
+    return writer
+
+
+def get_writer():
+    # One writer per connection pool; db.configure() starts a fresh one
+    with _writer_lock:
+        writer = _writer
+    if writer is None or writer.pool is not db.get_pool():
+        writer = start()
+    return writer
+
+
+def shutdown():
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(shutdown)